@@ -5,6 +5,77 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "AI Comic Generator"
     API_V1_STR: str = "/api/v1"
     DATABASE_URL: str = "sqlite:///./comic_app.db"
+
+    # SQLite tuning applied on every new connection (WAL lets readers run alongside the writer,
+    # synchronous=NORMAL only fsyncs at checkpoints, busy_timeout waits for the write lock
+    # instead of failing with "database is locked"). Ignored for other databases.
+    SQLITE_TUNING: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL" # OFF, NORMAL, FULL
+    SQLITE_BUSY_TIMEOUT_MS: int = 10000
+    SQLITE_MMAP_SIZE_MB: int = 256
+    SQLITE_CACHE_SIZE_MB: int = 64
+    # Connection pool (background threads each hold a connection while they commit)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 3600
+
+    # Max number of panels rendered at once by "generate all" (1 = sequential)
+    IMAGE_GENERATION_CONCURRENCY: int = 1
+    # Max number of character sheets rendered at once (no ordering dependency)
+    CHARACTER_GENERATION_CONCURRENCY: int = 4
+
+    # Opt-in per-provider request quota shared by all generation calls, text and image
+    # (0 = unlimited). Set it to the provider's quota, e.g. 20
+    PROVIDER_REQUESTS_PER_MINUTE: int = 0
+    PROVIDER_RATE_LIMIT_BURST: int = 4
+
+    # Task log lines are buffered in memory and written to TaskLog in batches
+    TASK_LOG_FLUSH_INTERVAL_SECONDS: float = 0.5
+    TASK_LOG_FLUSH_SIZE: int = 50
+
+    # Run model calls as AsyncAIService coroutines on one shared event loop instead of one
+    # thread per in-flight image. Single panel/character tasks then run on that loop entirely
+    # (DB and file work in worker threads); batch tasks keep one thread for their orchestration
+    ASYNC_GENERATION: bool = False
+    # Stream the storyboard response and save each JSON block as soon as it is complete
+    STORYBOARD_STREAMING: bool = False
+
+    # Durable task queue: tasks are stored in the DB and run by `python -m app.worker`
+    # processes instead of the API process's BackgroundTasks
+    TASK_QUEUE_ENABLED: bool = False
+    TASK_LEASE_SECONDS: int = 60
+    TASK_MAX_ATTEMPTS: int = 3
+    WORKER_POLL_INTERVAL_SECONDS: float = 1.0
+
+    # Opt-in disk cache of generation results keyed by model, prompt, context image
+    # contents and image config; identical requests are answered without a model call
+    RESULT_CACHE_ENABLED: bool = False
+    RESULT_CACHE_DIR: str = "./cache/results"
+    RESULT_CACHE_MAX_MB: int = 1024
+
+    # Model config writes touch this file so other processes only re-read the config version
+    # row once it changed ("" = next to the SQLite database; other databases check the row on
+    # every lookup). The row is also re-read while the stamp is younger than the settle window,
+    # which covers a writer that committed but died before its final touch
+    CONFIG_VERSION_STAMP_PATH: str = ""
+    CONFIG_STAMP_SETTLE_SECONDS: float = 5.0
+
+    # In-memory LRU of encoded context images (character sheets, history panels)
+    CONTEXT_IMAGE_CACHE_MB: int = 256
+    # Context images are downscaled and re-encoded before upload (0 / "ORIGINAL" = send as stored)
+    CONTEXT_IMAGE_MAX_EDGE: int = 1536
+    CONTEXT_IMAGE_FORMAT: str = "JPEG" # JPEG, WEBP, PNG or ORIGINAL
+    CONTEXT_IMAGE_QUALITY: int = 90
+    
+    # Serialized GET /projects/{id} responses, keyed by the project's version counter
+    PROJECT_READ_CACHE_MB: int = 64
+    
+    # Processes used to split export pages into panels (0 = one per CPU)
+    EXPORT_SPLIT_WORKERS: int = 0
+    # An in-process export task that has not reported progress for this long is considered dead
+    # (its process restarted) and replaced by the next export request
+    EXPORT_TASK_STALE_SECONDS: int = 120
     
     class Config:
         env_file = ".env"
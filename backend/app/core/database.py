@@ -1,14 +1,94 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import make_url
 from app.core.config import settings
 
-connect_args = {}
-if "sqlite" in settings.DATABASE_URL:
-    connect_args["check_same_thread"] = False
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB) * 1024 * 1024}")
+    # Negative cache_size is in KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_MB) * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
-engine = create_engine(settings.DATABASE_URL, echo=False, connect_args=connect_args)
+def create_db_engine(database_url: str, sqlite_tuning: bool = None):
+    """
+    Creates the engine for `database_url`. SQLite files get the SQLITE_* pragmas on
+    connect (unless sqlite_tuning is False); every non in-memory database gets a sized
+    connection pool.
+    """
+    if sqlite_tuning is None:
+        sqlite_tuning = settings.SQLITE_TUNING
+    url = make_url(database_url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    in_memory = is_sqlite and url.database in (None, "", ":memory:")
+
+    connect_args = {}
+    engine_args = {}
+    if is_sqlite:
+        connect_args["check_same_thread"] = False
+        if sqlite_tuning:
+            # The driver's own busy handler, in seconds (also covers the connect itself)
+            connect_args["timeout"] = settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+    if not in_memory:
+        engine_args.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+            pool_pre_ping=not is_sqlite,
+        )
+
+    db_engine = create_engine(database_url, echo=False, connect_args=connect_args, **engine_args)
+    if is_sqlite and sqlite_tuning and not in_memory:
+        event.listen(db_engine, "connect", apply_sqlite_pragmas)
+    return db_engine
+
+engine = create_db_engine(settings.DATABASE_URL)
+
+def migrate_db():
+    """
+    Adds columns and indexes introduced after a table was first created to existing databases
+    (create_all only creates missing tables, it never alters existing ones).
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.default is not None and column.default.is_scalar and isinstance(column.default.arg, (int, float, str)):
+                    default = column.default.arg
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+                conn.execute(text(ddl))
+            # CREATE INDEX IF NOT EXISTS (may take a moment once on a large database)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def seed_db():
+    """Rows the app expects to exist: the ModelConfigVersion counter (id=1)."""
+    from app.models.models import ModelConfigVersion
+    with Session(engine) as session:
+        if session.get(ModelConfigVersion, 1) is None:
+            session.add(ModelConfigVersion(id=1, version=0))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another process seeded it first
+                session.rollback()
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    migrate_db()
+    seed_db()
 
 def get_session():
     with Session(engine) as session:
@@ -1,12 +1,120 @@
 from sqlmodel import Session, select
-from app.models.models import ModelConfig
+from sqlalchemy import update
+from sqlalchemy.engine import make_url
+from app.core.config import settings
+from app.models.models import ModelConfig, ModelConfigVersion
 from app.schemas.schemas import ModelConfigCreate, ModelConfigUpdate
-from typing import List, Optional
+from typing import List, Optional, Dict
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def config_stamp_path() -> Optional[str]:
+    """File touched by every model config write, or None when there is no shared file to use."""
+    if settings.CONFIG_VERSION_STAMP_PATH:
+        return settings.CONFIG_VERSION_STAMP_PATH
+    url = make_url(settings.DATABASE_URL)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        return f"{url.database}.config-version"
+    return None
+
+_stamp_path = config_stamp_path()
+
+def read_config_stamp() -> Optional[int]:
+    """mtime of the stamp file in ns (0 if no write has touched it yet), None if unknown."""
+    if not _stamp_path:
+        return None
+    try:
+        return os.stat(_stamp_path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+    except OSError:
+        return None
+
+def touch_config_stamp():
+    if not _stamp_path:
+        return
+    try:
+        with open(_stamp_path, "a"):
+            pass
+        os.utime(_stamp_path)
+    except OSError as e:
+        logger.warning("Could not touch config version stamp %s: %s", _stamp_path, e)
+
+class ActiveConfigCache:
+    """
+    In-process cache of active ModelConfig rows per model_type.
+    Local writes invalidate it immediately; writes from other processes are picked up
+    through the ModelConfigVersion row. That row is only re-read when the stamp file changed
+    (an os.stat instead of a SELECT per lookup) or is still younger than the settle window,
+    so a revoked key is never served after the write that revoked it has committed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version: Optional[int] = None
+        self.stamp: Optional[int] = None
+        self.configs: Dict[str, Optional[ModelConfig]] = {}
+
+    def current_version(self, session: Session) -> int:
+        stamp = read_config_stamp()
+        # A recent stamp may belong to a write that has not committed yet (or whose final
+        # touch never happened), so the row is checked until the stamp has settled
+        settled = stamp is not None and time.time_ns() - stamp >= settings.CONFIG_STAMP_SETTLE_SECONDS * 1e9
+        if settled:
+            with self.lock:
+                if self.version is not None and self.stamp == stamp:
+                    return self.version
+
+        # A column select always hits the database (session.get could answer from the identity map)
+        version = session.exec(select(ModelConfigVersion.version).where(ModelConfigVersion.id == 1)).first() or 0
+        with self.lock:
+            if version != self.version:
+                self.configs.clear()
+            self.version = version
+            self.stamp = stamp if settled else None
+        return version
+
+    def get(self, model_type: str, version: int):
+        with self.lock:
+            if self.version == version and model_type in self.configs:
+                return True, self.configs[model_type]
+        return False, None
+
+    def put(self, model_type: str, version: int, config: Optional[ModelConfig]):
+        with self.lock:
+            # A concurrent invalidation changes self.version, so a stale read is never stored
+            if self.version == version:
+                self.configs[model_type] = config
+
+    def invalidate(self):
+        with self.lock:
+            self.version = None
+            self.stamp = None
+            self.configs.clear()
+
+_active_config_cache = ActiveConfigCache()
+
+def _bump_config_version(session: Session):
+    # Runs inside the caller's transaction so the version only moves if the write commits.
+    # The row itself is seeded by init_db, so concurrent first writes never race to insert it
+    session.exec(update(ModelConfigVersion).where(ModelConfigVersion.id == 1).values(version=ModelConfigVersion.version + 1))
+    # Touched before the commit (readers keep checking the row while it is recent) and again
+    # after it by _commit_config_write
+    touch_config_stamp()
+
+def _commit_config_write(session: Session):
+    session.commit()
+    touch_config_stamp()
+    _active_config_cache.invalidate()
 
 def create_model_config(session: Session, config_in: ModelConfigCreate) -> ModelConfig:
     db_config = ModelConfig.model_validate(config_in)
     session.add(db_config)
-    session.commit()
+    _bump_config_version(session)
+    _commit_config_write(session)
     session.refresh(db_config)
     return db_config
 
@@ -22,14 +130,26 @@ def update_model_config(session: Session, db_config: ModelConfig, config_in: Mod
     for key, value in config_data.items():
         setattr(db_config, key, value)
     session.add(db_config)
-    session.commit()
+    _bump_config_version(session)
+    _commit_config_write(session)
     session.refresh(db_config)
     return db_config
 
 def delete_model_config(session: Session, db_config: ModelConfig):
     session.delete(db_config)
-    session.commit()
+    _bump_config_version(session)
+    _commit_config_write(session)
 
 def get_active_config(session: Session, model_type: str) -> Optional[ModelConfig]:
-    statement = select(ModelConfig).where(ModelConfig.model_type == model_type, ModelConfig.is_active == True)
-    return session.exec(statement).first()
+    version = _active_config_cache.current_version(session)
+    found, config = _active_config_cache.get(model_type, version)
+    if found:
+        return config
+    
+    # populate_existing: a long-lived session may still hold the row as it was before the write
+    statement = select(ModelConfig).where(ModelConfig.model_type == model_type, ModelConfig.is_active == True).execution_options(populate_existing=True)
+    row = session.exec(statement).first()
+    # Cache a detached copy so it can be shared across sessions and threads
+    config = ModelConfig.model_validate(row) if row else None
+    _active_config_cache.put(model_type, version, config)
+    return config
@@ -1,7 +1,11 @@
+import hashlib
+import json
+from sqlalchemy import event, func, insert, update, delete
+from sqlalchemy.orm import defer, load_only, noload, selectinload
 from sqlmodel import Session, select
 from app.models.models import Project, Character, StoryboardItem, GlobalConfig
 from app.schemas.schemas import ProjectCreate, ProjectUpdate
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 def create_project(session: Session, project_in: ProjectCreate) -> Project:
     db_project = Project.model_validate(project_in)
@@ -14,9 +18,110 @@ def get_projects(session: Session, skip: int = 0, limit: int = 100) -> List[Proj
     statement = select(Project).offset(skip).limit(limit).order_by(Project.updated_at.desc())
     return session.exec(statement).all()
 
+def _first_images(session: Session, model, order_column, project_ids: List[str]) -> Dict[str, str]:
+    """project_id -> image_url of the first row (by order_column) that has an image."""
+    first = select(model.project_id, func.min(order_column).label("first")).where(
+        model.project_id.in_(project_ids), model.image_url.is_not(None)
+    ).group_by(model.project_id).subquery()
+    statement = select(model.project_id, model.image_url).join(
+        first, (model.project_id == first.c.project_id) & (order_column == first.c.first)
+    )
+    return dict(session.exec(statement).all())
+
+def _counts(session: Session, model, project_ids: List[str]) -> Dict[str, int]:
+    statement = select(model.project_id, func.count()).where(model.project_id.in_(project_ids)).group_by(model.project_id)
+    return dict(session.exec(statement).all())
+
+def get_project_summaries(session: Session, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Project list for the dashboard: metadata plus character / panel counts and a thumbnail
+    (first rendered panel, else first character sheet), in a fixed five queries.
+    """
+    statement = select(Project).options(defer(Project.story_input)).offset(skip).limit(limit).order_by(Project.updated_at.desc())
+    projects = session.exec(statement).all()
+    ids = [project.id for project in projects]
+    if not ids:
+        return []
+    char_counts = _counts(session, Character, ids)
+    item_counts = _counts(session, StoryboardItem, ids)
+    panel_images = _first_images(session, StoryboardItem, StoryboardItem.sequence, ids)
+    char_images = _first_images(session, Character, Character.id, ids)
+    return [
+        {
+            **project.model_dump(exclude={"story_input", "version"}),
+            "character_count": char_counts.get(project.id, 0),
+            "storyboard_count": item_counts.get(project.id, 0),
+            "thumbnail_url": panel_images.get(project.id) or char_images.get(project.id),
+        }
+        for project in projects
+    ]
+
 def get_project(session: Session, project_id: str) -> Optional[Project]:
     return session.get(Project, project_id)
 
+PROJECT_RELATIONS = ("characters", "storyboard_items", "global_config")
+
+def get_project_with_relations(session: Session, project_id: str, relations: Optional[Dict[str, Optional[Set[str]]]] = None) -> Optional[Project]:
+    """
+    Loads the project with its relations in one query per relation (selectinload).
+    `relations` limits which ones are loaded ({name: None for all columns, or {columns}});
+    the others are not loaded at all. By default characters, storyboard items and config are loaded.
+    """
+    if relations is None:
+        relations = {name: None for name in PROJECT_RELATIONS}
+    options = []
+    for name in PROJECT_RELATIONS:
+        attr = getattr(Project, name)
+        if name not in relations:
+            options.append(noload(attr))
+        elif relations[name]:
+            target = attr.property.mapper.class_
+            options.append(selectinload(attr).load_only(*[getattr(target, column) for column in relations[name]]))
+        else:
+            options.append(selectinload(attr))
+    statement = select(Project).where(Project.id == project_id).options(*options)
+    return session.exec(statement).first()
+
+def get_storyboard_page(session: Session, project_id: str, start: int = 1, end: Optional[int] = None, limit: int = 100, columns: Optional[Set[str]] = None) -> Tuple[int, List[StoryboardItem]]:
+    """Storyboard items with start <= sequence <= end (at most `limit`), plus the project's total item count."""
+    statement = select(StoryboardItem).where(StoryboardItem.project_id == project_id, StoryboardItem.sequence >= start)
+    if end is not None:
+        statement = statement.where(StoryboardItem.sequence <= end)
+    if columns:
+        statement = statement.options(load_only(*[getattr(StoryboardItem, column) for column in columns]))
+    items = session.exec(statement.order_by(StoryboardItem.sequence).limit(limit)).all()
+    total = session.exec(select(func.count()).select_from(StoryboardItem).where(StoryboardItem.project_id == project_id)).one()
+    return total, items
+
+def get_project_version(session: Session, project_id: str) -> Optional[int]:
+    return session.exec(select(Project.version).where(Project.id == project_id)).first()
+
+# --- Project version ---
+# Every write to a project or its characters / storyboard items / config bumps Project.version
+# in the same transaction. ORM writes are picked up by the flush hook below; bulk statements
+# (which bypass the flush) call bump_project_version themselves.
+
+_VERSIONED_CHILDREN = (Character, StoryboardItem, GlobalConfig)
+
+def bump_project_version(session: Session, project_id: str):
+    session.exec(update(Project).where(Project.id == project_id).values(version=Project.version + 1))
+
+@event.listens_for(Session, "after_flush")
+def _bump_versions_on_flush(session, flush_context):
+    # new/dirty/deleted still show the pre-flush state here
+    project_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Project):
+            project_ids.add(obj.id)
+        elif isinstance(obj, _VERSIONED_CHILDREN) and obj.project_id:
+            project_ids.add(obj.project_id)
+    if project_ids:
+        session.connection().execute(
+            update(Project).where(Project.id.in_(project_ids)).values(version=Project.version + 1)
+        )
+
 def update_project(session: Session, db_project: Project, project_in: ProjectUpdate) -> Project:
     project_data = project_in.model_dump(exclude_unset=True)
     for key, value in project_data.items():
@@ -54,36 +159,166 @@ def save_characters(session: Session, project_id: str, characters_data: List[dic
     # But user might want to edit specific ones.
     # Better: Update by name match, create if new.
     
+    # One query for the whole cast; the first row wins if a name is duplicated
+    statement = select(Character).where(Character.project_id == project_id)
+    existing_by_name = {}
+    for char in session.exec(statement).all():
+        existing_by_name.setdefault(char.name, char)
+    
     results = []
+    new_rows = {}
     for char_data in characters_data:
         name = char_data.get("name")
         if not name: continue
         
-        statement = select(Character).where(Character.project_id == project_id, Character.name == name)
-        existing = session.exec(statement).first()
-        
+        existing = existing_by_name.get(name)
         if existing:
-            existing.data = char_data
-            session.add(existing)
-            results.append(existing)
+            if existing.data != char_data:
+                existing.data = char_data
         else:
-            new_char = Character(project_id=project_id, name=name, data=char_data)
-            session.add(new_char)
-            results.append(new_char)
-            
+            # Repeated names in one call update the pending insert, like the row-by-row version did
+            new_rows[name] = {"project_id": project_id, "name": name, "data": char_data}
+        results.append(name)
+        
+    # Updates are flushed as one executemany; inserts go out as one multi-row INSERT ... RETURNING
+    # (returned rows are matched back by name, so their order does not matter)
+    session.flush()
+    if new_rows:
+        inserted = session.scalars(insert(Character).returning(Character), list(new_rows.values())).all()
+        existing_by_name.update((char.name, char) for char in inserted)
+        bump_project_version(session, project_id)
     session.commit()
-    return results
+    return [existing_by_name[name] for name in results]
+
+def storyboard_content_hash(item_data: dict) -> str:
+    """Hash of a panel's content. meta_info.volume is left out: it shifts whenever panels are added or removed."""
+    data = dict(item_data)
+    if isinstance(data.get("meta_info"), dict):
+        data["meta_info"] = {k: v for k, v in data["meta_info"].items() if k != "volume"}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+    
+def merge_storyboard(session: Session, project_id: str, storyboard_data: List[dict]) -> Tuple[List[StoryboardItem], List[int]]:
+    """
+    Diff/merge save of the storyboard. Incoming blocks are matched to existing items by content
+    hash (preferring the same sequence), so unchanged panels keep their id and image. The rest of
+    the incoming blocks take over an unmatched item at the same sequence (content changes, image
+    cleared) or are inserted; leftover items are deleted. Everything is written in bulk statements.
 
-def save_storyboard(session: Session, project_id: str, storyboard_data: List[dict]) -> List[StoryboardItem]:
-    # Similar strategy: Clear and Re-insert is risky if we have images.
-    # But storyboard is sequential.
-    # Let's delete all and re-insert for now as "Regenerate JSON" usually means fresh start.
-    # IF the user is just editing JSON text, we replace everything.
+    Returns (items in sequence order, ids of the stale items: new, changed or never rendered).
+    """
+    statement = select(StoryboardItem).where(StoryboardItem.project_id == project_id).order_by(StoryboardItem.sequence)
+    existing_items = session.exec(statement).all()
+    by_hash = {}
+    for item in existing_items:
+        by_hash.setdefault(storyboard_content_hash(item.data), []).append(item)
+    
+    matched = {} # incoming index -> existing item
+    used = set()
+    hashes = [storyboard_content_hash(item_data) for item_data in storyboard_data]
+    for i, content_hash in enumerate(hashes):
+        candidates = [item for item in by_hash.get(content_hash, []) if item.id not in used]
+        if candidates:
+            item = next((c for c in candidates if c.sequence == i + 1), candidates[0])
+            matched[i] = item
+            used.add(item.id)
+    
+    by_sequence = {}
+    for item in existing_items:
+        by_sequence.setdefault(item.sequence, item)
+    
+    updates = []
+    changed = set()
+    inserts = {}
+    for i, item_data in enumerate(storyboard_data):
+        sequence = i + 1
+        item = matched.get(i)
+        if item:
+            if item.sequence != sequence:
+                updates.append({"id": item.id, "sequence": sequence})
+            continue
+        item = by_sequence.get(sequence)
+        if item and item.id not in used:
+            # Same slot, different content: keep the row (and its image history), drop the stale image
+            used.add(item.id)
+            matched[i] = item
+            updates.append({"id": item.id, "sequence": sequence, "data": item_data, "image_url": None})
+            changed.add(item.id)
+        else:
+            inserts[i] = {"project_id": project_id, "sequence": sequence, "data": item_data}
     
-    # Check if there are existing items with images we want to preserve?
-    # Ideally, we should try to map them back, but it's hard if sequence changes.
-    # For now: delete all items for this project and insert new.
+    leftovers = [item.id for item in existing_items if item.id not in used]
+    if leftovers:
+        session.execute(delete(StoryboardItem).where(StoryboardItem.id.in_(leftovers)))
+    if updates:
+        session.execute(update(StoryboardItem), updates)
+    if inserts:
+        inserted = session.scalars(insert(StoryboardItem).returning(StoryboardItem), list(inserts.values())).all()
+        # Sequences are unique among the inserted rows, so RETURNING order does not matter
+        by_new_sequence = {item.sequence: item for item in inserted}
+        for i in inserts:
+            matched[i] = by_new_sequence[i + 1]
+            changed.add(matched[i].id)
+    if leftovers or updates or inserts:
+        bump_project_version(session, project_id)
+    # Stale = new or changed, or kept but never rendered (read before commit expires the rows)
+    stale = [matched[i].id for i in range(len(storyboard_data)) if matched[i].id in changed or not matched[i].image_url]
+    session.commit()
+    
+    return [matched[i] for i in range(len(storyboard_data))], stale
+
+def storyboard_hash_index(session: Session, project_id: str) -> Dict[str, List[Tuple[int, int]]]:
+    """content hash -> [(id, sequence)] of the project's storyboard items, for upsert_storyboard_block."""
+    statement = select(StoryboardItem.id, StoryboardItem.sequence, StoryboardItem.data).where(
+        StoryboardItem.project_id == project_id
+    ).order_by(StoryboardItem.sequence)
+    index = {}
+    for item_id, sequence, data in session.exec(statement).all():
+        index.setdefault(storyboard_content_hash(data), []).append((item_id, sequence))
+    return index
+
+def upsert_storyboard_block(session: Session, project_id: str, sequence: int, item_data: dict, hash_index: Dict[str, List[Tuple[int, int]]]) -> StoryboardItem:
+    """
+    Saves a single storyboard block at `sequence` while a storyboard is still streaming in: an
+    unclaimed item with the same content (looked up in hash_index, built once by storyboard_hash_index)
+    is moved there and keeps its image, otherwise a new item is inserted. The claimed item is taken
+    out of hash_index. Other items are left alone; merge_storyboard reconciles them at the end.
+    """
+    candidates = hash_index.get(storyboard_content_hash(item_data))
+    if candidates:
+        index = next((k for k, (_, seq) in enumerate(candidates) if seq == sequence), 0)
+        item_id, old_sequence = candidates.pop(index)
+        if old_sequence != sequence:
+            session.execute(update(StoryboardItem).where(StoryboardItem.id == item_id).values(sequence=sequence))
+            bump_project_version(session, project_id)
+        item = session.get(StoryboardItem, item_id)
+    else:
+        item = session.scalars(insert(StoryboardItem).returning(StoryboardItem), [{"project_id": project_id, "sequence": sequence, "data": item_data}]).one()
+        bump_project_version(session, project_id)
+    session.commit()
+    return item
+
+def revert_streamed_storyboard(session: Session, project_id: str, original: Dict[int, int], inserted: List[int]):
+    """
+    Undoes upsert_storyboard_block writes of a stream that never reached merge_storyboard:
+    deletes the `inserted` items and moves the `original` ones ({id: sequence}) back.
+    """
+    statement = select(StoryboardItem.id, StoryboardItem.sequence).where(StoryboardItem.id.in_(list(original)))
+    updates = [{"id": item_id, "sequence": original[item_id]} for item_id, sequence in session.exec(statement).all() if sequence != original[item_id]]
+    if inserted:
+        session.execute(delete(StoryboardItem).where(StoryboardItem.id.in_(inserted)))
+    if updates:
+        session.execute(update(StoryboardItem), updates)
+    if inserted or updates:
+        bump_project_version(session, project_id)
+    session.commit()
+
+def save_storyboard(session: Session, project_id: str, storyboard_data: List[dict], merge: bool = True) -> List[StoryboardItem]:
+    # Regenerating usually reproduces most panels, and images are the expensive part:
+    # by default the new blocks are merged into the existing items (see merge_storyboard).
+    if merge:
+        return merge_storyboard(session, project_id, storyboard_data)[0]
     
+    # Fresh start: delete all items for this project and insert new.
     statement = select(StoryboardItem).where(StoryboardItem.project_id == project_id)
     existing_items = session.exec(statement).all()
     for item in existing_items:
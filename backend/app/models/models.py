@@ -1,5 +1,6 @@
 from typing import Optional, List, Dict, Any
 from sqlmodel import SQLModel, Field, Relationship, Column, JSON
+from sqlalchemy import Index
 from datetime import datetime
 import uuid
 
@@ -54,12 +55,21 @@ class ImageHistoryBase(SQLModel):
 # --- Table Models ---
 
 class ModelConfig(ModelConfigBase, table=True):
+    # Active config lookup by type
+    __table_args__ = (Index("ix_modelconfig_type_active", "model_type", "is_active"),)
     id: Optional[int] = Field(default=None, primary_key=True)
 
+class ModelConfigVersion(SQLModel, table=True):
+    # Single row bumped on every ModelConfig write; lets other worker processes drop their config cache
+    id: int = Field(default=1, primary_key=True)
+    version: int = 0
+
 class Project(ProjectBase, table=True):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True) # project list order
+    # Bumped by every write to the project or its characters / storyboard / config (see crud_project)
+    version: int = 0
     
     characters: List["Character"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete"})
     storyboard_items: List["StoryboardItem"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete"})
@@ -68,30 +78,57 @@ class Project(ProjectBase, table=True):
     image_history: List["ImageHistory"] = Relationship(back_populates="project", sa_relationship_kwargs={"cascade": "all, delete"})
 
 class Character(CharacterBase, table=True):
+    # save_characters / merge lookups by name within a project
+    __table_args__ = (Index("ix_character_project_name", "project_id", "name"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: str = Field(foreign_key="project.id")
     project: Project = Relationship(back_populates="characters")
 
 class StoryboardItem(StoryboardItemBase, table=True):
+    # Panels are always read per project in sequence order
+    __table_args__ = (Index("ix_storyboarditem_project_sequence", "project_id", "sequence"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: str = Field(foreign_key="project.id")
     project: Project = Relationship(back_populates="storyboard_items")
 
 class GlobalConfig(GlobalConfigBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: str = Field(foreign_key="project.id")
+    project_id: str = Field(foreign_key="project.id", index=True)
     project: Project = Relationship(back_populates="global_config")
 
 class Task(TaskBase, table=True):
+    # Task list per project, newest first
+    __table_args__ = (Index("ix_task_project_created", "project_id", "created_at"),)
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     project_id: str = Field(foreign_key="project.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Legacy inline log blob; new lines are appended to TaskLog instead
     logs: List[str] = Field(default=[], sa_column=Column(JSON))
     
+    # Durable queue: the function a worker runs for this task, and its lease
+    handler: Optional[str] = None
+    handler_args: List[Any] = Field(default=[], sa_column=Column(JSON))
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    attempts: int = 0
+    # Resumable batch runs: per-item state, e.g. {"panels": {"12": "done", "13": "failed"}}
+    checkpoint: Dict[str, Any] = Field(default={}, sa_column=Column(JSON))
+    
     project: Project = Relationship(back_populates="tasks")
+    log_entries: List["TaskLog"] = Relationship(back_populates="task", sa_relationship_kwargs={"cascade": "all, delete"})
+
+class TaskLog(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    task_id: str = Field(foreign_key="task.id", index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    message: str
+    
+    task: Task = Relationship(back_populates="log_entries")
 
 class ImageHistory(ImageHistoryBase, table=True):
+    # History of one character / panel, newest first
+    __table_args__ = (Index("ix_imagehistory_entity_created", "entity_type", "entity_id", "created_at"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: str = Field(foreign_key="project.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -5,12 +5,15 @@ from app.core.database import get_session
 from app.models.models import ModelConfig
 from app.schemas.schemas import ModelConfigCreate, ModelConfigUpdate
 from app.cruds import crud_config
+from app.services.ai_service import AIService
 
 router = APIRouter()
 
 @router.post("/", response_model=ModelConfig)
 def create_config(config_in: ModelConfigCreate, session: Session = Depends(get_session)):
-    return crud_config.create_model_config(session, config_in)
+    config = crud_config.create_model_config(session, config_in)
+    AIService.invalidate_client_cache()
+    return config
 
 @router.get("/", response_model=List[ModelConfig])
 def read_configs(skip: int = 0, limit: int = 100, session: Session = Depends(get_session)):
@@ -28,7 +31,9 @@ def update_config(config_id: int, config_in: ModelConfigUpdate, session: Session
     config = crud_config.get_model_config(session, config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Config not found")
-    return crud_config.update_model_config(session, config, config_in)
+    config = crud_config.update_model_config(session, config, config_in)
+    AIService.invalidate_client_cache()
+    return config
 
 @router.delete("/{config_id}")
 def delete_config(config_id: int, session: Session = Depends(get_session)):
@@ -36,4 +41,5 @@ def delete_config(config_id: int, session: Session = Depends(get_session)):
     if not config:
         raise HTTPException(status_code=404, detail="Config not found")
     crud_config.delete_model_config(session, config)
+    AIService.invalidate_client_cache()
     return {"ok": True}
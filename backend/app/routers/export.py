@@ -1,19 +1,25 @@
-import shutil
-import os
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
+import logging
+import traceback
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlmodel import Session, select
+from app.core.config import settings
 from app.core.database import get_session
-from app.models.models import Project
-from app.services.image_service import split_comic_page
+from app.models.models import Project, Task
+from app.services.export_archive import (
+    archive_path, load_manifest, collect_export_entries, is_up_to_date, iter_export_archive,
+    pages_to_split, split_pages_parallel, build_export_archive
+)
+from app.services.task_log_service import append_task_log
+from app.services.task_queue import dispatch_task
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.get("/{project_id}")
-def export_project(
-    project_id: str, 
-    split_images: bool = False,
-    session: Session = Depends(get_session)
-):
+def get_export_project(session: Session, project_id: str) -> Project:
     project = session.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -22,59 +28,163 @@ def export_project(
     has_images = any(item.image_url for item in project.storyboard_items) or any(c.image_url for c in project.characters)
     if not has_images:
         raise HTTPException(status_code=400, detail="No images generated yet. Cannot export.")
+    return project
+
+def archive_url(project_id: str, split_images: bool) -> str:
+    split = "true" if split_images else "false"
+    return f"{settings.API_V1_STR}/export/{project_id}/archive.zip?split_images={split}"
+
+def log_export_event(task_id: str, message: str):
+    logger.info(message)
+    try:
+        append_task_log(task_id, message)
+    except Exception as e:
+        logger.error(f"Failed to log task event: {e}")
+
+def export_project_task(task_id: str, project_id: str, split_images: bool):
+    """
+    Background export: splits the pages that changed since the last export across the process
+    pool (0-90% progress), then builds and caches the archive. The result holds its download URL.
+    """
+    logger.info(f"Starting export task: {task_id} for project: {project_id}")
+    from app.core.database import engine
+    with Session(engine) as session:
+        task = session.get(Task, task_id)
+        if not task: 
+            logger.error(f"Task {task_id} not found")
+            return
         
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    project_static_dir = os.path.join(base_dir, "static", project_id)
-    export_dir = os.path.join(project_static_dir, "export")
-    
-    if os.path.exists(export_dir):
-        shutil.rmtree(export_dir)
-    os.makedirs(export_dir)
-    
-    # Export Characters
-    chars_dir = os.path.join(export_dir, "characters")
-    os.makedirs(chars_dir)
-    for char in project.characters:
-        if char.image_url:
-            # Resolve absolute path from relative URL
-            # URL: /static/{project_id}/characters/xxx.png
-            # Path: backend/static/{project_id}/characters/xxx.png
-            # We can construct it directly if we know the structure, but let's parse url
-            rel_path = char.image_url.lstrip("/") # static/...
-            local_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
+        task.status = "processing"
+        task.updated_at = datetime.utcnow()
+        session.add(task)
+        session.commit()
+        
+        try:
+            project = session.get(Project, project_id)
+            manifest = load_manifest(project_id, split_images)
+            entries = collect_export_entries(project, manifest)
+            pages = pages_to_split(entries, manifest) if split_images else []
+            log_export_event(task_id, f"Exporting {len(entries)} images; {len(pages)} pages to split.")
+            
+            def on_progress(done, total):
+                task.progress = int(done / total * 90)
+                # Heartbeat for start_export_task
+                task.updated_at = datetime.utcnow()
+                session.add(task)
+                session.commit()
+                if done == total or done % 10 == 0:
+                    log_export_event(task_id, f"Split {done}/{total} pages.")
+            
+            split_results = split_pages_parallel(pages, on_progress) if pages else {}
+            log_export_event(task_id, "Writing export archive...")
+            build_export_archive(project_id, split_images, entries, manifest, split_results)
+            
+            task.status = "completed"
+            task.progress = 100
+            task.result = {"download_url": archive_url(project_id, split_images)}
+            session.add(task)
+            session.commit()
+            log_export_event(task_id, f"Export task {task_id} completed successfully.")
             
-            if os.path.exists(local_path):
-                shutil.copy(local_path, os.path.join(chars_dir, f"{char.name}.png"))
+        except Exception as e:
+            logger.error(f"Export task {task_id} failed: {e}")
+            traceback.print_exc()
+            task.status = "failed"
+            task.message = str(e)
+            session.add(task)
+            session.commit()
 
-    panels_dir = os.path.join(export_dir, "panels")
-    if split_images:
-        os.makedirs(panels_dir)
+def start_export_task(background_tasks: BackgroundTasks, session: Session, project_id: str) -> Task:
+    """
+    Dispatches a background split export, or returns the one already pending/running for the
+    project (only split exports run as tasks) so repeated requests do not split pages twice.
+    An in-process task whose process died (no progress for EXPORT_TASK_STALE_SECONDS) is
+    marked failed and replaced; queued ones are recovered by the worker lease instead.
+    """
+    statement = select(Task).where(
+        Task.project_id == project_id, Task.type == "export", Task.status.in_(["pending", "processing"])
+    ).order_by(Task.created_at.desc())
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.EXPORT_TASK_STALE_SECONDS)
+    tasks = session.exec(statement).all()
+    alive = [t for t in tasks if t.handler is not None or t.updated_at >= cutoff]
+    if len(alive) < len(tasks):
+        for task in tasks:
+            if task not in alive:
+                task.status = "failed"
+                task.message = "Export task stopped responding (was the server restarted?)"
+                session.add(task)
+        session.commit()
+    if alive:
+        return alive[0]
     
-    # Sort items
-    items = sorted(project.storyboard_items, key=lambda x: x.sequence)
+    task = Task(
+        type="export",
+        status="pending",
+        project_id=project_id,
+        name="Export Comic",
+        description="Splitting pages and building the export archive"
+    )
+    session.add(task)
+    session.commit()
+    session.refresh(task)
+    dispatch_task(background_tasks, session, task, export_project_task, project_id, True)
+    return task
+
+@router.get("/{project_id}")
+def export_project(
+    project_id: str, 
+    background_tasks: BackgroundTasks,
+    split_images: bool = False,
+    session: Session = Depends(get_session)
+):
+    """
+    Returns {"download_url"} right away when the archive can be streamed. Splitting pages is CPU
+    work, so a split export with pages left to split runs as a background export Task first and
+    also returns its {"task_id"}; the URL serves the cached archive once the task completes.
+    """
+    # Validates up front (so errors reach the dialog as JSON)
+    project = get_export_project(session, project_id)
+    response = {"download_url": archive_url(project_id, split_images)}
+    if not split_images:
+        return response
     
-    for item in items:
-        if item.image_url:
-            rel_path = item.image_url.lstrip("/")
-            local_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
-            
-            if os.path.exists(local_path):
-                shutil.copy(local_path, os.path.join(export_dir, f"comic_part_{item.sequence}.png"))
-                
-                if split_images:
-                    with open(local_path, "rb") as f:
-                        img_bytes = f.read()
-                    
-                    try:
-                        panels = split_comic_page(img_bytes)
-                        for idx, panel_bytes in enumerate(panels):
-                            p_name = f"panel_{item.sequence}_{idx+1}.png"
-                            with open(os.path.join(panels_dir, p_name), "wb") as f:
-                                f.write(panel_bytes)
-                    except Exception as e:
-                        print(f"Failed to split panel {item.id}: {e}")
-                        
-    zip_path_base = os.path.join(project_static_dir, "export_archive")
-    shutil.make_archive(zip_path_base, 'zip', export_dir)
+    manifest = load_manifest(project_id, split_images)
+    entries = collect_export_entries(project, manifest)
+    if is_up_to_date(manifest, entries) or not pages_to_split(entries, manifest):
+        return response
     
-    return {"download_url": f"/static/{project_id}/export_archive.zip"}
+    response["task_id"] = start_export_task(background_tasks, session, project_id).id
+    return response
+
+@router.get("/{project_id}/archive.zip")
+def download_export_archive(
+    project_id: str, 
+    background_tasks: BackgroundTasks,
+    split_images: bool = False,
+    session: Session = Depends(get_session)
+):
+    """
+    Serves the cached archive when its manifest still matches the project's images; otherwise
+    streams a rebuilt archive (reusing unchanged entries) and caches it for the next export.
+    Pages are never split on the request: while a split export has pages left to split, this
+    answers 202 with the background export task building the archive.
+    """
+    project = get_export_project(session, project_id)
+    manifest = load_manifest(project_id, split_images)
+    entries = collect_export_entries(project, manifest)
+    filename = f"{project.title or project_id}.zip"
+    headers = {"Content-Disposition": f"attachment; filename=\"export_archive.zip\"; filename*=UTF-8''{quote(filename)}"}
+    
+    if is_up_to_date(manifest, entries):
+        return FileResponse(archive_path(project_id, split_images), media_type="application/zip", headers=headers)
+    if split_images and pages_to_split(entries, manifest):
+        task = start_export_task(background_tasks, session, project_id)
+        return JSONResponse(
+            status_code=202,
+            content={"detail": "The export archive is still being built.", "task_id": task.id},
+            headers={"Retry-After": "2"}
+        )
+    return StreamingResponse(iter_export_archive(project_id, split_images, entries, manifest), media_type="application/zip", headers=headers)
+
+# Handlers a durable-queue worker may run (see task_queue.resolve_handler)
+QUEUE_HANDLERS = {export_project_task.__name__: export_project_task}
@@ -2,10 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlmodel import Session
 from app.core.database import get_session
 from app.models.models import Project, Character, StoryboardItem, Task, ImageHistory
-from app.services.ai_service import AIService
-from app.services.consistency_service import ConsistencyService
-from app.utils.json_utils import extract_json_blocks
+from app.services.ai_service import AIService, AsyncAIService
+from app.services.consistency_service import ConsistencyService, MASTER_META_DEFAULTS
+from app.services.generation_loop import generation_loop
+from app.services.task_log_service import append_task_log
+from app.services.task_queue import dispatch_task
+from app.utils.json_utils import extract_json_blocks, JsonBlockStreamExtractor
+from app.utils.name_matcher import NameMatcher
 from app.cruds import crud_project
+from app.core.config import settings
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional
+import asyncio
 import os
 import uuid
 import json
@@ -22,18 +30,8 @@ logger = logging.getLogger(__name__)
 def log_task_event(session, task_id, message):
     logger.info(message)
     try:
-        task = session.get(Task, task_id)
-        if task:
-            if task.logs is None:
-                task.logs = []
-            import datetime
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            # Create new list to ensure SQLModel detects change
-            current_logs = list(task.logs) if task.logs else []
-            current_logs.append(f"[{timestamp}] {message}")
-            task.logs = current_logs
-            session.add(task)
-            session.commit()
+        # Buffered append to TaskLog; the task row itself is not rewritten
+        append_task_log(task_id, message)
     except Exception as e:
         logger.error(f"Failed to log task event: {e}")
 
@@ -66,6 +64,372 @@ def save_generated_image(session, project_id, entity_type, entity_id, image_byte
     
     return relative_url
 
+def resolve_static_path(base_dir, url):
+    # URL: /static/{project_id}/panels/xxx.png -> backend/static/{project_id}/panels/xxx.png
+    return os.path.join(base_dir, url.lstrip("/").replace("/", os.sep))
+
+def existing_image_path(entity, base_dir) -> Optional[str]:
+    """Absolute path of the entity's current image if the file is really on disk, else None."""
+    if not entity.image_url:
+        return None
+    path = resolve_static_path(base_dir, entity.image_url)
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        return path
+    return None
+
+def record_checkpoint(task, kind: str, entity_id, state: str):
+    # Reassign instead of mutating so the JSON column is flagged dirty
+    checkpoint = dict(task.checkpoint or {})
+    entries = dict(checkpoint.get(kind) or {})
+    entries[str(entity_id)] = state
+    checkpoint[kind] = entries
+    task.checkpoint = checkpoint
+
+def resume_panel_history(session, task, items, base_dir) -> dict:
+    """
+    Resume mode: panels that already have a valid image on disk are not rendered again.
+    Returns index -> absolute path for those panels so they still serve as history context.
+    """
+    history = {}
+    for i, item in enumerate(items):
+        path = existing_image_path(item, base_dir)
+        if path:
+            history[i] = path
+            record_checkpoint(task, "panels", item.id, "done")
+    session.commit()
+    if history:
+        log_task_event(session, task.id, f"Resuming: {len(history)} of {len(items)} panels already have images, skipping them.")
+    return history
+
+def get_character_context_images(item, characters, base_dir) -> List[str]:
+    """Absolute paths of the character sheets referenced by a storyboard item."""
+    char_names = item.data.get("characters", [])
+    if isinstance(char_names, str): char_names = [char_names]
+    elif isinstance(char_names, list):
+        names = []
+        for c in char_names:
+            if isinstance(c, dict): names.append(c.get("name", ""))
+            elif isinstance(c, str): names.append(c)
+        char_names = names
+    
+    context_images = []
+    for name in char_names:
+        for p_char in characters:
+            if p_char.image_url and (p_char.name in name or name in p_char.name):
+                abs_path = resolve_static_path(base_dir, p_char.image_url)
+                if os.path.exists(abs_path) and abs_path not in context_images:
+                    context_images.append(abs_path)
+    return context_images
+
+def panel_context_dependencies(total: int, lag: int = 1) -> List[List[int]]:
+    """
+    For each panel index, the indices of the panels used as history context.
+    Context is the first panel plus the two panels `lag` steps back, so with lag=1
+    this is the classic "first + last two" window and panels render strictly in order.
+    A larger lag lets up to `lag` panels render at once.
+    """
+    dependencies = []
+    for i in range(total):
+        deps = []
+        for j in (0, i - lag - 1, i - lag):
+            if 0 <= j < i and j not in deps:
+                deps.append(j)
+        dependencies.append(deps)
+    return dependencies
+
+def render_image(prompt: str, context_images: List[str], aspect_ratio: str, resolution: str) -> bytes:
+    """Runs one image generation call on a worker thread with its own session."""
+    from app.core.database import engine
+    with Session(engine) as session:
+        ai = AIService(session)
+        return ai.generate_image(
+            prompt,
+            context_images=context_images,
+            aspect_ratio=aspect_ratio,
+            resolution=resolution
+        )
+
+# --- Generation calls ---
+# Tasks are orchestrated on their own thread (DB commits, image files and logs stay there).
+# With ASYNC_GENERATION the model calls themselves run as AsyncAIService coroutines on the
+# shared generation loop, so in-flight generations do not each pin a thread; otherwise image
+# calls run on the task's thread pool. Either way the task gets a concurrent.futures.Future.
+
+def submit_render(pool, prompt: str, context_images: List[str], aspect_ratio: str, resolution: str):
+    if settings.ASYNC_GENERATION:
+        return generation_loop.submit(AsyncAIService().generate_image(
+            prompt,
+            context_images=context_images,
+            aspect_ratio=aspect_ratio,
+            resolution=resolution
+        ))
+    return pool.submit(render_image, prompt, context_images, aspect_ratio, resolution)
+
+def cancel_renders(pool, futures):
+    # Drop queued work on cancel/failure: pending coroutines are cancelled,
+    # calls already running on a thread finish in the background
+    for future in futures:
+        future.cancel()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def render_image_now(prompt: str, context_images: List[str], aspect_ratio: str, resolution: str) -> bytes:
+    if settings.ASYNC_GENERATION:
+        return submit_render(None, prompt, context_images, aspect_ratio, resolution).result()
+    return render_image(prompt, context_images, aspect_ratio, resolution)
+
+def generate_storyboard_text(session, system_prompt: str, user_input: str) -> str:
+    if settings.ASYNC_GENERATION:
+        return generation_loop.submit(AsyncAIService().generate_storyboard(system_prompt, user_input)).result()
+    return AIService(session).generate_storyboard(system_prompt, user_input)
+
+def stream_storyboard_text(session, system_prompt: str, user_input: str) -> Iterator[str]:
+    if settings.ASYNC_GENERATION:
+        return generation_loop.iterate(AsyncAIService().generate_storyboard_stream(system_prompt, user_input))
+    return AIService(session).generate_storyboard_stream(system_prompt, user_input)
+
+def build_character_sheet_prompt(char) -> str:
+    json_prompt = json.dumps(char.data, ensure_ascii=False, indent=2)
+    json_prompt += "\n\n generate a character design sheet with 4 panels: front view, side view, clothing details, accessories."
+    return json_prompt
+
+def build_character_prompt(char) -> str:
+    # Construct Natural Language Prompt from JSON
+    data = char.data
+    meta = data.get("meta_info", {})
+    name = data.get("name", "Unknown")
+    role = meta.get("role", "")
+    age = meta.get("age", "")
+    personality = data.get("personality", "") or meta.get("personality", "")
+    style = meta.get("style", "")
+    
+    # Build Description from panels
+    description = ""
+    panels = data.get("design_panels", [])
+    for p in panels:
+        view = p.get("view", "")
+        desc = p.get("description", "")
+        description += f"- {view}: {desc}\n"
+    
+    return f"""Character Design Request:
+Name: {name}
+Role: {role}
+Age: {age}
+Personality: {personality}
+Style: {style}
+
+Visual Description:
+{description}
+
+Task: Generate a high-quality character reference sheet (Character Design) based on the above description. 
+Include Front View, Side View, and detailed clothing/accessories. 
+Ensure the character's expression and pose reflect their personality: {personality}.
+"""
+
+def render_characters(session, task, project, characters, build_prompt) -> bool:
+    """
+    Renders character sheets concurrently (they have no ordering dependency), at most
+    CHARACTER_GENERATION_CONCURRENCY at a time. Provider quota is enforced by the rate limiter
+    inside AIService. Results are persisted on the calling thread. Returns False if the task was cancelled.
+    """
+    total_chars = len(characters)
+    if not total_chars:
+        return True
+    
+    workers = max(1, settings.CHARACTER_GENERATION_CONCURRENCY)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = list(characters)
+    in_flight = {}
+    completed = 0
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < workers:
+                char = pending.pop(0)
+                log_task_event(session, task.id, f"Generating image for character: {char.name}")
+                future = submit_render(
+                    pool,
+                    build_prompt(char),
+                    [],
+                    project.aspect_ratio or "16:9",
+                    project.resolution or "2K"
+                )
+                in_flight[future] = char
+        
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                char = in_flight.pop(future)
+                completed += 1
+                try:
+                    image_bytes = future.result()
+                    save_character_result(session, task, project, char, image_bytes, completed, total_chars)
+                
+                except Exception as e:
+                    logger.error(f"Failed to generate char {char.id}: {e}")
+                    log_task_event(session, task.id, f"Failed to generate char {char.id}: {e}")
+            
+            # Check for cancellation
+            session.refresh(task)
+            if task.status == "cancelled":
+                log_task_event(session, task.id, "Task execution cancelled by user.")
+                return False
+    finally:
+        cancel_renders(pool, in_flight)
+    return True
+
+def build_batch_panel_prompt(item) -> str:
+    json_prompt = json.dumps(item.data, ensure_ascii=False, indent=2)
+    json_prompt += "\n\n use json block as user input prompt to generate 2*2 grid comic image."
+    return json_prompt
+
+def build_batch_panel_context(item, characters, history_paths, base_dir) -> List[str]:
+    # Prepare Context: a) Character Sheets, b) History panels (first + last two)
+    context_images = get_character_context_images(item, characters, base_dir)
+    for path in history_paths:
+        if path and path not in context_images:
+            context_images.append(path)
+    return context_images
+
+def render_panels(session, task, project, workers: int, base_dir, resume: bool = False) -> bool:
+    """
+    Renders all storyboard panels through a dependency graph: each panel only waits for
+    the panels whose images it uses as history context (see panel_context_dependencies).
+    With workers=1 this is exactly the old sequential "first + last two" behaviour.
+    With resume=True panels that already have an image on disk are skipped.
+    Returns False if the task was cancelled.
+    """
+    items = sorted(project.storyboard_items, key=lambda x: x.sequence)
+    total_items = len(items)
+    log_task_event(session, task.id, f"Generating {total_items} storyboard panels (concurrency: {workers})...")
+    
+    dependencies = panel_context_dependencies(total_items, workers)
+    # index -> absolute image path (None if the panel failed)
+    generated_history = resume_panel_history(session, task, items, base_dir) if resume else {}
+    pending = [i for i in range(total_items) if i not in generated_history]
+    in_flight = {}
+    completed = len(generated_history)
+    
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while pending or in_flight:
+            # Submit every panel whose context panels are finished
+            for i in list(pending):
+                if len(in_flight) >= workers:
+                    break
+                if not all(d in generated_history for d in dependencies[i]):
+                    continue
+                
+                item = items[i]
+                pending.remove(i)
+                log_task_event(session, task.id, f"Generating panel {item.sequence}...")
+                
+                context_images = build_batch_panel_context(
+                    item, project.characters, [generated_history[d] for d in dependencies[i]], base_dir
+                )
+                future = submit_render(
+                    pool,
+                    build_batch_panel_prompt(item),
+                    context_images,
+                    project.aspect_ratio or "16:9",
+                    project.resolution or "2K"
+                )
+                in_flight[future] = i
+            
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                i = in_flight.pop(future)
+                item = items[i]
+                completed += 1
+                try:
+                    image_bytes = future.result()
+                    generated_history[i] = save_panel_result(session, task, project, item, image_bytes, completed, total_items, base_dir)
+                except Exception as e:
+                    generated_history[i] = None
+                    record_checkpoint(task, "panels", item.id, "failed")
+                    session.commit()
+                    logger.error(f"Failed to generate panel {item.id}: {e}")
+                    log_task_event(session, task.id, f"Failed to generate panel {item.id}: {e}")
+            
+            # Check for cancellation
+            session.refresh(task)
+            if task.status == "cancelled":
+                log_task_event(session, task.id, "Task execution cancelled by user.")
+                return False
+    finally:
+        cancel_renders(pool, in_flight)
+    return True
+
+def save_panel_result(session, task, project, item, image_bytes, completed, total_items, base_dir) -> str:
+    """Persists a rendered batch panel and returns its absolute path for use as history context."""
+    relative_url = save_generated_image(session, project.id, "panel", item.id, image_bytes)
+    
+    item.image_url = relative_url
+    session.add(item)
+    
+    task.progress = int((completed / total_items) * 100)
+    record_checkpoint(task, "panels", item.id, "done")
+    session.add(task)
+    session.commit()
+    
+    log_task_event(session, task.id, f"Panel {item.sequence} generated successfully.")
+    return resolve_static_path(base_dir, relative_url)
+
+def save_character_result(session, task, project, char, image_bytes, completed, total_chars):
+    relative_url = save_generated_image(session, project.id, "character", char.id, image_bytes)
+    char.image_url = relative_url
+    session.add(char)
+    
+    # Update task progress
+    task.progress = int((completed / total_chars) * 100)
+    record_checkpoint(task, "characters", char.id, "done")
+    session.add(task)
+    session.commit()
+    log_task_event(session, task.id, f"Character {char.name} generated successfully.")
+
+def build_panel_request(item, project):
+    """Returns (prompt, context_images) for regenerating a single panel."""
+    json_prompt = json.dumps(item.data, ensure_ascii=False, indent=2)
+    json_prompt += "\n\n use json block as user input prompt to generate 2*2 grid comic image."
+    
+    context_images = []
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    # 1. Find Character Images
+    # STRICT POLICY: Only use the currently active character image (p_char.image_url).
+    # Do NOT search ImageHistory or other versions. This ensures consistency with the user's current selection.
+    context_images.extend(get_character_context_images(item, project.characters, base_dir))
+    
+    # 2. Previous Panels - RE-ENABLED but with strict filtering
+    # We want to use PREVIOUSLY CONFIRMED panels as reference to maintain consistency,
+    # but NOT the current panel's old version (which we are regenerating).
+    # STRICT POLICY: Only use currently active panel images (i.image_url) from the database.
+    
+    # Filter logic:
+    # - Use panels with sequence number LESS than current item.sequence
+    # - Ensure they have an image_url (meaning they are generated/confirmed)
+    # - Limit to last 3 to keep context fresh but manageable
+    
+    prev_items = sorted([i for i in project.storyboard_items if i.sequence < item.sequence and i.image_url], key=lambda x: x.sequence)
+    if prev_items:
+        selected = []
+        if len(prev_items) >= 3:
+            selected = [prev_items[0]] + prev_items[-2:] # First one + last two
+        else:
+            selected = prev_items
+            
+        for prev in selected:
+            abs_path = resolve_static_path(base_dir, prev.image_url)
+            if os.path.exists(abs_path) and abs_path not in context_images:
+                context_images.append(abs_path)
+    
+    # Style Consistency
+    meta_style = item.data.get("meta_info", {}).get("style", "")
+    if not meta_style and project.global_config:
+        meta_style = project.global_config.data.get("style", "")
+        
+    if meta_style:
+         json_prompt += f"\n\nStyle Consistency Requirement: {meta_style}. Ensure the visual style matches the provided context images."
+    
+    return json_prompt, context_images
+
 router = APIRouter()
 
 from app.core.prompts import COMIC_GENERATION_SYSTEM_PROMPT
@@ -75,7 +439,254 @@ def get_system_prompt():
 
 # --- Background Task Functions ---
 
-def generate_storyboard_task(task_id: str, project_id: str, user_input: str):
+def build_storyboard_prompts(project, user_input: str):
+    """Returns (system_prompt, final_prompt) with the project preferences applied."""
+    # --- Replace Placeholders in System Prompt ---
+    system_prompt = get_system_prompt()
+    
+    # Defaults
+    style = "Standard"
+    if project.theme: style = project.theme
+    
+    lang = "English"
+    if project.language:
+        lang_map = {"zh-CN": "Simplified Chinese", "en-US": "English", "ja-JP": "Japanese"}
+        lang = lang_map.get(project.language, project.language)
+        
+    # Inject into System Prompt
+    system_prompt = system_prompt.replace("{User Specified Style}", style)
+    # We could also inject language if we had a placeholder, but style is the main one failing.
+    # Let's add language instruction to system prompt dynamically if needed, 
+    # or rely on the "Language & Format" section in prompt which says "Use user input language".
+    
+    # --- Construct User Prompt ---
+    final_prompt = user_input
+    
+    # Append preferences as normal requirements
+    prefs = []
+    if project.theme: prefs.append(f"Theme: {project.theme}")
+    if project.language: prefs.append(f"Language: {project.language}")
+    if project.panel_count: prefs.append(f"Estimated Panel Count: {project.panel_count}")
+    if project.aspect_ratio: prefs.append(f"Aspect Ratio: {project.aspect_ratio}")
+    
+    if prefs:
+        final_prompt += "\n\nRequirements:\n" + "\n".join(prefs)
+    
+    return system_prompt, final_prompt
+
+def save_raw_ai_output(session, task_id, project_id, generated_text):
+    # --- Save Generated Text to Temp File ---
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    temp_dir = os.path.join(base_dir, "static", project_id, "temp")
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+    
+    timestamp = int(time.time())
+    temp_file = os.path.join(temp_dir, f"ai_output_{timestamp}.txt")
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(generated_text)
+        log_task_event(session, task_id, f"Saved raw AI output to {temp_file}")
+    except Exception as e:
+        logger.error(f"Failed to save temp AI output: {e}")
+
+def split_storyboard_blocks(json_blocks):
+    """Returns (char_blocks, story_blocks) from the extracted JSON blocks."""
+    char_blocks = [b for b in json_blocks if b.get("type") == "character_sheet"]
+    story_blocks = [b for b in json_blocks if b.get("type") == "storyboard"] 
+    
+    if not story_blocks:
+         story_blocks = [b for b in json_blocks if b.get("type") not in ["character_sheet", "comic_config"]]
+    return char_blocks, story_blocks
+
+def find_missing_characters(char_blocks, story_blocks) -> List[str]:
+    story_char_names = set()
+    for block in story_blocks:
+        chars = block.get("characters", [])
+        if isinstance(chars, str):
+            story_char_names.add(chars)
+        elif isinstance(chars, list):
+            for c in chars:
+                if isinstance(c, str): story_char_names.add(c)
+                elif isinstance(c, dict): story_char_names.add(c.get("name", ""))
+
+    generated_char_names = set(b.get("name") for b in char_blocks if b.get("name"))
+    
+    # A story name is covered if it contains a generated name or is contained in one
+    # (e.g. "Xiao Ming" vs "Ming"); each direction is one matcher pass per name
+    generated_matcher = NameMatcher(generated_char_names)
+    covered = {name for name in story_char_names if generated_matcher.find_all(name)}
+    story_matcher = NameMatcher(story_char_names)
+    for g_name in generated_char_names:
+        covered |= story_matcher.find(g_name)
+    
+    missing_chars = []
+    for name in story_char_names:
+        if name not in covered and name and len(name) > 1: # Ignore single chars or empty
+            missing_chars.append(name)
+    return missing_chars
+
+def build_missing_characters_prompt(missing_chars: List[str]) -> str:
+    return f"You missed generating character sheets for the following characters that appeared in the storyboard: {', '.join(missing_chars)}. Please generate 'character_sheet' JSON blocks for them now. Do not generate anything else."
+
+def sync_block_meta(config_block, char_blocks, story_blocks):
+    """Enforce Consistency: copies the global style/language/layout config into every block's meta_info."""
+    global_style = config_block.get("style", "")
+    global_aspect = config_block.get("aspect_ratio", "16:9")
+    global_lang = config_block.get("language", MASTER_META_DEFAULTS["language"])
+
+    # Update Character Sheets
+    for char in char_blocks:
+        char["meta_info"] = char.get("meta_info", {})
+        char["meta_info"]["language"] = global_lang
+        char["meta_info"]["style"] = global_style
+
+        # Remove top-level redundant keys if they exist to avoid confusion
+        char.pop("language", None)
+        char.pop("style", None)
+
+    # Update Storyboard Items
+    for block in story_blocks:
+        meta = block.get("meta_info", {})
+        meta["style"] = global_style
+        meta["language"] = global_lang
+        meta["aspect_ratio"] = global_aspect
+
+        # Also inject specific style configs if present
+        for key in ["bubble_style", "narration_style", "border_style", "gutter_style", "layout_settings"]:
+            if key in config_block:
+                meta[key] = config_block[key]
+
+        block["meta_info"] = meta
+
+def apply_storyboard_output(session, project, json_blocks, char_blocks, story_blocks):
+    """
+    Syncs the comic config into every block and persists config, characters and storyboard.
+    Returns the ids of storyboard items that need (re-)rendering: new, changed or never rendered.
+    """
+    project_id = project.id
+    config_block = next((b for b in json_blocks if b.get("type") == "comic_config"), None)
+    
+    # If AI didn't return config, create one from project prefs
+    if not config_block and (project.aspect_ratio or project.language):
+        config_block = {
+            "type": "comic_config",
+            "style": "Standard", # Default
+            "aspect_ratio": project.aspect_ratio or "16:9",
+            "language": project.language or MASTER_META_DEFAULTS["language"]
+        }
+    
+    if config_block:
+        crud_project.create_global_config(session, project_id, config_block)
+    
+    # --- Enforce Consistency: Update meta_info for all blocks ---
+    if config_block:
+        sync_block_meta(config_block, char_blocks, story_blocks)
+    
+    # Save to DB (unchanged panels keep their rendered images). Stored panels are normalized,
+    # so the incoming ones are normalized the same way first or their content hashes never match
+    crud_project.save_characters(session, project_id, char_blocks)
+    consistency = ConsistencyService(session)
+    consistency.normalize_storyboard_blocks(project_id, story_blocks)
+    _, stale = crud_project.merge_storyboard(session, project_id, story_blocks)
+    
+    # Consistency (volumes, and anything the blocks did not cover)
+    consistency.normalize_project(project_id)
+    return stale
+
+def new_stream_state() -> dict:
+    """
+    Blocks seen so far by persist_streamed_block, plus what revert_streamed_blocks needs to undo
+    its storyboard writes: the items as they were ({id: sequence}) and the ids it inserted.
+    """
+    return {"blocks": [], "config": None, "story": [], "index": None, "original": {}, "inserted": []}
+
+def persist_streamed_block(session, task, project, block, streamed):
+    """
+    Saves one block of a streaming storyboard response as soon as it is complete, so the
+    project fills in while the model is still writing. `streamed` (new_stream_state) collects
+    the blocks seen so far. Returns the saved Character for character sheets.
+    """
+    streamed["blocks"].append(block)
+    block_type = block.get("type")
+    if block_type == "comic_config":
+        streamed["config"] = block
+        crud_project.create_global_config(session, project.id, block)
+        log_task_event(session, task.id, "Received comic config.")
+    elif block_type == "character_sheet":
+        if streamed["config"]:
+            sync_block_meta(streamed["config"], [block], [])
+        saved = crud_project.save_characters(session, project.id, [block])
+        if saved:
+            log_task_event(session, task.id, f"Received character sheet: {block.get('name')}")
+            return saved[0]
+    else:
+        streamed["story"].append(block)
+        if streamed["config"]:
+            sync_block_meta(streamed["config"], [], [block])
+        ConsistencyService(session).normalize_storyboard_blocks(project.id, [block])
+        if streamed["index"] is None:
+            streamed["index"] = crud_project.storyboard_hash_index(session, project.id)
+            streamed["original"] = {item_id: seq for entries in streamed["index"].values() for item_id, seq in entries}
+        # Only this block is written; old panels stay until the final merge so later blocks can still match them
+        item = crud_project.upsert_storyboard_block(session, project.id, len(streamed["story"]), block, streamed["index"])
+        if item.id not in streamed["original"]:
+            streamed["inserted"].append(item.id)
+        log_task_event(session, task.id, f"Received storyboard block {len(streamed['story'])}.")
+    return None
+
+def revert_streamed_blocks(session, project_id, streamed):
+    """Puts the storyboard back as it was before the stream when the final merge will not run (cancel, failure)."""
+    if streamed["index"] is not None:
+        crud_project.revert_streamed_storyboard(session, project_id, streamed["original"], streamed["inserted"])
+        streamed["index"] = None
+
+def stream_storyboard(session, task, project, system_prompt, final_prompt, streamed, render_pool=None):
+    """
+    Streams the storyboard response through JsonBlockStreamExtractor, persisting each block as it
+    completes into `streamed` (new_stream_state, owned by the caller so it can revert the writes).
+    With a render_pool, character sheets start rendering before the storyboard is done.
+    Returns (generated_text, json_blocks, {character_id: future}).
+    """
+    extractor = JsonBlockStreamExtractor()
+    renders = {}
+    
+    def handle(blocks):
+        for block in blocks:
+            char = persist_streamed_block(session, task, project, block, streamed)
+            if char and render_pool and not char.image_url and char.id not in renders:
+                log_task_event(session, task.id, f"Generating image for character: {char.name}")
+                renders[char.id] = submit_render(
+                    render_pool,
+                    build_character_sheet_prompt(char),
+                    [],
+                    project.aspect_ratio or "16:9",
+                    project.resolution or "2K"
+                )
+    
+    try:
+        for chunk in stream_storyboard_text(session, system_prompt, final_prompt):
+            handle(extractor.feed(chunk))
+        handle(extractor.finish())
+    except BaseException:
+        for future in renders.values():
+            future.cancel()
+        raise
+    return extractor.text, streamed["blocks"], renders
+
+def save_character_renders(session, task, project, results):
+    """Persists early character renders ({character_id: image bytes or Exception}) once the storyboard is saved."""
+    completed = 0
+    for char_id, result in results.items():
+        completed += 1
+        char = session.get(Character, char_id)
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to generate char {char_id}: {result}")
+            log_task_event(session, task.id, f"Failed to generate char {char_id}: {result}")
+        elif char is not None:
+            save_character_result(session, task, project, char, result, completed, len(results))
+
+def generate_storyboard_task(task_id: str, project_id: str, user_input: str, render_character_images: bool = False):
     logger.info(f"Starting storyboard generation task: {task_id} for project: {project_id}")
     # We need a fresh session for the background task
     from app.core.database import engine
@@ -89,6 +700,8 @@ def generate_storyboard_task(task_id: str, project_id: str, user_input: str):
         session.add(task)
         session.commit()
         
+        render_pool = ThreadPoolExecutor(max_workers=max(1, settings.CHARACTER_GENERATION_CONCURRENCY)) if render_character_images else None
+        streamed = new_stream_state()
         try:
             project = crud_project.get_project(session, project_id)
             log_task_event(session, task_id, f"Project found: {project.title}")
@@ -98,108 +711,37 @@ def generate_storyboard_task(task_id: str, project_id: str, user_input: str):
             session.add(project)
             session.commit()
             
-            ai = AIService(session)
-            system_prompt = get_system_prompt()
-            
-            # Construct Final Prompt with Preferences
-            final_prompt = user_input
-            
-            # --- Replace Placeholders in System Prompt ---
-            system_prompt = get_system_prompt()
-            
-            # Defaults
-            style = "Standard"
-            if project.theme: style = project.theme
-            
-            lang = "English"
-            if project.language:
-                lang_map = {"zh-CN": "Simplified Chinese", "en-US": "English", "ja-JP": "Japanese"}
-                lang = lang_map.get(project.language, project.language)
-                
-            # Inject into System Prompt
-            system_prompt = system_prompt.replace("{User Specified Style}", style)
-            # We could also inject language if we had a placeholder, but style is the main one failing.
-            # Let's add language instruction to system prompt dynamically if needed, 
-            # or rely on the "Language & Format" section in prompt which says "Use user input language".
-            
-            # --- Construct User Prompt ---
-            final_prompt = user_input
-            
-            # Append preferences as normal requirements
-            prefs = []
-            if project.theme: prefs.append(f"Theme: {project.theme}")
-            if project.language: prefs.append(f"Language: {project.language}")
-            if project.panel_count: prefs.append(f"Estimated Panel Count: {project.panel_count}")
-            if project.aspect_ratio: prefs.append(f"Aspect Ratio: {project.aspect_ratio}")
-            
-            if prefs:
-                final_prompt += "\n\nRequirements:\n" + "\n".join(prefs)
+            system_prompt, final_prompt = build_storyboard_prompts(project, user_input)
 
-            log_task_event(session, task_id, "Calling AI service for storyboard generation... This may take a while.")
-            generated_text = ai.generate_storyboard(system_prompt, final_prompt)
-            
-            # --- Save Generated Text to Temp File ---
-            import time
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            temp_dir = os.path.join(base_dir, "static", project_id, "temp")
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-            
-            timestamp = int(time.time())
-            temp_file = os.path.join(temp_dir, f"ai_output_{timestamp}.txt")
-            try:
-                with open(temp_file, "w", encoding="utf-8") as f:
-                    f.write(generated_text)
-                log_task_event(session, task_id, f"Saved raw AI output to {temp_file}")
-            except Exception as e:
-                logger.error(f"Failed to save temp AI output: {e}")
-            # ----------------------------------------
-
-            log_task_event(session, task_id, "AI generation complete. Extracting JSON blocks...")
-            json_blocks = extract_json_blocks(generated_text)
-            
-            char_blocks = [b for b in json_blocks if b.get("type") == "character_sheet"]
-            story_blocks = [b for b in json_blocks if b.get("type") == "storyboard"] 
-            
-            if not story_blocks:
-                 story_blocks = [b for b in json_blocks if b.get("type") not in ["character_sheet", "comic_config"]]
+            renders = {}
+            if settings.STORYBOARD_STREAMING:
+                log_task_event(session, task_id, "Streaming storyboard from AI service... Blocks are saved as they arrive.")
+                generated_text, json_blocks, renders = stream_storyboard(session, task, project, system_prompt, final_prompt, streamed, render_pool)
+                save_raw_ai_output(session, task_id, project_id, generated_text)
+                log_task_event(session, task_id, f"AI generation complete. Received {len(json_blocks)} JSON blocks.")
+            else:
+                log_task_event(session, task_id, "Calling AI service for storyboard generation... This may take a while.")
+                generated_text = generate_storyboard_text(session, system_prompt, final_prompt)
+                save_raw_ai_output(session, task_id, project_id, generated_text)
+
+                log_task_event(session, task_id, "AI generation complete. Extracting JSON blocks...")
+                json_blocks = extract_json_blocks(generated_text)
+            char_blocks, story_blocks = split_storyboard_blocks(json_blocks)
 
             # --- Missing Character Check & Fix ---
             session.refresh(task)
             if task.status == "cancelled":
+                revert_streamed_blocks(session, project_id, streamed)
                 log_task_event(session, task_id, "Task execution cancelled by user.")
                 return
 
-            story_char_names = set()
-            for block in story_blocks:
-                chars = block.get("characters", [])
-                if isinstance(chars, str):
-                    story_char_names.add(chars)
-                elif isinstance(chars, list):
-                    for c in chars:
-                        if isinstance(c, str): story_char_names.add(c)
-                        elif isinstance(c, dict): story_char_names.add(c.get("name", ""))
-
-            generated_char_names = set(b.get("name") for b in char_blocks if b.get("name"))
-            
-            # Simple fuzzy matching or direct check
-            missing_chars = []
-            for name in story_char_names:
-                # Check if name is contained in any generated char name (e.g. "Xiao Ming" vs "Ming")
-                found = False
-                for g_name in generated_char_names:
-                    if name in g_name or g_name in name:
-                        found = True
-                        break
-                if not found and name and len(name) > 1: # Ignore single chars or empty
-                    missing_chars.append(name)
-            
+            missing_chars = find_missing_characters(char_blocks, story_blocks)
             if missing_chars:
                 log_task_event(session, task_id, f"Detected missing characters: {missing_chars}. Requesting AI to generate them...")
-                fix_prompt = f"You missed generating character sheets for the following characters that appeared in the storyboard: {', '.join(missing_chars)}. Please generate 'character_sheet' JSON blocks for them now. Do not generate anything else."
+                fix_prompt = build_missing_characters_prompt(missing_chars)
                 
                 try:
-                    fix_response = ai.generate_storyboard(system_prompt, fix_prompt) # Re-use generate method
+                    fix_response = generate_storyboard_text(session, system_prompt, fix_prompt) # Re-use generate method
                     fix_blocks = extract_json_blocks(fix_response)
                     new_chars = [b for b in fix_blocks if b.get("type") == "character_sheet"]
                     if new_chars:
@@ -208,69 +750,21 @@ def generate_storyboard_task(task_id: str, project_id: str, user_input: str):
                 except Exception as e:
                     logger.error(f"Failed to generate missing characters: {e}")
 
-            config_block = next((b for b in json_blocks if b.get("type") == "comic_config"), None)
-            
-            # If AI didn't return config, create one from project prefs
-            if not config_block and (project.aspect_ratio or project.language):
-                config_block = {
-                    "type": "comic_config",
-                    "style": "Standard", # Default
-                    "aspect_ratio": project.aspect_ratio or "16:9",
-                    "language": project.language or "en-US"
-                }
-            
-            if config_block:
-                crud_project.create_global_config(session, project_id, config_block)
-            
-            # --- Enforce Consistency: Update meta_info for all blocks ---
-            # Re-read global config if we just created/updated it
-            # Or use the config_block we have
-            
-            if not config_block:
-                 # Try to fetch existing
-                 # But we just generated it. If None, we create a default one above.
-                 # Let's use the one we have.
-                 pass
-
-            if config_block:
-                global_style = config_block.get("style", "")
-                global_aspect = config_block.get("aspect_ratio", "16:9")
-                global_lang = config_block.get("language", "en-US")
-                
-                # Update Character Sheets
-                for char in char_blocks:
-                    char["meta_info"] = char.get("meta_info", {})
-                    char["meta_info"]["language"] = global_lang
-                    char["meta_info"]["style"] = global_style
-                    
-                    # Remove top-level redundant keys if they exist to avoid confusion
-                    char.pop("language", None)
-                    char.pop("style", None)
-                    
-                # Update Storyboard Items
-                for block in story_blocks:
-                    meta = block.get("meta_info", {})
-                    meta["style"] = global_style
-                    meta["language"] = global_lang
-                    meta["aspect_ratio"] = global_aspect
-                    
-                    # Also inject specific style configs if present
-                    for key in ["bubble_style", "narration_style", "border_style", "gutter_style", "layout_settings"]:
-                        if key in config_block:
-                            meta[key] = config_block[key]
-                    
-                    block["meta_info"] = meta
-            
-            # Save to DB
-            crud_project.save_characters(session, project_id, char_blocks)
-            crud_project.save_storyboard(session, project_id, story_blocks)
-            
-            # Consistency
-            consistency = ConsistencyService(session)
-            consistency.normalize_project(project_id)
+            stale = apply_storyboard_output(session, project, json_blocks, char_blocks, story_blocks)
+            # The merge reconciled the streamed writes, nothing to revert from here on
+            streamed["index"] = None
+            log_task_event(session, task_id, f"Storyboard saved: {len(story_blocks) - len(stale)} panels kept their images, {len(stale)} need new images.")
             
+            if render_character_images:
+                # Sheets that started rendering mid-stream, then any character still without an image
+                save_character_renders(session, task, project, {cid: f.exception() or f.result() for cid, f in renders.items()})
+                session.refresh(project)
+                pending_chars = [c for c in project.characters if not c.image_url and c.id not in renders]
+                if not render_characters(session, task, project, pending_chars, build_character_sheet_prompt):
+                    return
+
             task.status = "completed"
-            task.result = {"blocks_found": len(json_blocks)}
+            task.result = {"blocks_found": len(json_blocks), "stale_panels": stale}
             task.progress = 100
             session.add(task)
             session.commit()
@@ -279,12 +773,20 @@ def generate_storyboard_task(task_id: str, project_id: str, user_input: str):
         except Exception as e:
             logger.error(f"Storyboard task {task_id} failed: {e}")
             traceback.print_exc()
+            session.rollback()
+            try:
+                revert_streamed_blocks(session, project_id, streamed)
+            except Exception as revert_error:
+                logger.error(f"Could not revert streamed storyboard of task {task_id}: {revert_error}")
             task.status = "failed"
             task.message = str(e)
             session.add(task)
             session.commit()
+        finally:
+            if render_pool:
+                render_pool.shutdown(wait=False, cancel_futures=True)
 
-def generate_all_images_task(task_id: str, project_id: str):
+def generate_all_images_task(task_id: str, project_id: str, concurrency: Optional[int] = None, resume: bool = False):
     logger.info(f"Starting batch image generation task: {task_id} for project: {project_id}")
     from app.core.database import engine
     with Session(engine) as session:
@@ -299,7 +801,6 @@ def generate_all_images_task(task_id: str, project_id: str):
         
         try:
             project = session.get(Project, project_id)
-            ai = AIService(session)
             
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
             static_root = os.path.join(base_dir, "static")
@@ -308,159 +809,22 @@ def generate_all_images_task(task_id: str, project_id: str):
             # 1. Generate Characters
             total_chars = len(project.characters)
             log_task_event(session, task_id, f"Generating {total_chars} characters...")
-            for i, char in enumerate(project.characters):
-                # Check for cancellation
-                session.refresh(task)
-                if task.status == "cancelled":
-                    log_task_event(session, task_id, "Task execution cancelled by user.")
-                    return
-
+            pending_chars = []
+            for char in project.characters:
                 if char.image_url: 
                     log_task_event(session, task_id, f"Character {char.name} already has image, skipping.")
                     continue 
-                
-                log_task_event(session, task_id, f"Generating image for character: {char.name}")
-                json_prompt = json.dumps(char.data, ensure_ascii=False, indent=2)
-                json_prompt += "\n\n generate a character design sheet with 4 panels: front view, side view, clothing details, accessories."
-                
-                try:
-                    image_bytes = ai.generate_image(
-                        json_prompt, 
-                        aspect_ratio=project.aspect_ratio or "16:9",
-                        resolution=project.resolution or "2K"
-                    )
-                    relative_url = save_generated_image(session, project_id, "character", char.id, image_bytes)
-                    char.image_url = relative_url
-                    session.add(char)
-                    session.commit()
-                    log_task_event(session, task_id, f"Character {char.name} generated successfully.")
-                    
-                    # Update task progress
-                    progress = int(((i + 1) / total_chars) * 100)
-                    task.progress = progress
-                    session.add(task)
-                    session.commit()
-                    
-                except Exception as e:
-                    logger.error(f"Failed to generate char {char.id}: {e}")
-                    log_task_event(session, task_id, f"Failed to generate char {char.id}: {e}")
-                
-                # Update task progress
-                # progress = int(((i + 1) / total_chars) * 100)
-                # task.progress = progress
-                # session.add(task)
-                # session.commit()
-                
-            # 2. Generate Storyboard Items (Sequential)
-            # Re-fetch items to ensure order
-            items = sorted(project.storyboard_items, key=lambda x: x.sequence)
-            total_items = len(items)
-            log_task_event(session, task_id, f"Generating {total_items} storyboard panels...")
-            
-            generated_history = [] # Keep track of generated images for context
+                pending_chars.append(char)
             
-            # Populate history with existing images
-            # Actually comic_generator logic builds history as it goes.
-            # We should probably load existing images into history if we are resuming?
-            # For "one click", let's assume we scan all items.
-            
-            for i, item in enumerate(items):
-                # Check for cancellation
-                session.refresh(task)
-                if task.status == "cancelled":
-                    log_task_event(session, task_id, "Task execution cancelled by user.")
-                    return
-
-                # Update progress at start of loop
-                # task.progress = int((i / total_items) * 100)
-                # session.add(task)
-                # session.commit()
-                
-                # if item.image_url:
-                #    # Add to history
-                #    filename = os.path.basename(item.image_url)
-                #    # We need to find where it is stored.
-                #    # Assuming standard structure
-                #    # We need absolute path for history
-                #    # item.image_url is like /static/{project_id}/panels/{filename}
-                #    rel_path = item.image_url.lstrip("/")
-                #    abs_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
-                #    
-                #    if os.path.exists(abs_path):
-                #        generated_history.append(abs_path)
-                #    continue
-                
-                log_task_event(session, task_id, f"Generating panel {item.sequence}...")
-                
-                # Prepare Context
-                context_images = []
-                
-                # a) Character Sheets
-                char_names = item.data.get("characters", [])
-                if isinstance(char_names, str): char_names = [char_names]
-                elif isinstance(char_names, list):
-                    names = []
-                    for c in char_names:
-                        if isinstance(c, dict): names.append(c.get("name", ""))
-                        elif isinstance(c, str): names.append(c)
-                    char_names = names
-                
-                for name in char_names:
-                    for p_char in project.characters:
-                        if p_char.image_url and (p_char.name in name or name in p_char.name):
-                            # Resolve absolute path for char image
-                            rel_path = p_char.image_url.lstrip("/")
-                            abs_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
-                            if os.path.exists(abs_path) and abs_path not in context_images:
-                                context_images.append(abs_path)
-                
-                # b) Previous History (Last 3 logic) - RE-ENABLED for Batch Generation
-                # For batch generation, we build history as we go.
-                # This ensures panel N is consistent with panel N-1.
-                
-                if len(generated_history) >= 3:
-                    selected = [generated_history[0]] + generated_history[-2:]
-                else:
-                    selected = generated_history
-                
-                for path in selected:
-                    if path not in context_images:
-                        context_images.append(path)
-                
-                # Generate
-                json_prompt = json.dumps(item.data, ensure_ascii=False, indent=2)
-                json_prompt += "\n\n use json block as user input prompt to generate 2*2 grid comic image."
+            if not render_characters(session, task, project, pending_chars, build_character_sheet_prompt):
+                return
                 
-                try:
-                    image_bytes = ai.generate_image(
-                        json_prompt, 
-                        context_images=context_images,
-                        aspect_ratio=project.aspect_ratio or "16:9",
-                        resolution=project.resolution or "2K"
-                    )
-                    relative_url = save_generated_image(session, project_id, "panel", item.id, image_bytes)
-                    
-                    item.image_url = relative_url
-                    session.add(item)
-                    session.commit()
-                    
-                    # Update progress
-                    task.progress = int(((i + 1) / total_items) * 100)
-                    session.add(task)
-                    session.commit()
-                    
-                    # Add to history (absolute path for context usage)
-                    # We need absolute path for next context
-                    # save_generated_image returns relative /static/...
-                    # Reconstruct absolute path
-                    # strip leading /
-                    abs_path = os.path.join(base_dir, relative_url.lstrip("/").replace("/", os.sep))
-                    generated_history.append(abs_path)
-                    log_task_event(session, task_id, f"Panel {item.sequence} generated successfully.")
-                    
-                except Exception as e:
-                    logger.error(f"Failed to generate panel {item.id}: {e}")
-                    log_task_event(session, task_id, f"Failed to generate panel {item.id}: {e}")
+            # 2. Generate Storyboard Items
+            workers = max(1, concurrency or settings.IMAGE_GENERATION_CONCURRENCY)
+            # A queued task re-run after a worker crash continues from its own checkpoint
+            resume = resume or bool((task.checkpoint or {}).get("panels"))
+            if not render_panels(session, task, project, workers, base_dir, resume=resume):
+                return
             
             task.status = "completed"
             task.progress = 100
@@ -491,83 +855,12 @@ def generate_all_characters_task(task_id: str, project_id: str):
         
         try:
             project = session.get(Project, project_id)
-            ai = AIService(session)
             
             total_chars = len(project.characters)
             log_task_event(session, task_id, f"Generating {total_chars} characters...")
             
-            for i, char in enumerate(project.characters):
-                # Check for cancellation
-                session.refresh(task)
-                if task.status == "cancelled":
-                    log_task_event(session, task_id, "Task execution cancelled by user.")
-                    return
-
-                # if char.image_url: 
-                #    logger.info(f"Character {char.name} already has image, skipping.")
-                #    continue 
-                
-                log_task_event(session, task_id, f"Generating image for character: {char.name}")
-                
-                # Construct Natural Language Prompt from JSON
-                data = char.data
-                meta = data.get("meta_info", {})
-                name = data.get("name", "Unknown")
-                role = meta.get("role", "")
-                age = meta.get("age", "")
-                personality = data.get("personality", "") or meta.get("personality", "")
-                style = meta.get("style", "")
-                
-                # Build Description from panels
-                description = ""
-                panels = data.get("design_panels", [])
-                for p in panels:
-                    view = p.get("view", "")
-                    desc = p.get("description", "")
-                    description += f"- {view}: {desc}\n"
-                
-                prompt = f"""Character Design Request:
-Name: {name}
-Role: {role}
-Age: {age}
-Personality: {personality}
-Style: {style}
-
-Visual Description:
-{description}
-
-Task: Generate a high-quality character reference sheet (Character Design) based on the above description. 
-Include Front View, Side View, and detailed clothing/accessories. 
-Ensure the character's expression and pose reflect their personality: {personality}.
-"""
-                
-                try:
-                    image_bytes = ai.generate_image(
-                        prompt,
-                        aspect_ratio=project.aspect_ratio or "16:9",
-                        resolution=project.resolution or "2K"
-                    )
-                    relative_url = save_generated_image(session, project_id, "character", char.id, image_bytes)
-                    char.image_url = relative_url
-                    session.add(char)
-                    session.commit()
-                    log_task_event(session, task_id, f"Character {char.name} generated successfully.")
-                    
-                    # Update progress
-                    progress = int(((i + 1) / total_chars) * 100)
-                    task.progress = progress
-                    session.add(task)
-                    session.commit()
-                    
-                except Exception as e:
-                    logger.error(f"Failed to generate char {char.id}: {e}")
-                    log_task_event(session, task_id, f"Failed to generate char {char.id}: {e}")
-                
-                # Update progress
-                # progress = int(((i + 1) / total_chars) * 100)
-                # task.progress = progress
-                # session.add(task)
-                # session.commit()
+            if not render_characters(session, task, project, list(project.characters), build_character_prompt):
+                return
 
             task.status = "completed"
             task.progress = 100
@@ -583,92 +876,131 @@ Ensure the character's expression and pose reflect their personality: {personali
             session.add(task)
             session.commit()
 
-def generate_character_task(task_id: str, character_id: int):
-    logger.info(f"Starting character generation task: {task_id} for char: {character_id}")
+# --- Single-image tasks ---
+# A panel or character task is one model call between two short DB phases. The sync task
+# (BackgroundTasks thread or queue worker) and the async one share those phases; the async task
+# runs on the generation loop, awaits AsyncAIService and does the DB phases in worker threads,
+# so an in-flight single-image task does not hold a threadpool thread while the model works.
+
+IMAGE_TASK_ENTITIES = {"panel": (StoryboardItem, "Storyboard item"), "character": (Character, "Character")}
+
+def build_image_task_request(session, task_id, entity_type, entity) -> dict:
+    """Keyword arguments for render_image / AsyncAIService.generate_image."""
+    if entity_type == "panel":
+        prompt, context_images = build_panel_request(entity, entity.project)
+        log_task_event(session, task_id, f"Calling AI service for panel {entity.sequence}...")
+    else:
+        prompt, context_images = build_character_prompt(entity), []
+        log_task_event(session, task_id, f"Calling AI service for character {entity.name}...")
+    return {
+        "prompt": prompt,
+        "context_images": context_images,
+        "aspect_ratio": entity.project.aspect_ratio or "16:9",
+        "resolution": entity.project.resolution or "2K",
+    }
+
+def fail_image_task(session, task, entity_type, error):
+    label = f"{entity_type.capitalize()} task {task.id}"
+    logger.error(f"{label} failed: {error}")
+    log_task_event(session, task.id, f"{label} failed: {error}")
+    traceback.print_exception(error)
+    task.status = "failed"
+    task.message = str(error)
+    session.add(task)
+    session.commit()
+
+def begin_image_task(task_id: str, entity_type: str, entity_id: int) -> Optional[dict]:
+    """Marks the task processing and returns its render request; None if the task is gone or already failed."""
     from app.core.database import engine
     with Session(engine) as session:
         task = session.get(Task, task_id)
-        if not task: 
+        if not task:
             logger.error(f"Task {task_id} not found")
-            return
+            return None
         
         task.status = "processing"
         session.add(task)
         session.commit()
         
+        model, label = IMAGE_TASK_ENTITIES[entity_type]
         try:
-            char = session.get(Character, character_id)
-            if not char:
-                raise ValueError("Character not found")
-                
-            ai = AIService(session)
-            
-            # Construct Natural Language Prompt from JSON
-            data = char.data
-            meta = data.get("meta_info", {})
-            name = data.get("name", "Unknown")
-            role = meta.get("role", "")
-            age = meta.get("age", "")
-            personality = data.get("personality", "") or meta.get("personality", "")
-            style = meta.get("style", "")
-            
-            # Build Description from panels
-            description = ""
-            panels = data.get("design_panels", [])
-            for p in panels:
-                view = p.get("view", "")
-                desc = p.get("description", "")
-                description += f"- {view}: {desc}\n"
-            
-            prompt = f"""Character Design Request:
-Name: {name}
-Role: {role}
-Age: {age}
-Personality: {personality}
-Style: {style}
-
-Visual Description:
-{description}
+            entity = session.get(model, entity_id)
+            if not entity:
+                raise ValueError(f"{label} not found")
+            return build_image_task_request(session, task_id, entity_type, entity)
+        except Exception as e:
+            fail_image_task(session, task, entity_type, e)
+            return None
 
-Task: Generate a high-quality character reference sheet (Character Design) based on the above description. 
-Include Front View, Side View, and detailed clothing/accessories. 
-Ensure the character's expression and pose reflect their personality: {personality}.
-"""
-            
-            log_task_event(session, task_id, f"Calling AI service for character {char.name}...")
-            start_time = time.time()
-            try:
-                image_bytes = ai.generate_image(
-                    prompt,
-                    aspect_ratio=char.project.aspect_ratio or "16:9",
-                    resolution=char.project.resolution or "2K"
-                )
-                elapsed = time.time() - start_time
-                log_task_event(session, task_id, f"AI generation finished in {elapsed:.2f}s. Image size: {len(image_bytes)} bytes.")
-            except Exception as e:
-                elapsed = time.time() - start_time
-                log_task_event(session, task_id, f"AI generation failed after {elapsed:.2f}s: {str(e)}")
-                raise e
-            
-            relative_url = save_generated_image(session, char.project_id, "character", char.id, image_bytes)
-            
-            char.image_url = relative_url
-            session.add(char)
+def finish_image_task(task_id: str, entity_type: str, entity_id: int, elapsed: float, image_bytes: Optional[bytes] = None, error: Optional[BaseException] = None):
+    """Saves the rendered image and completes the task, or fails it with `error`."""
+    from app.core.database import engine
+    with Session(engine) as session:
+        task = session.get(Task, task_id)
+        if not task: 
+            logger.error(f"Task {task_id} not found")
+            return
+        
+        try:
+            if error is not None:
+                log_task_event(session, task_id, f"AI generation failed after {elapsed:.2f}s: {error}")
+                raise error
+            log_task_event(session, task_id, f"AI generation finished in {elapsed:.2f}s. Image size: {len(image_bytes)} bytes.")
+        
+            model, label = IMAGE_TASK_ENTITIES[entity_type]
+            entity = session.get(model, entity_id)
+            if not entity:
+                raise ValueError(f"{label} not found")
+            entity.image_url = save_generated_image(session, entity.project_id, entity_type, entity.id, image_bytes)
+            session.add(entity)
             
             task.status = "completed"
             task.progress = 100
             session.add(task)
             session.commit()
-            log_task_event(session, task_id, f"Character task {task_id} completed successfully.")
-            
+            log_task_event(session, task_id, f"{entity_type.capitalize()} task {task_id} completed successfully.")
         except Exception as e:
-            logger.error(f"Character task {task_id} failed: {e}")
-            log_task_event(session, task_id, f"Character task {task_id} failed: {e}")
-            traceback.print_exc()
-            task.status = "failed"
-            task.message = str(e)
-            session.add(task)
-            session.commit()
+            fail_image_task(session, task, entity_type, e)
+            
+def run_image_task(task_id: str, entity_type: str, entity_id: int):
+    request = begin_image_task(task_id, entity_type, entity_id)
+    if request is None:
+        return
+    start_time = time.time()
+    try:
+        image_bytes = render_image_now(**request)
+    except Exception as e:
+        finish_image_task(task_id, entity_type, entity_id, time.time() - start_time, error=e)
+        return
+    finish_image_task(task_id, entity_type, entity_id, time.time() - start_time, image_bytes=image_bytes)
+
+async def run_image_task_async(task_id: str, entity_type: str, entity_id: int):
+    request = await asyncio.to_thread(begin_image_task, task_id, entity_type, entity_id)
+    if request is None:
+        return
+    start_time = time.time()
+    try:
+        image_bytes = await AsyncAIService().generate_image(**request)
+    except Exception as e:
+        await asyncio.to_thread(finish_image_task, task_id, entity_type, entity_id, time.time() - start_time, error=e)
+        return
+    await asyncio.to_thread(finish_image_task, task_id, entity_type, entity_id, time.time() - start_time, image_bytes=image_bytes)
+
+def generate_character_task(task_id: str, character_id: int):
+    logger.info(f"Starting character generation task: {task_id} for char: {character_id}")
+    run_image_task(task_id, "character", character_id)
+
+async def generate_character_task_async(task_id: str, character_id: int):
+    logger.info(f"Starting character generation task: {task_id} for char: {character_id}")
+    await run_image_task_async(task_id, "character", character_id)
+
+def generate_panel_task(task_id: str, item_id: int):
+    logger.info(f"Starting panel generation task: {task_id} for item: {item_id}")
+    run_image_task(task_id, "panel", item_id)
+
+async def generate_panel_task_async(task_id: str, item_id: int):
+    logger.info(f"Starting panel generation task: {task_id} for item: {item_id}")
+    await run_image_task_async(task_id, "panel", item_id)
 
 # --- Endpoints ---
 
@@ -676,6 +1008,8 @@ from pydantic import BaseModel
 
 class StoryboardRequest(BaseModel):
     user_input: str
+    # Also draw character sheets; with STORYBOARD_STREAMING they start before the storyboard is finished
+    render_characters: bool = False
 
 @router.post("/storyboard/{project_id}")
 def generate_storyboard(
@@ -709,7 +1043,7 @@ def generate_storyboard(
     session.refresh(task)
     logger.info(f"Task created: {task.id}")
     
-    background_tasks.add_task(generate_storyboard_task, task.id, project_id, user_input)
+    dispatch_task(background_tasks, session, task, generate_storyboard_task, project_id, user_input, request.render_characters)
     
     return {"task_id": task.id}
 
@@ -717,6 +1051,8 @@ def generate_storyboard(
 def generate_all_images(
     project_id: str, 
     background_tasks: BackgroundTasks,
+    concurrency: Optional[int] = None,
+    resume: bool = False,
     session: Session = Depends(get_session)
 ):
     logger.info(f"Received request to generate all images for project {project_id}")
@@ -730,14 +1066,14 @@ def generate_all_images(
         status="pending", 
         project_id=project_id,
         name="Batch Generate Images",
-        description="Generating all storyboard images"
+        description="Generating missing storyboard images" if resume else "Generating all storyboard images"
     )
     session.add(task)
     session.commit()
     session.refresh(task)
     logger.info(f"Task created: {task.id}")
     
-    background_tasks.add_task(generate_all_images_task, task.id, project_id)
+    dispatch_task(background_tasks, session, task, generate_all_images_task, project_id, concurrency, resume)
     
     return {"task_id": task.id}
 
@@ -773,7 +1109,7 @@ def generate_all_characters(
     session.refresh(task)
     logger.info(f"Task created: {task.id}")
     
-    background_tasks.add_task(generate_all_characters_task, task.id, project_id)
+    dispatch_task(background_tasks, session, task, generate_all_characters_task, project_id)
     
     return {"task_id": task.id}
 
@@ -798,116 +1134,10 @@ def generate_character(
     session.commit()
     session.refresh(task)
     
-    background_tasks.add_task(generate_character_task, task.id, character_id)
+    dispatch_task(background_tasks, session, task, generate_character_task, character_id, async_handler=generate_character_task_async)
     
     return {"task_id": task.id}
 
-def generate_panel_task(task_id: str, item_id: int):
-    logger.info(f"Starting panel generation task: {task_id} for item: {item_id}")
-    from app.core.database import engine
-    with Session(engine) as session:
-        task = session.get(Task, task_id)
-        if not task:
-            logger.error(f"Task {task_id} not found")
-            return
-            
-        task.status = "processing"
-        session.add(task)
-        session.commit()
-        
-        try:
-            item = session.get(StoryboardItem, item_id)
-            if not item:
-                 raise ValueError("Storyboard item not found")
-            
-            project = item.project
-            ai = AIService(session)
-            json_prompt = json.dumps(item.data, ensure_ascii=False, indent=2)
-            json_prompt += "\n\n use json block as user input prompt to generate 2*2 grid comic image."
-            
-            context_images = []
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            
-            # 1. Find Character Images
-            # STRICT POLICY: Only use the currently active character image (p_char.image_url).
-            # Do NOT search ImageHistory or other versions. This ensures consistency with the user's current selection.
-            char_names = item.data.get("characters", [])
-            if isinstance(char_names, str): char_names = [char_names]
-            elif isinstance(char_names, list):
-                names = []
-                for c in char_names:
-                    if isinstance(c, dict): names.append(c.get("name", ""))
-                    elif isinstance(c, str): names.append(c)
-                char_names = names
-        
-            if project.characters:
-                for name in char_names:
-                    for p_char in project.characters:
-                        if p_char.image_url and (p_char.name in name or name in p_char.name):
-                            rel_path = p_char.image_url.lstrip("/")
-                            abs_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
-                            if os.path.exists(abs_path) and abs_path not in context_images:
-                                context_images.append(abs_path)
-            
-            # 2. Previous Panels - RE-ENABLED but with strict filtering
-            # We want to use PREVIOUSLY CONFIRMED panels as reference to maintain consistency,
-            # but NOT the current panel's old version (which we are regenerating).
-            # STRICT POLICY: Only use currently active panel images (i.image_url) from the database.
-            
-            # Filter logic:
-            # - Use panels with sequence number LESS than current item.sequence
-            # - Ensure they have an image_url (meaning they are generated/confirmed)
-            # - Limit to last 3 to keep context fresh but manageable
-            
-            prev_items = sorted([i for i in project.storyboard_items if i.sequence < item.sequence and i.image_url], key=lambda x: x.sequence)
-            if prev_items:
-                selected = []
-                if len(prev_items) >= 3:
-                    selected = [prev_items[0]] + prev_items[-2:] # First one + last two
-                else:
-                    selected = prev_items
-                    
-                for prev in selected:
-                    rel_path = prev.image_url.lstrip("/")
-                    abs_path = os.path.join(base_dir, rel_path.replace("/", os.sep))
-                    if os.path.exists(abs_path) and abs_path not in context_images:
-                        context_images.append(abs_path)
-            
-            # Style Consistency
-            meta_style = item.data.get("meta_info", {}).get("style", "")
-            if not meta_style and project.global_config:
-                meta_style = project.global_config.data.get("style", "")
-                
-            if meta_style:
-                 json_prompt += f"\n\nStyle Consistency Requirement: {meta_style}. Ensure the visual style matches the provided context images."
-        
-            log_task_event(session, task_id, f"Calling AI service for panel {item.sequence}...")
-            image_bytes = ai.generate_image(
-                json_prompt,  
-                context_images=context_images,
-                aspect_ratio=project.aspect_ratio or "16:9",
-                resolution=project.resolution or "2K"
-            )
-            
-            relative_url = save_generated_image(session, project.id, "panel", item.id, image_bytes)
-            item.image_url = relative_url
-            session.add(item)
-            
-            task.status = "completed"
-            task.progress = 100
-            session.add(task)
-            session.commit()
-            log_task_event(session, task_id, f"Panel task {task_id} completed successfully.")
-            
-        except Exception as e:
-            logger.error(f"Panel task {task_id} failed: {e}")
-            log_task_event(session, task_id, f"Panel task {task_id} failed: {e}")
-            traceback.print_exc()
-            task.status = "failed"
-            task.message = str(e)
-            session.add(task)
-            session.commit()
-
 @router.post("/panel/{item_id}")
 def generate_panel(
     item_id: int, 
@@ -929,6 +1159,20 @@ def generate_panel(
     session.commit()
     session.refresh(task)
     
-    background_tasks.add_task(generate_panel_task, task.id, item_id)
+    dispatch_task(background_tasks, session, task, generate_panel_task, item_id, async_handler=generate_panel_task_async)
     
     return {"task_id": task.id}
+
+# Handlers a worker process may run from a queued Task row (see app/services/task_queue.py)
+QUEUE_HANDLERS = {
+    handler.__name__: handler
+    for handler in (
+        generate_storyboard_task,
+        generate_all_images_task,
+        generate_all_characters_task,
+        generate_character_task,
+        generate_panel_task,
+    )
+}
+# Rows queued under the former *_task_async handler names run the same tasks
+QUEUE_HANDLERS.update({f"{name}_async": handler for name, handler in list(QUEUE_HANDLERS.items())})
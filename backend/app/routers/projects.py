@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
 from sqlmodel import Session
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 from app.core.database import get_session
 from app.models.models import Project, GlobalConfig, Character, StoryboardItem
-from app.schemas.schemas import ProjectCreate, ProjectUpdate, ProjectRead
+from app.schemas.schemas import ProjectCreate, ProjectUpdate, ProjectRead, ProjectSummary, StoryboardItemRead, StoryboardPage
 from app.cruds import crud_project
-from app.services.consistency_service import ConsistencyService
+from app.services.consistency_service import ConsistencyService, build_character_registry
+from app.services.project_read_cache import project_read_cache
+from app.utils.fields import parse_fields, fields_key, dump_fields
+import copy
+import hashlib
+import json
 
 router = APIRouter()
 
@@ -14,16 +19,72 @@ router = APIRouter()
 def create_project(project_in: ProjectCreate, session: Session = Depends(get_session)):
     return crud_project.create_project(session, project_in)
 
-@router.get("/", response_model=List[Project])
+@router.get("/", response_model=List[ProjectSummary])
 def read_projects(skip: int = 0, limit: int = 100, session: Session = Depends(get_session)):
-    return crud_project.get_projects(session, skip, limit)
+    return crud_project.get_project_summaries(session, skip, limit)
 
-@router.get("/{project_id}", response_model=ProjectRead)
-def read_project(project_id: str, session: Session = Depends(get_session)):
-    project = crud_project.get_project(session, project_id)
-    if not project:
+def parse_fields_or_400(fields: Optional[str], model):
+    try:
+        return parse_fields(fields, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def versioned_response(request: Request, session: Session, project_id: str, variant: str, build):
+    """
+    Serves a project read (full project, fieldset or storyboard page, named by `variant`).
+    The project's version counter changes with every write, so it doubles as the ETag:
+    an unchanged project costs one indexed SELECT and a 304, or a cached body.
+    """
+    version = crud_project.get_project_version(session, project_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return project
+    etag = f"{project_id}-{version}"
+    if variant:
+        etag += "-" + hashlib.sha1(variant.encode("utf-8")).hexdigest()[:12]
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if headers["ETag"] in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    # A write landing between the version read and build() only makes the body newer than
+    # its key; the next request sees the new version and rebuilds
+    body = project_read_cache.get(project_id, version, variant)
+    if body is None:
+        body = build()
+        project_read_cache.put(project_id, version, body, variant)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/{project_id}", response_model=ProjectRead)
+def read_project(project_id: str, request: Request, fields: Optional[str] = None, session: Session = Depends(get_session)):
+    """`fields` selects a sparse fieldset, e.g. "title,storyboard_items.id,storyboard_items.image_url"."""
+    spec = parse_fields_or_400(fields, ProjectRead)
+    
+    def build():
+        if spec is None:
+            project = crud_project.get_project_with_relations(session, project_id)
+            return ProjectRead.model_validate(project).model_dump_json().encode("utf-8")
+        relations = {name: spec[name] for name in crud_project.PROJECT_RELATIONS if name in spec}
+        project = crud_project.get_project_with_relations(session, project_id, relations)
+        return json.dumps(dump_fields(project, ProjectRead, spec), ensure_ascii=False).encode("utf-8")
+    
+    return versioned_response(request, session, project_id, fields_key(spec), build)
+
+@router.get("/{project_id}/storyboard", response_model=StoryboardPage)
+def read_storyboard(project_id: str, request: Request, start: int = 1, end: Optional[int] = None, limit: int = Query(100, ge=1, le=1000),
+                    fields: Optional[str] = None, session: Session = Depends(get_session)):
+    """Storyboard items with start <= sequence <= end (at most `limit`), optionally with a sparse fieldset."""
+    spec = parse_fields_or_400(fields, StoryboardItemRead)
+    
+    def build():
+        total, items = crud_project.get_storyboard_page(session, project_id, start, end, limit, set(spec) if spec else None)
+        if spec is None:
+            rows = [StoryboardItemRead.model_validate(item).model_dump(mode="json") for item in items]
+        else:
+            rows = [dump_fields(item, StoryboardItemRead, spec) for item in items]
+        page = StoryboardPage(project_id=project_id, start=start, end=end, total=total, items=rows)
+        return page.model_dump_json().encode("utf-8")
+    
+    variant = f"storyboard:{start}:{end}:{limit}:{fields_key(spec)}"
+    return versioned_response(request, session, project_id, variant, build)
 
 @router.put("/{project_id}", response_model=Project)
 def update_project(project_id: str, project_in: ProjectUpdate, session: Session = Depends(get_session)):
@@ -61,12 +122,13 @@ def update_global_config(project_id: str, data: Dict = Body(...), session: Sessi
     session.commit()
     session.refresh(project)
     
-    # 2. Update GlobalConfig in DB
+    # 2. Update GlobalConfig in DB (keep the previous data to diff against)
+    old_data = copy.deepcopy(project.global_config.data) if project.global_config else None
     config = crud_project.create_global_config(session, project_id, data)
     
-    # 3. Trigger consistency check (Propagate to all items)
+    # 3. Trigger consistency check (Propagate the changed fields to the items they affect)
     consistency = ConsistencyService(session)
-    consistency.normalize_project(project_id)
+    consistency.normalize_config_change(project_id, old_data, data)
     
     return config
 
@@ -136,9 +198,14 @@ def merge_characters(
     # 1. Update Storyboard Items
     # We need to scan all items and replace source names with target name
     project = session.get(Project, project_id)
+    # One matcher pass per item finds the items that mention a source character at all
+    _, source_matcher = build_character_registry(source_names)
     if project.storyboard_items:
         for item in project.storyboard_items:
-            data = item.data
+            if not source_matcher.find_all(json.dumps(item.data.get("characters", []), ensure_ascii=False)):
+                continue
+            # Copy so the JSON column sees a new value (in-place edits are not tracked)
+            data = copy.deepcopy(item.data)
             # 'characters' field in storyboard item data
             # It can be a list of strings, or list of dicts with 'name' key, or a single string
             chars = data.get("characters", [])
@@ -1,17 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlmodel import Session
-from app.core.database import get_session
+from typing import Optional
+from app.core.database import get_session, engine
+from app.core.config import settings
 from app.models.models import Task
-from app.schemas.schemas import TaskRead
+from app.schemas.schemas import TaskRead, TaskLogPage
+from app.services.task_log_service import get_task_logs, count_task_logs_by_task
+from app.services.task_events import task_event_bus, task_status_payload, TERMINAL_STATUSES
+import asyncio
+import json
 
 router = APIRouter()
 
+def to_task_read(session: Session, task: Task, log_offset: int = 0, log_limit: Optional[int] = None) -> TaskRead:
+    logs, total = get_task_logs(session, task, log_offset, log_limit)
+    task_read = TaskRead.model_validate(task)
+    task_read.logs = logs
+    task_read.log_count = total
+    return task_read
+
 @router.get("/{task_id}", response_model=TaskRead)
-def get_task_status(task_id: str, session: Session = Depends(get_session)):
+def get_task_status(
+    task_id: str,
+    log_offset: int = Query(0, ge=0),
+    log_limit: Optional[int] = Query(None, ge=0),
+    session: Session = Depends(get_session)
+):
     task = session.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+    return to_task_read(session, task, log_offset, log_limit)
+
+@router.get("/{task_id}/logs", response_model=TaskLogPage)
+def get_task_log_page(
+    task_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(200, ge=1, le=1000),
+    session: Session = Depends(get_session)
+):
+    task = session.get(Task, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    logs, total = get_task_logs(session, task, offset, limit)
+    return TaskLogPage(task_id=task_id, offset=offset, total=total, logs=logs)
 
 @router.get("/project/{project_id}", response_model=list[TaskRead])
 def get_project_tasks(project_id: str, session: Session = Depends(get_session)):
@@ -20,7 +53,17 @@ def get_project_tasks(project_id: str, session: Session = Depends(get_session)):
     tasks = session.exec(statement).all()
     # Filter only recent or active tasks if list is too long?
     # For now return all, maybe limit 20
-    return tasks[:20]
+    tasks = tasks[:20]
+    
+    # Log lines are fetched per task via /{task_id}/logs; the list only carries counts
+    counts = count_task_logs_by_task(session, [t.id for t in tasks])
+    results = []
+    for task in tasks:
+        task_read = TaskRead.model_validate(task)
+        task_read.logs = []
+        task_read.log_count = counts.get(task.id, len(task.logs or []))
+        results.append(task_read)
+    return results
 
 @router.post("/{task_id}/cancel", response_model=TaskRead)
 def cancel_task(task_id: str, session: Session = Depends(get_session)):
@@ -29,11 +72,91 @@ def cancel_task(task_id: str, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Task not found")
     
     if task.status in ["completed", "failed", "cancelled"]:
-        return task
+        return to_task_read(session, task)
         
     task.status = "cancelled"
     task.message = "Task cancelled by user"
     session.add(task)
     session.commit()
     session.refresh(task)
-    return task
\ No newline at end of file
+    return to_task_read(session, task)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def load_task_snapshot(task_id: str, log_offset: int):
+    with Session(engine) as session:
+        task = session.get(Task, task_id)
+        if not task:
+            return None, [], 0
+        logs, total = get_task_logs(session, task, log_offset)
+        return task_status_payload(task), logs, total
+
+@router.get("/{task_id}/stream")
+async def stream_task(task_id: str, request: Request, log_offset: int = Query(0, ge=0)):
+    """
+    Server-Sent Events stream of a task: one 'status' snapshot plus the log backlog from
+    `log_offset`, then live 'status' and 'log' events as the task publishes them.
+    """
+    # Subscribe before reading the backlog so no line falls between the two
+    queue = task_event_bus.subscribe(task_id)
+    status, logs, total = await run_in_threadpool(load_task_snapshot, task_id, log_offset)
+    if status is None:
+        task_event_bus.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    async def event_stream():
+        next_index = log_offset + len(logs)
+        finished = status["status"] in TERMINAL_STATUSES
+        last_status = status
+        try:
+            yield format_sse("status", status)
+            for i, line in enumerate(logs):
+                yield format_sse("log", {"type": "log", "task_id": task_id, "index": log_offset + i, "line": line})
+            
+            while True:
+                if await request.is_disconnected():
+                    break
+                # After a terminal status, linger briefly for the closing log lines.
+                # Queued tasks run in worker processes whose events never reach this
+                # bus, so poll the DB on a short interval instead.
+                timeout = 2 if finished or settings.TASK_QUEUE_ENABLED else 15
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if finished:
+                        break
+                    if settings.TASK_QUEUE_ENABLED:
+                        latest, new_logs, _ = await run_in_threadpool(load_task_snapshot, task_id, next_index)
+                        if latest is None:
+                            break
+                        for line in new_logs:
+                            yield format_sse("log", {"type": "log", "task_id": task_id, "index": next_index, "line": line})
+                            next_index += 1
+                        if latest != last_status:
+                            last_status = latest
+                            finished = latest["status"] in TERMINAL_STATUSES
+                            yield format_sse("status", latest)
+                        continue
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                if payload["type"] == "log":
+                    if payload["index"] < next_index:
+                        continue
+                    next_index = payload["index"] + 1
+                else:
+                    last_status = payload
+                    finished = payload["status"] in TERMINAL_STATUSES
+                yield format_sse(payload["type"], payload)
+            
+            yield format_sse("end", {"task_id": task_id, "log_count": max(next_index, total)})
+        finally:
+            task_event_bus.unsubscribe(task_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
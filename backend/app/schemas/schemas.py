@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Any
 from datetime import datetime
 from app.models.models import (
     ModelConfigBase, ProjectBase, CharacterBase, StoryboardItemBase, GlobalConfigBase, TaskBase,
@@ -37,6 +37,13 @@ class TaskRead(TaskBase):
     created_at: datetime
     updated_at: datetime
     logs: List[str] = []
+    log_count: int = 0
+
+class TaskLogPage(BaseModel):
+    task_id: str
+    offset: int
+    total: int
+    logs: List[str] = []
 
 # Project
 class ProjectCreate(ProjectBase):
@@ -59,3 +66,26 @@ class ProjectRead(ProjectBase):
     characters: List[CharacterRead] = []
     storyboard_items: List[StoryboardItemRead] = []
     global_config: Optional[GlobalConfigRead] = None
+
+class ProjectSummary(BaseModel):
+    # Dashboard card: project metadata without story_input or any data blobs
+    id: str
+    title: str
+    description: Optional[str] = None
+    theme: Optional[str] = None
+    language: Optional[str] = None
+    panel_count: Optional[int] = None
+    aspect_ratio: Optional[str] = None
+    resolution: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    character_count: int = 0
+    storyboard_count: int = 0
+    thumbnail_url: Optional[str] = None
+
+class StoryboardPage(BaseModel):
+    project_id: str
+    start: int
+    end: Optional[int] = None
+    total: int
+    items: List[Dict[str, Any]] = []
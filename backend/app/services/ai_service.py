@@ -1,45 +1,203 @@
 import os
 import time
+import asyncio
 import logging
-from typing import List, Optional
+import threading
+from typing import List, Optional, Dict, Tuple, Any, Iterator, AsyncIterator
 from sqlmodel import Session
 from app.models.models import ModelConfig
+from app.core.config import settings
+from app.services.result_cache import get_result_cache
+from app.services.context_image_cache import context_image_cache, context_upload_metrics
 from google import genai
 from google.genai import types
-from PIL import Image
-import io
 
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """
+    Thread-safe token bucket. `reserve()` takes a token (possibly going into debt)
+    and returns how long the caller must wait before sending its request.
+    """
+    def __init__(self, rate_per_minute: int, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
 class AIService:
-    def __init__(self, session: Session):
+    # One bucket per provider, shared by every AIService instance in the process
+    _rate_limiters: Dict[str, TokenBucket] = {}
+    _rate_limiters_lock = threading.Lock()
+
+    # Provider clients keyed by (provider, api_key, base_url, model_name). Reusing a client
+    # reuses its HTTP connection pool, so keep-alive connections stay warm across calls.
+    _clients: Dict[Tuple[str, str, Optional[str], str], Any] = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, session: Optional[Session] = None):
         self.session = session
         
     def _get_client(self, model_type: str):
         from app.cruds.crud_config import get_active_config
-        config = get_active_config(self.session, model_type)
+        if self.session is None:
+            # No caller session (AsyncAIService): a short one of our own
+            from app.core.database import engine
+            with Session(engine) as session:
+                config = get_active_config(session, model_type)
+        else:
+            config = get_active_config(self.session, model_type)
         
         if not config:
             raise ValueError(f"No active configuration found for {model_type} model.")
             
+        key = (config.provider.lower(), config.api_key, config.base_url or None, config.model_name)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._create_client(config)
+                self._clients[key] = client
+        return client, config
+
+    def _create_client(self, config: ModelConfig):
         if config.provider.lower() == "google":
             # Initialize Google Client
-            return genai.Client(api_key=config.api_key), config.model_name
+            http_options = types.HttpOptions(base_url=config.base_url) if config.base_url else None
+            return genai.Client(api_key=config.api_key, http_options=http_options)
             
         raise NotImplementedError(f"Provider {config.provider} not supported yet.")
 
+    @classmethod
+    def invalidate_client_cache(cls):
+        """
+        Drops all cached clients. Called whenever a ModelConfig is created, updated or deleted.
+        Clients are not closed here because in-flight generations may still be using them.
+        """
+        with cls._clients_lock:
+            cls._clients.clear()
+
+    @classmethod
+    def _get_rate_limiter(cls, provider: str) -> Optional[TokenBucket]:
+        if settings.PROVIDER_REQUESTS_PER_MINUTE <= 0:
+            return None
+        key = provider.lower()
+        with cls._rate_limiters_lock:
+            if key not in cls._rate_limiters:
+                cls._rate_limiters[key] = TokenBucket(
+                    settings.PROVIDER_REQUESTS_PER_MINUTE,
+                    settings.PROVIDER_RATE_LIMIT_BURST
+                )
+            return cls._rate_limiters[key]
+
+    def _wait_for_rate_limit(self, config: ModelConfig):
+        limiter = self._get_rate_limiter(config.provider)
+        if limiter:
+            limiter.acquire()
+
+    def _lookup_result_cache(self, kind: str, model_name: str, prompt: str, context_images: Optional[List[str]] = None, **config):
+        """Returns (cache, key, cached bytes or None). cache is None when RESULT_CACHE_ENABLED is off."""
+        cache = get_result_cache()
+        if cache is None:
+            return None, None, None
+        if context_images:
+            # What the model sees depends on how context images are downscaled/encoded
+            config["context_encoding"] = [settings.CONTEXT_IMAGE_MAX_EDGE, settings.CONTEXT_IMAGE_FORMAT.upper(), settings.CONTEXT_IMAGE_QUALITY]
+        key = cache.make_key(kind, model_name, prompt, context_images, **config)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Result cache hit for {kind} ({key[:12]})")
+        return cache, key, cached
+
+    def _build_storyboard_prompt(self, system_prompt: str, user_input: str) -> str:
+        return f"{system_prompt}\n\nUser Input: {user_input}\n\nPlease generate the full storyboard in JSON format as requested."
+
+    def _build_image_contents(self, model_name: str, prompt: str, context_images: Optional[List[str]]) -> list:
+        """Prompt plus prepared context images; records this call's upload sizes in context_upload_metrics."""
+        contents = [prompt]
+        original_bytes = 0
+        upload_bytes = 0
+        if context_images:
+            for img_path in context_images:
+                if os.path.exists(img_path):
+                    try:
+                        # Encoded (downscaled) bytes come from the shared cache instead of re-decoding the file
+                        data, mime_type, original_size = context_image_cache.get(img_path)
+                        contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+                        original_bytes += original_size
+                        upload_bytes += len(data)
+                    except Exception as e:
+                        logger.warning(f"Failed to load context image {img_path}: {e}")
+                else:
+                    # Log missing context image but don't fail, just skip it
+                    logger.warning(f"Warning: Context image not found at {img_path}, skipping.")
+        if original_bytes:
+            call = context_upload_metrics.record(model_name, len(contents) - 1, original_bytes, upload_bytes)
+            saved = call["saved_bytes"]
+            logger.info(
+                f"Context images: {call['files']} files, {original_bytes // 1024} KB -> {upload_bytes // 1024} KB "
+                f"(saved {saved // 1024} KB, {saved * 100 // original_bytes}%)"
+            )
+        return contents
+
+    def _build_image_config(self, aspect_ratio: str, resolution: str) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            image_config=types.ImageConfig(
+                aspect_ratio=aspect_ratio,
+                image_size=resolution
+            ),
+        )
+
+    def _extract_image(self, response, attempt: int) -> Optional[bytes]:
+        if response.parts:
+            for part in response.parts:
+                if part.inline_data is not None:
+                    image_data = part.inline_data.data
+                    if len(image_data) > 0:
+                        logger.info(f"DEBUG: Successfully received image data ({len(image_data)} bytes)")
+                        return image_data
+                    else:
+                        logger.warning(f"Warning: Received empty image data on attempt {attempt + 1}")
+        
+        # Check for text refusal/error
+        if response.text:
+            logger.warning(f"Model response text (no image): {response.text}")
+        return None
+
     def generate_storyboard(self, system_prompt: str, user_input: str) -> str:
-        client, model_name = self._get_client("text")
+        client, config = self._get_client("text")
+        model_name = config.model_name
         
-        full_prompt = f"{system_prompt}\n\nUser Input: {user_input}\n\nPlease generate the full storyboard in JSON format as requested."
+        full_prompt = self._build_storyboard_prompt(system_prompt, user_input)
+        cache, cache_key, cached = self._lookup_result_cache("storyboard", model_name, full_prompt)
+        if cached is not None:
+            return cached.decode("utf-8")
         
         max_retries = 3
         for attempt in range(max_retries):
             try:
+                self._wait_for_rate_limit(config)
                 response = client.models.generate_content(
                     model=model_name,
                     contents=full_prompt
                 )
+                if cache and response.text:
+                    cache.put(cache_key, response.text.encode("utf-8"))
                 return response.text
             except Exception as e:
                 logger.error(f"Error generating storyboard (Attempt {attempt + 1}/{max_retries}): {e}")
@@ -48,21 +206,53 @@ class AIService:
                     continue
                 raise e
 
+    def generate_storyboard_stream(self, system_prompt: str, user_input: str) -> Iterator[str]:
+        """
+        Streaming variant of generate_storyboard: yields text chunks as the model writes them.
+        Retries only happen before the first chunk; a stream that breaks midway raises.
+        """
+        client, config = self._get_client("text")
+        model_name = config.model_name
+        
+        full_prompt = self._build_storyboard_prompt(system_prompt, user_input)
+        cache, cache_key, cached = self._lookup_result_cache("storyboard", model_name, full_prompt)
+        if cached is not None:
+            yield cached.decode("utf-8")
+            return
+        
+        max_retries = 3
+        for attempt in range(max_retries):
+            received = []
+            try:
+                self._wait_for_rate_limit(config)
+                for chunk in client.models.generate_content_stream(
+                    model=model_name,
+                    contents=full_prompt
+                ):
+                    if chunk.text:
+                        received.append(chunk.text)
+                        yield chunk.text
+                if cache and received:
+                    cache.put(cache_key, "".join(received).encode("utf-8"))
+                return
+            except Exception as e:
+                logger.error(f"Error streaming storyboard (Attempt {attempt + 1}/{max_retries}): {e}")
+                if not received and attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)
+                    continue
+                raise e
+
     def generate_image(self, prompt: str, context_images: List[str] = None, aspect_ratio: str = "16:9", resolution: str = "2K") -> bytes:
-        client, model_name = self._get_client("image")
+        client, config = self._get_client("image")
+        model_name = config.model_name
         
-        contents = [prompt]
-        if context_images:
-            for img_path in context_images:
-                if os.path.exists(img_path):
-                    try:
-                        prev_img = Image.open(img_path)
-                        contents.append(prev_img)
-                    except Exception as e:
-                        logger.warning(f"Failed to load context image {img_path}: {e}")
-                else:
-                    # Log missing context image but don't fail, just skip it
-                    logger.warning(f"Warning: Context image not found at {img_path}, skipping.")
+        cache, cache_key, cached = self._lookup_result_cache(
+            "image", model_name, prompt, context_images, aspect_ratio=aspect_ratio, resolution=resolution
+        )
+        if cached is not None:
+            return cached
+        
+        contents = self._build_image_contents(model_name, prompt, context_images)
 
         # Retry loop
         max_retries = 3
@@ -73,31 +263,19 @@ class AIService:
                 if context_images:
                     logger.info(f"DEBUG: Context images count: {len(context_images)}")
 
+                self._wait_for_rate_limit(config)
                 response = client.models.generate_content(
                     model=model_name,
                     contents=contents,
-                    config=types.GenerateContentConfig(
-                        image_config=types.ImageConfig(
-                            aspect_ratio=aspect_ratio,
-                            image_size=resolution
-                        ),
-                    )
+                    config=self._build_image_config(aspect_ratio, resolution)
                 )
                 logger.info(f"DEBUG: Generation API call completed for attempt {attempt + 1}")
                 
-                if response.parts:
-                    for part in response.parts:
-                        if part.inline_data is not None:
-                            image_data = part.inline_data.data
-                            if len(image_data) > 0:
-                                logger.info(f"DEBUG: Successfully received image data ({len(image_data)} bytes)")
-                                return image_data
-                            else:
-                                logger.warning(f"Warning: Received empty image data on attempt {attempt + 1}")
-                
-                # Check for text refusal/error
-                if response.text:
-                    logger.warning(f"Model response text (no image): {response.text}")
+                image_data = self._extract_image(response, attempt)
+                if image_data:
+                    if cache:
+                        cache.put(cache_key, image_data)
+                    return image_data
                     
                 logger.warning(f"Attempt {attempt + 1} failed: No valid image data found in response.")
                 if attempt == max_retries - 1:
@@ -112,3 +290,123 @@ class AIService:
                     continue
                 raise e
         return b""
+
+class AsyncAIService(AIService):
+    """
+    Asyncio variant of AIService. Uses the async surface of google.genai (client.aio)
+    and asyncio.sleep for backoff/rate limiting, so many generations can share one event loop
+    (see generation_loop). Create it without a session: the config lookup, cache and context
+    image reads run in worker threads (asyncio.to_thread) with their own short sessions.
+    """
+
+    async def _wait_for_rate_limit_async(self, config: ModelConfig):
+        limiter = self._get_rate_limiter(config.provider)
+        if limiter:
+            delay = limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def generate_storyboard(self, system_prompt: str, user_input: str) -> str:
+        client, config = await asyncio.to_thread(self._get_client, "text")
+        model_name = config.model_name
+        
+        full_prompt = self._build_storyboard_prompt(system_prompt, user_input)
+        cache, cache_key, cached = await asyncio.to_thread(self._lookup_result_cache, "storyboard", model_name, full_prompt)
+        if cached is not None:
+            return cached.decode("utf-8")
+        
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                await self._wait_for_rate_limit_async(config)
+                response = await client.aio.models.generate_content(
+                    model=model_name,
+                    contents=full_prompt
+                )
+                if cache and response.text:
+                    await asyncio.to_thread(cache.put, cache_key, response.text.encode("utf-8"))
+                return response.text
+            except Exception as e:
+                logger.error(f"Error generating storyboard (Attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise e
+
+    async def generate_storyboard_stream(self, system_prompt: str, user_input: str) -> AsyncIterator[str]:
+        client, config = await asyncio.to_thread(self._get_client, "text")
+        model_name = config.model_name
+        
+        full_prompt = self._build_storyboard_prompt(system_prompt, user_input)
+        cache, cache_key, cached = await asyncio.to_thread(self._lookup_result_cache, "storyboard", model_name, full_prompt)
+        if cached is not None:
+            yield cached.decode("utf-8")
+            return
+        
+        max_retries = 3
+        for attempt in range(max_retries):
+            received = []
+            try:
+                await self._wait_for_rate_limit_async(config)
+                stream = await client.aio.models.generate_content_stream(
+                    model=model_name,
+                    contents=full_prompt
+                )
+                async for chunk in stream:
+                    if chunk.text:
+                        received.append(chunk.text)
+                        yield chunk.text
+                if cache and received:
+                    await asyncio.to_thread(cache.put, cache_key, "".join(received).encode("utf-8"))
+                return
+            except Exception as e:
+                logger.error(f"Error streaming storyboard (Attempt {attempt + 1}/{max_retries}): {e}")
+                if not received and attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise e
+
+    async def generate_image(self, prompt: str, context_images: List[str] = None, aspect_ratio: str = "16:9", resolution: str = "2K") -> bytes:
+        client, config = await asyncio.to_thread(self._get_client, "image")
+        model_name = config.model_name
+        
+        cache, cache_key, cached = await asyncio.to_thread(
+            self._lookup_result_cache, "image", model_name, prompt, context_images, aspect_ratio=aspect_ratio, resolution=resolution
+        )
+        if cached is not None:
+            return cached
+        
+        contents = await asyncio.to_thread(self._build_image_contents, model_name, prompt, context_images)
+
+        # Retry loop
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                logger.info(f"DEBUG: Starting async image generation attempt {attempt + 1}/{max_retries} with model {model_name}...")
+
+                await self._wait_for_rate_limit_async(config)
+                response = await client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=self._build_image_config(aspect_ratio, resolution)
+                )
+                
+                image_data = self._extract_image(response, attempt)
+                if image_data:
+                    if cache:
+                        await asyncio.to_thread(cache.put, cache_key, image_data)
+                    return image_data
+                    
+                logger.warning(f"Attempt {attempt + 1} failed: No valid image data found in response.")
+                if attempt == max_retries - 1:
+                    raise ValueError(f"No image found in response after {max_retries} retries. Last response: {response.text if response.text else 'Empty'}")
+                
+                await asyncio.sleep(2 ** attempt)
+                
+            except Exception as e:
+                logger.error(f"Error generating image (Attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                raise e
+        return b""
@@ -1,18 +1,125 @@
 import re
 import json
 import copy
-from typing import List, Dict, Any
+import logging
+from typing import List, Dict, Any, Optional
+from sqlalchemy import update
 from sqlmodel import Session, select
 from app.models.models import Project, Character, StoryboardItem, GlobalConfig
+from app.cruds.crud_project import bump_project_version
+from app.utils.name_matcher import NameMatcher
+
+logger = logging.getLogger(__name__)
+
+def character_keywords(full_name: str) -> List[str]:
+    """A character's full name plus its short form without the bracketed alias, e.g. "Ma (Butler)" -> "Ma"."""
+    keywords = [full_name]
+    simplified = re.split(r'[（\(]', full_name)[0].strip()
+    if simplified and simplified != full_name:
+        keywords.append(simplified)
+    return keywords
+
+def build_character_registry(names: List[str]):
+    """Returns (keyword -> full name, NameMatcher over the keywords) for a project's cast."""
+    known_characters = {}
+    for full_name in names:
+        if not full_name: continue
+        for kw in character_keywords(full_name):
+            if kw:
+                known_characters[kw] = full_name
+    return known_characters, NameMatcher(known_characters)
+
+# Config fields propagated into every storyboard item's meta_info (and the subset copied to characters)
+MASTER_META_DEFAULTS = {
+    "style": None,
+    "bubble_style": None,
+    "narration_style": None,
+    "border_style": None,
+    "gutter_style": None,
+    "layout_settings": None,
+    "aspect_ratio": "16:9",
+    "language": "English",
+}
+CHARACTER_META_FIELDS = ("style", "language", "aspect_ratio")
+
+def master_meta_from_config(config_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Explicitly maps all config fields we want to sync into meta_info."""
+    if not config_data:
+        return {}
+    return {key: config_data.get(key, default) for key, default in MASTER_META_DEFAULTS.items()}
+
+def diff_master_meta(old_meta: Dict[str, Any], new_meta: Dict[str, Any]) -> Dict[str, Any]:
+    """The master meta fields whose value changed between two configs."""
+    return {key: value for key, value in new_meta.items() if old_meta.get(key) != value}
+
+def apply_master_meta(meta: Dict[str, Any], master_meta: Dict[str, Any]):
+    """Overwrites style configs in an item's meta in place, preserving other fields (like volume)."""
+    for key, value in master_meta.items():
+        if key == "volume": continue
+
+        # "if value is not None" keeps booleans (like False in show_panel_numbers).
+        # None means "not in config", so it never unsets an existing field.
+        # Nested dictionaries (like layout_settings) are merged to preserve other keys.
+        if value is not None:
+            if isinstance(value, dict) and isinstance(meta.get(key), dict):
+                meta[key].update(value)
+            else:
+                meta[key] = value
+
+def apply_character_meta(meta: Dict[str, Any], master_meta: Dict[str, Any]):
+    for key in CHARACTER_META_FIELDS:
+        if master_meta.get(key): meta[key] = master_meta.get(key)
+
+def normalize_item_data(item_data: Dict[str, Any], master_meta: Dict[str, Any], known_characters: Dict[str, str], name_matcher: NameMatcher):
+    """
+    Normalizes one storyboard block in place: characters named in plot_breakdown are added to
+    `characters` and the master meta is applied. The volume is left to the caller.
+    """
+    plot_text = json.dumps(item_data.get("plot_breakdown", []), ensure_ascii=False)
+    current_chars = item_data.get("characters", [])
+    if isinstance(current_chars, str):
+        current_chars = [current_chars]
+    if not isinstance(current_chars, list):
+        current_chars = []
+
+    # Check for missing characters (in cast order)
+    keyword_order = {kw: i for i, kw in enumerate(known_characters)}
+    found_missing = []
+    for kw in sorted(name_matcher.find(plot_text), key=keyword_order.get):
+        full_name = known_characters[kw]
+        is_present = False
+        for char_name in current_chars:
+             if kw in char_name or char_name in full_name:
+                 is_present = True
+                 break
+        if not is_present:
+             if full_name not in current_chars and full_name not in found_missing:
+                 found_missing.append(full_name)
+
+    if found_missing:
+        current_chars.extend(found_missing)
+        item_data["characters"] = current_chars
+
+    # Sync Meta Info
+    meta = item_data.get("meta_info", {})
+    apply_master_meta(meta, master_meta)
+    item_data["meta_info"] = meta
 
 class ConsistencyService:
     def __init__(self, session: Session):
         self.session = session
 
+    def _bulk_update(self, project_id: str, model, rows: List[Dict[str, Any]]):
+        """One executemany UPDATE by primary key for [{"id": ..., "data": ...}] rows."""
+        if rows:
+            self.session.execute(update(model), rows)
+            bump_project_version(self.session, project_id)
+
     def normalize_project(self, project_id: str):
         """
         Normalizes the project's data (characters, storyboard) based on the global config.
-        This mirrors the logic in comic_generator.py.
+        This mirrors the logic in comic_generator.py. Only rows whose data actually changes
+        are written, in one bulk UPDATE per table.
         """
         project = self.session.get(Project, project_id)
         if not project:
@@ -31,20 +138,8 @@ class ConsistencyService:
 
         # Priority 0: Comic Config
         if global_config and global_config.data:
-            config_data = global_config.data
-            master_style = config_data.get("style")
-            
-            # Explicitly map all fields we want to sync
-            master_meta = {
-                "style": master_style,
-                "bubble_style": config_data.get("bubble_style"),
-                "narration_style": config_data.get("narration_style"),
-                "border_style": config_data.get("border_style"),
-                "gutter_style": config_data.get("gutter_style"),
-                "layout_settings": config_data.get("layout_settings"),
-                "aspect_ratio": config_data.get("aspect_ratio", "16:9"),
-                "language": config_data.get("language", "English")
-            }
+            master_meta = master_meta_from_config(global_config.data)
+            master_style = master_meta.get("style")
         
         # Priority 1: First Character Sheet (if no config style)
         if not master_style and characters:
@@ -64,31 +159,19 @@ class ConsistencyService:
             if not master_meta:
                 master_meta = first_meta.copy()
 
-        # Build Character Registry
-        known_characters = {}
-        for char in characters:
-            full_name = char.name
-            if not full_name: continue
-            
-            keywords = [full_name]
-            simplified = re.split(r'[（\(]', full_name)[0].strip()
-            if simplified and simplified != full_name:
-                keywords.append(simplified)
-            
-            for kw in keywords:
-                if kw:
-                    known_characters[kw] = full_name
+        # Build Character Registry (compiled once, matched against every item in one pass)
+        known_characters, name_matcher = build_character_registry([char.name for char in characters])
 
         # Apply Normalization
         # Even if master_style is None, we might still have layout_settings to sync
         # So we check if we have ANY master_meta to apply
         if master_meta:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.info(f"Normalizing project {project_id} with master config: {json.dumps(master_meta, ensure_ascii=False)}")
             
             # 1. Normalize Characters
+            char_updates = []
             for char in characters:
+                # Deepcopy so the comparison below sees the original data
                 char_data = copy.deepcopy(char.data)
                 if not isinstance(char_data, dict):
                     char_data = dict(char_data)
@@ -96,9 +179,7 @@ class ConsistencyService:
                 meta = char_data.get("meta_info", {})
                 
                 # Sync Core Fields
-                if master_meta.get("style"): meta["style"] = master_meta.get("style")
-                if master_meta.get("language"): meta["language"] = master_meta.get("language")
-                if master_meta.get("aspect_ratio"): meta["aspect_ratio"] = master_meta.get("aspect_ratio")
+                apply_character_meta(meta, master_meta)
                 
                 char_data["meta_info"] = meta
                 
@@ -107,75 +188,89 @@ class ConsistencyService:
                 char_data.pop("language", None)
                 char_data.pop("Language", None)
                 
-                char.data = char_data
-                self.session.add(char)
+                if char_data != char.data:
+                    char_updates.append({"id": char.id, "data": char_data})
             
             # 2. Normalize Storyboard Items
             total_volumes = len(storyboard_items)
+            item_updates = []
             
             for i, item in enumerate(storyboard_items):
-                # Use deepcopy to ensure we don't mutate the original object in place before assignment
-                # and to ensure SQLAlchemy detects the change when we reassign.
                 item_data = copy.deepcopy(item.data)
                 if not isinstance(item_data, dict):
                     item_data = dict(item_data)
                 
-                # Check for missing characters
-                plot_text = json.dumps(item_data.get("plot_breakdown", []), ensure_ascii=False)
-                current_chars = item_data.get("characters", [])
-                if isinstance(current_chars, str):
-                    current_chars = [current_chars]
-                if not isinstance(current_chars, list):
-                    current_chars = []
-                
-                found_missing = []
-                for kw, full_name in known_characters.items():
-                    if kw in plot_text:
-                        is_present = False
-                        for char_name in current_chars:
-                             if kw in char_name or char_name in full_name:
-                                 is_present = True
-                                 break
-                        if not is_present:
-                             if full_name not in current_chars and full_name not in found_missing:
-                                 found_missing.append(full_name)
-                
-                if found_missing:
-                    current_chars.extend(found_missing)
-                    item_data["characters"] = current_chars
-
-                # Sync Meta Info
-                meta = item_data.get("meta_info", {})
-                
-                # We want to preserve existing fields in meta (like volume) but overwrite style configs
-                # master_meta has style, bubble_style, etc.
-                
-                # Force update fields from master_meta even if they exist in meta
-                # But careful with 'None' values in master_meta (though we constructed it from config)
-                
-                for key, value in master_meta.items():
-                    if key == "volume": continue
-                    
-                    # Special handling for boolean values (like False in show_panel_numbers)
-                    # "if value is not None" is correct for booleans.
-                    # For nested dictionaries (like layout_settings), we should merge to preserve other keys.
-                    
-                    if value is not None:
-                        if isinstance(value, dict) and isinstance(meta.get(key), dict):
-                            meta[key].update(value)
-                        else:
-                            meta[key] = value
-                    
-                    # If value is None but key exists in master_meta keys (explicitly set to null), we might want to unset it?
-                    # But our master_meta construction uses .get() defaults, so None usually means "not in config".
+                normalize_item_data(item_data, master_meta, known_characters, name_matcher)
                     
                 # Ensure Volume format
-                meta["volume"] = f"{i+1}/{total_volumes}"
-                item_data["meta_info"] = meta
+                item_data["meta_info"]["volume"] = f"{i+1}/{total_volumes}"
                 
-                logger.info(f"Updated Item {i+1} meta: {json.dumps(meta, ensure_ascii=False)}")
+                if item_data != item.data:
+                    item_updates.append({"id": item.id, "data": item_data})
                 
-                item.data = item_data
-                self.session.add(item)
-            
+            self._bulk_update(project_id, Character, char_updates)
+            self._bulk_update(project_id, StoryboardItem, item_updates)
+            logger.info(f"Normalized project {project_id}: {len(char_updates)}/{len(characters)} characters, {len(item_updates)}/{total_volumes} storyboard items changed")
             self.session.commit()
+            
+    def normalize_storyboard_blocks(self, project_id: str, blocks: List[Dict[str, Any]]):
+        """
+        Applies normalize_project's per-item normalization to incoming storyboard blocks in place,
+        before they are saved. merge_storyboard matches blocks to stored items by content hash, and
+        stored items have been normalized, so the incoming side has to be normalized the same way.
+        """
+        project = self.session.get(Project, project_id)
+        if not project or not blocks:
+            return
+        global_config = project.global_config
+        if global_config and global_config.data:
+            master_meta = master_meta_from_config(global_config.data)
+        else:
+            # Same fallback as normalize_project: the first block becomes the first item
+            master_meta = dict(blocks[0].get("meta_info", {}))
+        known_characters, name_matcher = build_character_registry([char.name for char in project.characters])
+        for block in blocks:
+            if master_meta:
+                normalize_item_data(block, master_meta, known_characters, name_matcher)
+            
+    def normalize_config_change(self, project_id: str, old_config: Optional[Dict[str, Any]], new_config: Dict[str, Any]) -> int:
+        """
+        Incremental normalization after a global config edit: only the master meta fields that
+        differ between the old and new config are re-applied, and only rows whose meta_info
+        actually changes are written (one bulk UPDATE per table). Character lists and volume
+        numbers do not depend on the config, so they are left to the full normalize_project.
+        Returns the number of rows updated.
+        """
+        if not old_config:
+            # The project had no config: item meta may still come from the first block
+            self.normalize_project(project_id)
+            return -1
+
+        changed = diff_master_meta(master_meta_from_config(old_config), master_meta_from_config(new_config))
+        if not changed:
+            return 0
+        logger.info(f"Normalizing project {project_id} config change: {json.dumps(changed, ensure_ascii=False)}")
+
+        updated = 0
+        char_changed = {key: changed[key] for key in CHARACTER_META_FIELDS if key in changed}
+        targets = [(StoryboardItem, changed, apply_master_meta)]
+        if char_changed:
+            targets.append((Character, char_changed, apply_character_meta))
+
+        for model, fields, apply in targets:
+            # Plain (id, data) rows: no ORM objects are built for rows that stay untouched
+            rows = self.session.exec(select(model.id, model.data).where(model.project_id == project_id)).all()
+            updates = []
+            for row_id, data in rows:
+                if not isinstance(data, dict):
+                    continue
+                old_meta = data.get("meta_info", {})
+                meta = copy.deepcopy(old_meta)
+                apply(meta, fields)
+                if meta != old_meta:
+                    updates.append({"id": row_id, "data": {**data, "meta_info": meta}})
+            self._bulk_update(project_id, model, updates)
+            updated += len(updates)
+
+        self.session.commit()
+        return updated
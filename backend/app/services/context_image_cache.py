@@ -0,0 +1,131 @@
+import io
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Formats the image model accepts as-is; anything else is re-encoded
+UPLOAD_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+def encode_image(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        img.save(buf, format="WEBP", quality=quality)
+    else:
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+def prepare_context_image(path: str) -> Tuple[bytes, str, int]:
+    """
+    Reads a context image and returns (encoded bytes, mime type, original size) ready for upload.
+    Images are downscaled to CONTEXT_IMAGE_MAX_EDGE and re-encoded as CONTEXT_IMAGE_FORMAT
+    (PNG instead of JPEG for images with transparency, which JPEG would flatten to black);
+    the original file is sent unchanged when that would not make it smaller.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    fmt = settings.CONTEXT_IMAGE_FORMAT.upper()
+    max_edge = settings.CONTEXT_IMAGE_MAX_EDGE
+    with Image.open(io.BytesIO(data)) as img:
+        needs_resize = max_edge > 0 and max(img.size) > max_edge
+        if img.format in UPLOAD_MIME_TYPES and (fmt == "ORIGINAL" or (fmt == img.format and not needs_resize)):
+            return data, UPLOAD_MIME_TYPES[img.format], len(data)
+        
+        if fmt not in UPLOAD_MIME_TYPES or (fmt == "JPEG" and has_alpha(img)):
+            fmt = "PNG"
+        img.load()
+        if needs_resize:
+            img = img.copy()
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        encoded = encode_image(img, fmt, settings.CONTEXT_IMAGE_QUALITY)
+    
+    if not needs_resize and len(encoded) >= len(data) and img.format in UPLOAD_MIME_TYPES:
+        return data, UPLOAD_MIME_TYPES[img.format], len(data)
+    return encoded, UPLOAD_MIME_TYPES[fmt], len(data)
+
+class ContextImageCache:
+    """
+    Process-wide LRU of prepared context images keyed by (path, mtime, size), so the same
+    character sheets and history panels are read and encoded once per batch instead of once
+    per panel. Bounded by the total size of the cached payloads.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, int, int], Tuple[bytes, str, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Tuple[bytes, str, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+        
+        entry = prepare_context_image(path)
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return entry
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = entry
+                self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (old_data, _, _) = self.entries.popitem(last=False)
+                self.total_bytes -= len(old_data)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+context_image_cache = ContextImageCache(settings.CONTEXT_IMAGE_CACHE_MB * 1024 * 1024)
+
+class ContextUploadMetrics:
+    """
+    Per-call record of context image upload sizes (original vs. sent bytes) for image
+    generation calls: the most recent calls plus process-wide totals.
+    """
+    def __init__(self, max_calls: int = 1000):
+        self.calls = deque(maxlen=max_calls)
+        self.totals = {"calls": 0, "files": 0, "original_bytes": 0, "upload_bytes": 0, "saved_bytes": 0}
+        self.lock = threading.Lock()
+
+    def record(self, model_name: str, files: int, original_bytes: int, upload_bytes: int) -> Dict[str, Any]:
+        call = {
+            "at": time.time(),
+            "model": model_name,
+            "files": files,
+            "original_bytes": original_bytes,
+            "upload_bytes": upload_bytes,
+            "saved_bytes": original_bytes - upload_bytes,
+        }
+        with self.lock:
+            self.calls.append(call)
+            self.totals["calls"] += 1
+            for key in ("files", "original_bytes", "upload_bytes", "saved_bytes"):
+                self.totals[key] += call[key]
+        return call
+
+    def snapshot(self, last: int = 50) -> Dict[str, Any]:
+        with self.lock:
+            return {"totals": dict(self.totals), "recent": list(self.calls)[-last:]}
+
+context_upload_metrics = ContextUploadMetrics()
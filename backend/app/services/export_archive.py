@@ -0,0 +1,324 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+from app.core.config import settings
+from app.models.models import Project
+from app.services.image_service import split_comic_page_file
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Copy buffer for streaming stored files into the archive
+ZIP_CHUNK_SIZE = 1024 * 1024
+# The manifest is the archive's last entry, so archive and manifest are swapped in by one rename
+MANIFEST_VERSION = 2
+MANIFEST_NAME = "export_manifest.json"
+
+def resolve_image_path(image_url: str) -> str:
+    # URL: /static/{project_id}/characters/xxx.png -> Path: backend/static/{project_id}/characters/xxx.png
+    rel_path = image_url.lstrip("/")
+    return os.path.join(base_dir, rel_path.replace("/", os.sep))
+
+def safe_entry_name(name: str) -> str:
+    return name.replace("/", "_").replace("\\", "_")
+
+def archive_path(project_id: str, split_images: bool) -> str:
+    """The cached archive (one per split flag); its manifest is stored inside it."""
+    name = "export_archive_split" if split_images else "export_archive"
+    return os.path.join(base_dir, "static", project_id, f"{name}.zip")
+
+def load_manifest(project_id: str, split_images: bool) -> Optional[Dict[str, Any]]:
+    zip_path = archive_path(project_id, split_images)
+    if not os.path.exists(zip_path):
+        return None
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("split_images") != split_images:
+        return None
+    return manifest
+
+@contextmanager
+def archive_lock(zip_path: str):
+    """Exclusive lock on the archive across processes (the server and queue workers), held while publishing."""
+    with open(f"{zip_path}.lock", "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def file_sha256(path: str, stat: os.stat_result, previous: Optional[Dict[str, Any]]) -> str:
+    # Generated images are never rewritten in place, so an unchanged size + mtime reuses the recorded hash
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous["sha256"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(ZIP_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def collect_export_entries(project: Project, previous: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Manifest entries (archive name, source URL/path, size, mtime and content hash) for every
+    exportable image: character sheets, then storyboard pages in sequence order.
+    """
+    previous_by_name = {e["name"]: e for e in previous["entries"]} if previous else {}
+    sources = []
+    for char in project.characters:
+        if char.image_url:
+            sources.append((f"characters/{safe_entry_name(char.name)}.png", char.image_url, 0))
+    for item in sorted(project.storyboard_items, key=lambda x: x.sequence):
+        if item.image_url:
+            sources.append((f"comic_part_{item.sequence}.png", item.image_url, item.sequence))
+
+    entries = []
+    for name, url, sequence in sources:
+        local_path = resolve_image_path(url)
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            continue
+        entries.append({
+            "name": name,
+            "source": url,
+            "path": local_path,
+            "sequence": sequence,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_sha256(local_path, stat, previous_by_name.get(name)),
+        })
+    return entries
+
+def is_up_to_date(manifest: Optional[Dict[str, Any]], entries: List[Dict[str, Any]]) -> bool:
+    if not manifest:
+        return False
+    if manifest["split_images"] and any(e["sequence"] and "panels" not in e for e in manifest["entries"]):
+        # A page failed to split last time
+        return False
+    return [(e["name"], e["sha256"]) for e in manifest["entries"]] == [(e["name"], e["sha256"]) for e in entries]
+
+class ZipStream:
+    """
+    Write-only file object for zipfile: written bytes are buffered until drained, so the
+    archive can be sent while it is being built (zipfile falls back to data descriptors
+    because this stream cannot seek). Everything written is also copied to `tee`.
+    """
+    def __init__(self, tee=None):
+        self.chunks = []
+        self.tee = tee
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        if self.tee:
+            self.tee.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stored_info(arcname: str, mtime: float = None) -> zipfile.ZipInfo:
+    # PNGs are already compressed: store them as-is instead of deflating again
+    timestamp = datetime.fromtimestamp(mtime) if mtime else datetime.now()
+    info = zipfile.ZipInfo(arcname, date_time=timestamp.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+def reused_info(old_archive: zipfile.ZipFile, arcname: str) -> zipfile.ZipInfo:
+    # A fresh ZipInfo: writing mutates offsets, the old archive's own one must stay intact
+    info = zipfile.ZipInfo(arcname, date_time=old_archive.getinfo(arcname).date_time)
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+def copy_into(archive: zipfile.ZipFile, info: zipfile.ZipInfo, src, stream: ZipStream):
+    with archive.open(info, "w") as dest:
+        while True:
+            chunk = src.read(ZIP_CHUNK_SIZE)
+            if not chunk:
+                break
+            dest.write(chunk)
+            yield stream.drain()
+
+def iter_export_archive(project_id: str, split_images: bool, entries: List[Dict[str, Any]], previous: Optional[Dict[str, Any]] = None, split_results: Optional[Dict[int, List[bytes]]] = None):
+    """
+    Streams a fresh export archive while writing it to the cache, then publishes it (manifest
+    included as the last entry) with one rename. Entries (and split panels) whose content hash
+    matches the previous manifest are copied out of the previous archive instead of being read
+    and split again. Entries that fail are left out of the manifest and pages that fail to split
+    get no "panels", so the next export retries them.
+    `split_results` ({sequence: [panel PNG bytes]}) supplies pages already split elsewhere.
+    """
+    zip_path = archive_path(project_id, split_images)
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    # Entries were collected just before this call: a build started later sees newer images
+    created_at = datetime.utcnow().isoformat(timespec="microseconds")
+    previous_by_name = {e["name"]: e for e in previous["entries"]} if previous else {}
+    old_archive = zipfile.ZipFile(zip_path) if previous else None
+    old_names = set(old_archive.namelist()) if old_archive else set()
+    tmp_path = f"{zip_path}.{uuid.uuid4().hex}.tmp"
+    reused = 0
+    written = []
+    try:
+        with open(tmp_path, "wb") as tmp:
+            stream = ZipStream(tee=tmp)
+            with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+                for entry in entries:
+                    prev = previous_by_name.get(entry["name"])
+                    unchanged = old_archive is not None and prev is not None and prev["sha256"] == entry["sha256"]
+                    try:
+                        if unchanged:
+                            with old_archive.open(entry["name"]) as src:
+                                yield from copy_into(archive, reused_info(old_archive, entry["name"]), src, stream)
+                            reused += 1
+                        else:
+                            with open(entry["path"], "rb") as src:
+                                yield from copy_into(archive, stored_info(entry["name"], entry["mtime_ns"] / 1e9), src, stream)
+                    except (OSError, KeyError) as e:
+                        logger.error(f"Failed to export {entry['name']}: {e}")
+                        continue
+                    written.append(entry)
+
+                    if not (split_images and entry["sequence"]):
+                        continue
+                    entry.pop("panels", None)
+                    if unchanged and all(name in old_names for name in prev.get("panels", [None])):
+                        for panel_name in prev["panels"]:
+                            with old_archive.open(panel_name) as src:
+                                yield from copy_into(archive, reused_info(old_archive, panel_name), src, stream)
+                        entry["panels"] = list(prev["panels"])
+                        continue
+                    if split_results is not None and entry["sequence"] in split_results:
+                        panels = split_results[entry["sequence"]]
+                    else:
+                        try:
+                            panels = split_comic_page_file(entry["path"])
+                        except OSError as e:
+                            logger.error(f"Failed to split {entry['name']}: {e}")
+                            panels = []
+                    if not panels:
+                        # split_comic_page returns [] on failure: no "panels" key, so pages_to_split retries it
+                        logger.error(f"No panels exported for {entry['name']}")
+                        continue
+                    entry["panels"] = []
+                    for idx, panel_bytes in enumerate(panels):
+                        panel_name = f"panels/panel_{entry['sequence']}_{idx+1}.png"
+                        archive.writestr(stored_info(panel_name), panel_bytes)
+                        entry["panels"].append(panel_name)
+                        yield stream.drain()
+
+                manifest = {
+                    "version": MANIFEST_VERSION,
+                    "split_images": split_images,
+                    "created_at": created_at,
+                    "entries": [{k: v for k, v in e.items() if k != "path"} for e in written],
+                }
+                archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False))
+            yield stream.drain()
+
+        if old_archive:
+            old_archive.close()
+            old_archive = None
+        with archive_lock(zip_path):
+            published = load_manifest(project_id, split_images)
+            if published and published["created_at"] > created_at:
+                # A build that started later (in this or another process) already published newer content
+                logger.info(f"Export archive for {project_id} superseded by a newer build; not published")
+            else:
+                os.replace(tmp_path, zip_path)
+                logger.info(f"Export archive for {project_id} rebuilt: {reused}/{len(entries)} entries reused from the previous archive")
+    finally:
+        if old_archive:
+            old_archive.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def pages_to_split(entries: List[Dict[str, Any]], previous: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Storyboard pages whose panels cannot be copied from the previous split archive."""
+    previous_by_name = {e["name"]: e for e in previous["entries"]} if previous else {}
+    pages = []
+    for entry in entries:
+        if not entry["sequence"]:
+            continue
+        prev = previous_by_name.get(entry["name"])
+        if not (prev and prev["sha256"] == entry["sha256"] and "panels" in prev):
+            pages.append(entry)
+    return pages
+
+_split_pool: Optional[ProcessPoolExecutor] = None
+_split_pool_lock = threading.Lock()
+
+def get_split_pool() -> ProcessPoolExecutor:
+    # Created on first use and kept for the life of the process; "spawn" so the workers do not
+    # inherit the server's threads and open DB connections
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is None:
+            workers = settings.EXPORT_SPLIT_WORKERS or os.cpu_count() or 1
+            _split_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _split_pool
+
+def reset_split_pool(pool: ProcessPoolExecutor):
+    # A worker died (e.g. killed for memory): drop the broken pool so the next export gets a new one
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is pool:
+            _split_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def split_pages_parallel(pages: List[Dict[str, Any]], on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[int, List[bytes]]:
+    """
+    Splits pages across the process pool; returns {sequence: [panel PNG bytes]}.
+    Pages that fail in the pool are left out, so iter_export_archive splits them inline.
+    """
+    pool = get_split_pool()
+    futures = {pool.submit(split_comic_page_file, page["path"]): page["sequence"] for page in pages}
+    results = {}
+    for done, future in enumerate(as_completed(futures), start=1):
+        sequence = futures[future]
+        try:
+            results[sequence] = future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"Failed to split page {sequence}: {e}")
+            reset_split_pool(pool)
+        except Exception as e:
+            logger.error(f"Failed to split page {sequence}: {e}")
+        if on_progress:
+            on_progress(done, len(futures))
+    return results
+
+def build_export_archive(project_id: str, split_images: bool, entries: List[Dict[str, Any]], previous: Optional[Dict[str, Any]] = None, split_results: Optional[Dict[int, List[bytes]]] = None):
+    """Builds and caches the archive without a client attached (background export task)."""
+    for _ in iter_export_archive(project_id, split_images, entries, previous, split_results):
+        pass
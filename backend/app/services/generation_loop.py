@@ -0,0 +1,48 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable, Coroutine, Iterator, Optional
+
+class GenerationLoop:
+    """
+    Process-wide asyncio event loop on a daemon thread, used by ASYNC_GENERATION to run
+    AsyncAIService calls. Batch task orchestration (DB commits, image files, task logs) stays on
+    the task's own thread and only waits on the returned concurrent.futures.Future; single-image
+    tasks run here as coroutines and push their DB phases to worker threads. Nothing blocking
+    ever runs on this loop, so many in-flight generations share it.
+    """
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="generation-loop", daemon=True).start()
+            return self.loop
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedules `coro` on the loop; cancelling the returned future cancels the coroutine."""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    async def run(self, func: Callable[..., Coroutine], *args):
+        """Awaits `func(*args)` on the generation loop from another event loop (e.g. a Starlette background task)."""
+        return await asyncio.wrap_future(self.submit(func(*args)))
+
+    def iterate(self, stream: AsyncIterator) -> Iterator:
+        """Consumes an async iterator from a regular thread, one item at a time."""
+        async def next_item():
+            return await stream.__anext__()
+        
+        try:
+            while True:
+                try:
+                    yield self.submit(next_item()).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(stream, "aclose"):
+                self.submit(stream.aclose()).result()
+
+generation_loop = GenerationLoop()
@@ -28,3 +28,8 @@ def split_comic_page(image_bytes: bytes) -> list[bytes]:
     except Exception as e:
         print(f"Failed to split image: {e}")
         return []
+
+def split_comic_page_file(path: str) -> list[bytes]:
+    """split_comic_page for a file on disk (picklable entry point for export process pools)."""
+    with open(path, "rb") as f:
+        return split_comic_page(f.read())
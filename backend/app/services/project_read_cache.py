@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.core.config import settings
+
+class ProjectReadCache:
+    """
+    Process-wide LRU of serialized project responses keyed by (project id, version, variant),
+    where the variant names the fieldset / page (empty for the full ProjectRead).
+    Project.version is bumped in the same transaction as every write to the project or its
+    characters / storyboard items / config, so a stale entry is simply never looked up again
+    (also across worker processes). Bounded by the total size of the cached bodies.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, int, str], bytes]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, project_id: str, version: int, variant: str = "") -> Optional[bytes]:
+        key = (project_id, version, variant)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, project_id: str, version: int, body: bytes, variant: str = ""):
+        if len(body) > self.max_bytes:
+            return
+        key = (project_id, version, variant)
+        with self.lock:
+            # Older versions of the same project can never be served again
+            for stale in [k for k in self.entries if k[0] == project_id and k[1] != version]:
+                self.total_bytes -= len(self.entries.pop(stale))
+            if key not in self.entries:
+                self.entries[key] = body
+                self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                _, old_body = self.entries.popitem(last=False)
+                self.total_bytes -= len(old_body)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+project_read_cache = ProjectReadCache(settings.PROJECT_READ_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """
+    Content-addressed cache of generation results on local disk.
+    One file per key (sha256 hex); file mtime doubles as the LRU clock, and the
+    oldest entries are evicted once the directory grows past `max_bytes`.
+    The size is tracked as a running total, so the directory is only walked on the first
+    write and when the total goes over the limit (that scan also picks up other processes' writes).
+    """
+    # Eviction frees space down to this fraction of max_bytes, so the next writes do not rescan
+    EVICT_TO = 0.9
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes: Optional[int] = None
+        # (path, mtime_ns, size) -> sha256 of the file, so unchanged context images are hashed once
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def file_hash(self, path: str) -> str:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Missing context images are skipped by the request, so they only matter by name
+            return f"missing:{path}"
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._file_hashes.get(memo_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self.lock:
+                if len(self._file_hashes) > 4096:
+                    self._file_hashes.clear()
+                self._file_hashes[memo_key] = digest
+        return digest
+
+    def make_key(self, kind: str, model_name: str, prompt: str, context_images: Optional[List[str]] = None, **config) -> str:
+        payload = {
+            "kind": kind,
+            "model": model_name,
+            "prompt": prompt,
+            "context": [self.file_hash(p) for p in (context_images or [])],
+            "config": config,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Mark as recently used
+            return data
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write result cache entry {key}: {e}")
+            return
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += len(data) - replaced
+            over = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan(self) -> Tuple[List[Tuple[float, int, str]], int]:
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        with self.lock:
+            entries, total = self._scan()
+            if total > self.max_bytes:
+                target = int(self.max_bytes * self.EVICT_TO)
+                for _, size, path in sorted(entries):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    if total <= target:
+                        break
+            self.total_bytes = total
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[ResultCache]:
+    """The process-wide result cache, or None unless RESULT_CACHE_ENABLED is set."""
+    global _result_cache
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(settings.RESULT_CACHE_DIR, settings.RESULT_CACHE_MAX_MB * 1024 * 1024)
+        return _result_cache
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Tuple
+from sqlalchemy import event, inspect
+from sqlmodel import Session
+from app.models.models import Task
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class TaskEventBus:
+    """
+    In-process pub/sub for task progress. Publishers can be any thread (background tasks);
+    subscribers are asyncio queues owned by streaming endpoints on the event loop.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1000)
+        with self.lock:
+            self.subscribers.setdefault(task_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        with self.lock:
+            subs = [s for s in self.subscribers.get(task_id, []) if s[1] is not queue]
+            if subs:
+                self.subscribers[task_id] = subs
+            else:
+                self.subscribers.pop(task_id, None)
+
+    def publish(self, task_id: str, payload: dict):
+        with self.lock:
+            subs = list(self.subscribers.get(task_id, []))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, payload)
+            except RuntimeError:
+                # Event loop already closed; the stream is gone
+                self.unsubscribe(task_id, queue)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, payload: dict):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning("Task event queue full, dropping event")
+
+task_event_bus = TaskEventBus()
+
+def task_status_payload(task: Task) -> dict:
+    return {
+        "type": "status",
+        "task_id": task.id,
+        "status": task.status,
+        "progress": task.progress,
+        "message": task.message,
+    }
+
+# Status/progress transitions are published once the transaction that wrote them commits,
+# so every place that updates a Task row feeds the stream without extra calls.
+
+@event.listens_for(Session, "after_flush")
+def _collect_task_changes(session, flush_context):
+    changed = session.info.setdefault("task_events", {})
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Task):
+            continue
+        state = inspect(obj)
+        if any(state.attrs[key].history.has_changes() for key in ("status", "progress", "message")):
+            changed[obj.id] = task_status_payload(obj)
+
+@event.listens_for(Session, "after_commit")
+def _publish_task_changes(session):
+    changed = session.info.pop("task_events", None)
+    if changed:
+        for task_id, payload in changed.items():
+            task_event_bus.publish(task_id, payload)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_task_changes(session):
+    session.info.pop("task_events", None)
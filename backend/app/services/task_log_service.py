@@ -0,0 +1,138 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple, Dict
+from sqlmodel import Session, select
+from sqlalchemy import func
+from app.core.config import settings
+from app.models.models import Task, TaskLog
+from app.services.task_events import task_event_bus
+
+logger = logging.getLogger(__name__)
+
+class TaskLogWriter:
+    """
+    Buffers task log lines in memory and appends them to the TaskLog table in one
+    transaction per batch, either every TASK_LOG_FLUSH_INTERVAL_SECONDS (background thread)
+    or as soon as TASK_LOG_FLUSH_SIZE lines are pending.
+    """
+    # A task's line counter is dropped once it has been quiet this long (finished tasks stop
+    # logging); if it logs again the counter is re-seeded from the table
+    COUNT_IDLE_SECONDS = 300
+    # Lines kept for retry while the database is failing; older ones are dropped beyond this
+    MAX_PENDING_LINES = 10000
+
+    def __init__(self):
+        self.buffer: List[Tuple[str, datetime, str]] = []
+        self.buffer_lock = threading.Lock()
+        # Serializes flushes so batches are written in append order
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        # Next line index per task, so live stream events line up with paginated reads
+        self.line_counts: Dict[str, int] = {}
+        self.last_append: Dict[str, float] = {}
+
+    def append(self, task_id: str, message: str) -> int:
+        """Buffers a line and returns its index within the task's log."""
+        seeded_count = None
+        while True:
+            with self.buffer_lock:
+                if task_id in self.line_counts or seeded_count is not None:
+                    index = self.line_counts.get(task_id, seeded_count)
+                    self.line_counts[task_id] = index + 1
+                    self.last_append[task_id] = time.monotonic()
+            
+                    self.buffer.append((task_id, datetime.utcnow(), message))
+                    full = len(self.buffer) >= settings.TASK_LOG_FLUSH_SIZE
+                    if self.thread is None:
+                        self.thread = threading.Thread(target=self._run, name="task-log-writer", daemon=True)
+                        self.thread.start()
+                    break
+            # First line from this process for the task: count its stored lines without holding
+            # the lock (none of them can still be buffered, counters with pending lines are never evicted)
+            from app.core.database import engine
+            with Session(engine) as session:
+                seeded_count = count_task_logs(session, task_id)
+        if full:
+            self.wakeup.set()
+        return index
+
+    def flush(self):
+        with self.flush_lock:
+            with self.buffer_lock:
+                batch, self.buffer = self.buffer, []
+            if not batch:
+                return
+            from app.core.database import engine
+            try:
+                with Session(engine) as session:
+                    session.add_all([
+                        TaskLog(task_id=task_id, created_at=created_at, message=message)
+                        for task_id, created_at, message in batch
+                    ])
+                    session.commit()
+            except Exception as e:
+                # Put the batch back in front of anything appended meanwhile; the next flush retries it
+                with self.buffer_lock:
+                    self.buffer = batch + self.buffer
+                    dropped = len(self.buffer) - self.MAX_PENDING_LINES
+                    if dropped > 0:
+                        self.buffer = self.buffer[dropped:]
+                logger.error(f"Failed to flush {len(batch)} task log lines, will retry: {e}")
+                if dropped > 0:
+                    logger.error(f"Dropped the {dropped} oldest pending task log lines")
+                return
+            self._evict_idle_counts()
+
+    def _evict_idle_counts(self):
+        now = time.monotonic()
+        with self.buffer_lock:
+            pending = {task_id for task_id, _, _ in self.buffer}
+            for task_id, last in list(self.last_append.items()):
+                if now - last > self.COUNT_IDLE_SECONDS and task_id not in pending:
+                    del self.last_append[task_id]
+                    del self.line_counts[task_id]
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(settings.TASK_LOG_FLUSH_INTERVAL_SECONDS)
+            self.wakeup.clear()
+            self.flush()
+
+task_log_writer = TaskLogWriter()
+atexit.register(task_log_writer.flush)
+
+def append_task_log(task_id: str, message: str):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    line = f"[{timestamp}] {message}"
+    index = task_log_writer.append(task_id, line)
+    task_event_bus.publish(task_id, {"type": "log", "task_id": task_id, "index": index, "line": line})
+
+def count_task_logs(session: Session, task_id: str) -> int:
+    statement = select(func.count()).select_from(TaskLog).where(TaskLog.task_id == task_id)
+    return session.exec(statement).one()
+
+def count_task_logs_by_task(session: Session, task_ids: List[str]) -> Dict[str, int]:
+    if not task_ids:
+        return {}
+    statement = select(TaskLog.task_id, func.count()).where(TaskLog.task_id.in_(task_ids)).group_by(TaskLog.task_id)
+    return {task_id: count for task_id, count in session.exec(statement).all()}
+
+def get_task_logs(session: Session, task: Task, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+    """Returns (lines, total) for a task. Tasks created before TaskLog fall back to the legacy logs column."""
+    # Make this process's pending lines visible to the reader
+    task_log_writer.flush()
+    
+    total = count_task_logs(session, task.id)
+    if total == 0 and task.logs:
+        legacy = list(task.logs)
+        end = None if limit is None else offset + limit
+        return legacy[offset:end], len(legacy)
+    
+    statement = select(TaskLog.message).where(TaskLog.task_id == task.id).order_by(TaskLog.id).offset(offset)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return list(session.exec(statement).all()), total
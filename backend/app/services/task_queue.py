@@ -0,0 +1,196 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import event, update, or_
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.models.models import Task
+
+logger = logging.getLogger(__name__)
+
+class LeaseLostError(RuntimeError):
+    pass
+
+# (task_id, worker_id, lost event) of the task the current thread is running for its lease
+_current_lease = threading.local()
+
+@event.listens_for(Session, "before_commit")
+def _fence_lost_lease(session):
+    """
+    Commits made by a leased task's thread only go through while this worker still owns the
+    lease. Once it expired (and the task may be running on another worker) the handler's next
+    commit raises LeaseLostError, which stops it instead of letting two runs write results.
+    """
+    lease = getattr(_current_lease, "value", None)
+    if lease is None:
+        return
+    task_id, worker_id, lost = lease
+    if not lost.is_set():
+        owner = session.exec(select(Task.lease_owner).where(Task.id == task_id)).first()
+        if owner == worker_id:
+            return
+        lost.set()
+    raise LeaseLostError(f"Lease on task {task_id} was lost, not committing")
+
+def dispatch_task(background_tasks, session: Session, task: Task, handler, *args, async_handler=None):
+    """
+    Runs `handler(task.id, *args)` in the API process (BackgroundTasks), or, with
+    TASK_QUEUE_ENABLED, stores it on the Task row for a worker process to claim.
+    With ASYNC_GENERATION an `async_handler` (coroutine twin of `handler`) runs on the shared
+    generation loop instead, so the task does not take a threadpool thread.
+    """
+    if not settings.TASK_QUEUE_ENABLED:
+        if async_handler is not None and settings.ASYNC_GENERATION:
+            from app.services.generation_loop import generation_loop
+            background_tasks.add_task(generation_loop.run, async_handler, task.id, *args)
+        else:
+            background_tasks.add_task(handler, task.id, *args)
+        return
+    
+    task.handler = handler.__name__
+    task.handler_args = list(args)
+    session.add(task)
+    session.commit()
+
+def resolve_handler(name: str):
+    from app.routers.generation import QUEUE_HANDLERS
+    from app.routers.export import QUEUE_HANDLERS as EXPORT_HANDLERS
+    handler = QUEUE_HANDLERS.get(name) or EXPORT_HANDLERS.get(name)
+    if handler is None:
+        raise ValueError(f"Unknown task handler: {name}")
+    return handler
+
+def requeue_expired_tasks(session: Session) -> int:
+    """Crash recovery: tasks whose worker stopped renewing its lease go back to the queue."""
+    now = datetime.utcnow()
+    expired = (
+        Task.handler.is_not(None),
+        Task.status == "processing",
+        Task.lease_expires_at < now,
+    )
+    failed = session.exec(
+        update(Task).where(*expired, Task.attempts >= settings.TASK_MAX_ATTEMPTS).values(
+            status="failed", message="Worker lease expired too many times", lease_owner=None, lease_expires_at=None
+        )
+    ).rowcount
+    requeued = session.exec(
+        update(Task).where(*expired, Task.attempts < settings.TASK_MAX_ATTEMPTS).values(
+            status="pending", lease_owner=None, lease_expires_at=None
+        )
+    ).rowcount
+    session.commit()
+    if requeued or failed:
+        logger.warning(f"Requeued {requeued} and failed {failed} tasks with expired leases")
+    return requeued
+
+def claim_next_task(session: Session, worker_id: str) -> Optional[Task]:
+    """Atomically leases the oldest pending queued task to this worker."""
+    now = datetime.utcnow()
+    claimable = (
+        Task.handler.is_not(None),
+        Task.status == "pending",
+        or_(Task.lease_owner.is_(None), Task.lease_expires_at < now),
+    )
+    candidates = session.exec(select(Task.id).where(*claimable).order_by(Task.created_at).limit(10)).all()
+    for task_id in candidates:
+        # The WHERE clause is re-checked by the UPDATE, so only one worker wins each task
+        claimed = session.exec(
+            update(Task).where(Task.id == task_id, *claimable).values(
+                lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=settings.TASK_LEASE_SECONDS),
+                attempts=Task.attempts + 1,
+            )
+        ).rowcount
+        session.commit()
+        if claimed:
+            return session.get(Task, task_id)
+    return None
+
+def renew_lease(task_id: str, worker_id: str) -> bool:
+    from app.core.database import engine
+    with Session(engine) as session:
+        renewed = session.exec(
+            update(Task).where(Task.id == task_id, Task.lease_owner == worker_id).values(
+                lease_expires_at=datetime.utcnow() + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+            )
+        ).rowcount
+        session.commit()
+        return renewed > 0
+
+def release_lease(task_id: str, worker_id: str):
+    from app.core.database import engine
+    with Session(engine) as session:
+        session.exec(
+            update(Task).where(Task.id == task_id, Task.lease_owner == worker_id).values(
+                lease_owner=None, lease_expires_at=None
+            )
+        )
+        session.commit()
+
+def run_claimed_task(task_id: str, handler_name: str, args: list, worker_id: str):
+    """
+    Runs a claimed task while a heartbeat thread keeps its lease alive. If the lease is lost
+    the handler's commits are refused (see _fence_lost_lease), so it stops at its next write.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+    
+    def heartbeat():
+        while not stop.wait(settings.TASK_LEASE_SECONDS / 3):
+            try:
+                if not renew_lease(task_id, worker_id):
+                    logger.warning(f"Lost lease on task {task_id}, stopping it at its next commit")
+                    lost.set()
+                    return
+            except Exception as e:
+                logger.error(f"Failed to renew lease on task {task_id}: {e}")
+    
+    beat = threading.Thread(target=heartbeat, name=f"lease-{task_id[:8]}", daemon=True)
+    beat.start()
+    _current_lease.value = (task_id, worker_id, lost)
+    try:
+        handler = resolve_handler(handler_name)
+        handler(task_id, *args)
+    finally:
+        _current_lease.value = None
+        stop.set()
+        beat.join()
+        if not lost.is_set():
+            release_lease(task_id, worker_id)
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def run_worker(worker_id: Optional[str] = None, once: bool = False):
+    """Worker loop: requeue expired leases, claim a task, run it, repeat."""
+    from app.core.database import engine
+    worker_id = worker_id or make_worker_id()
+    logger.info(f"Task worker {worker_id} started")
+    while True:
+        task_ref = None
+        try:
+            with Session(engine) as session:
+                requeue_expired_tasks(session)
+                task = claim_next_task(session, worker_id)
+                if task:
+                    task_ref = (task.id, task.handler, list(task.handler_args or []))
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed to claim a task: {e}")
+        
+        if task_ref:
+            task_id, handler_name, args = task_ref
+            logger.info(f"Worker {worker_id} running task {task_id} ({handler_name})")
+            try:
+                run_claimed_task(task_id, handler_name, args, worker_id)
+            except Exception as e:
+                logger.error(f"Task {task_id} crashed in worker {worker_id}: {e}")
+            continue
+        
+        if once:
+            return
+        time.sleep(settings.WORKER_POLL_INTERVAL_SECONDS)
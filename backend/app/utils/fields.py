@@ -0,0 +1,70 @@
+from typing import Any, Dict, Optional, Set, Type, get_args
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+def nested_model(annotation) -> Optional[Type[BaseModel]]:
+    """The pydantic model inside an annotation like List[CharacterRead] or Optional[GlobalConfigRead]."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        model = nested_model(arg)
+        if model:
+            return model
+    return None
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Dict[str, Optional[Set[str]]]]:
+    """
+    Parses a sparse fieldset like "title,storyboard_items.id,storyboard_items.image_url" against
+    `model`. Returns {field: None (whole field) or {sub fields}}, or None when no fields were asked
+    for. Raises ValueError for names the model does not have.
+    """
+    if not fields:
+        return None
+    spec: Dict[str, Optional[Set[str]]] = {}
+    for name in (part.strip() for part in fields.split(",")):
+        if not name:
+            continue
+        top, _, sub = name.partition(".")
+        if top not in model.model_fields:
+            raise ValueError(f"Unknown field '{top}'")
+        if not sub:
+            spec[top] = None
+            continue
+        child = nested_model(model.model_fields[top].annotation)
+        if child is None or sub not in child.model_fields:
+            raise ValueError(f"Unknown field '{name}'")
+        if top not in spec:
+            spec[top] = set()
+        if spec[top] is not None:
+            spec[top].add(sub)
+    return spec or None
+
+def fields_key(spec: Optional[Dict[str, Optional[Set[str]]]]) -> str:
+    """Canonical string for a parsed fieldset (cache key / ETag variant)."""
+    if not spec:
+        return ""
+    return ",".join(top if subs is None else ",".join(f"{top}.{sub}" for sub in sorted(subs)) for top, subs in sorted(spec.items()))
+
+def dump_fields(obj, model: Type[BaseModel], spec: Dict[str, Optional[Set[str]]]) -> Dict[str, Any]:
+    """
+    JSON-ready dict with only the fields in `spec` (from parse_fields), read straight off the ORM
+    object so columns and relations that were not asked for are never touched (or loaded).
+    """
+    result = {}
+    for name, subs in spec.items():
+        value = getattr(obj, name)
+        child = nested_model(model.model_fields[name].annotation)
+        if child is None:
+            result[name] = value
+            continue
+
+        def dump(row):
+            if subs is None:
+                return child.model_validate(row).model_dump(mode="json")
+            return {sub: getattr(row, sub) for sub in sorted(subs)}
+
+        if isinstance(value, list):
+            result[name] = [dump(row) for row in value]
+        else:
+            result[name] = dump(value) if value is not None else None
+    return jsonable_encoder(result)
@@ -1,72 +1,298 @@
 import json
+import logging
 import re
-from typing import List, Dict, Any
+from json.decoder import scanstring
+from json.scanner import make_scanner
+from typing import List, Dict, Any, Optional, Tuple
 
-def extract_json_blocks(text: str) -> List[Dict[str, Any]]:
-    """Extracts JSON blocks from the generated text."""
-    json_blocks = []
-    
-    # 1. Try to find ```json ... ``` blocks
-    pattern = r"```(?:json|JSON)?\s*(.*?)\s*```"
-    matches = re.findall(pattern, text, re.DOTALL)
-    
-    # 2. If no code blocks found, or even if found, we should also look for raw JSON objects
-    # because sometimes models output mixed content.
-    # But let's stick to code blocks first if they exist.
-    
-    if not matches:
-        # Fallback: Try to find top-level JSON objects/arrays directly in text
-        # This regex looks for { ... } or [ ... ] that span multiple lines
-        # It's not perfect but better than nothing
-        # We search for anything starting with { or [ and ending with } or ]
-        # non-greedy match might be safer for multiple blocks
-        raw_pattern = r"(\{[\s\S]*?\}|\[[\s\S]*?\])"
-        matches = re.findall(raw_pattern, text)
-    
-    def repair_json(json_str: str) -> Dict[str, Any]:
-        """Attempts to repair common JSON errors, specifically missing commas."""
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_LITERALS = {"true": True, "false": False, "null": None}
+# json's C scanner: parses one complete, well-formed value at an index and returns (value, end)
+_scan_once = make_scanner(json.JSONDecoder())
+# Every scanner error counts lines up to its position, so text that keeps failing is parsed here
+_MAX_SCANNER_ERRORS = 8
+
+class _TolerantParser:
+    """
+    Single-pass recursive descent JSON parser for model output. Tolerates missing commas,
+    trailing/duplicate commas, unterminated strings and unbalanced closing braces/fences
+    (open containers are closed at the end of input). Strings, and nested containers that are
+    well-formed on their own, go through json's C scanner.
+    """
+    def __init__(self, text: str, error_pos: int = 0, errors: int = 0):
+        self.text = text
+        self.n = len(text)
+        # Position of the last error the C scanner hit: containers starting before it are parsed
+        # here, so one broken comma does not get re-scanned by every enclosing level
+        self.error_pos = error_pos
+        self.errors = errors
+
+    def skip_ws(self, i: int) -> int:
+        return _WHITESPACE.match(self.text, i).end()
+
+    def parse(self) -> Any:
+        starts = [i for i in (self.text.find("{"), self.text.find("[")) if i >= 0]
+        if not starts:
+            raise ValueError("No JSON object or array found")
+        value, _ = self.container(min(starts))
+        return value
+
+    def scan(self, i: int) -> Optional[Tuple[Any, int]]:
+        """Tries the C scanner on the value at i; None if it is malformed (or the scanner failed too often)."""
+        if i < self.error_pos or self.errors >= _MAX_SCANNER_ERRORS:
+            return None
+        try:
+            return _scan_once(self.text, i)
+        except json.JSONDecodeError as e:
+            self.error_pos = e.pos
+        except StopIteration as e: # no value where the scanner expected one
+            self.error_pos = e.value
+        self.errors += 1
+        return None
+
+    def container(self, i: int) -> Tuple[Any, int]:
+        """Parses the object/array opening at i (which the C scanner already rejected)."""
+        return self.object(i + 1) if self.text[i] == "{" else self.array(i + 1)
+
+    def value(self, i: int) -> Tuple[Any, int]:
+        i = self.skip_ws(i)
+        if i >= self.n:
+            return None, i
+        ch = self.text[i]
+        if ch in "{[":
+            return self.scan(i) or self.container(i)
+        if ch == '"':
+            return self.string(i + 1)
+        if ch in ",}]":
+            # Missing value ("key": ,) -> null, the separator is left to the container
+            return None, i
+        m = _NUMBER.match(self.text, i)
+        if m:
+            number = m.group()
+            return (float(number) if any(c in number for c in ".eE") else int(number)), m.end()
+        for word, literal in _LITERALS.items():
+            if self.text.startswith(word, i):
+                return literal, i + len(word)
+        raise ValueError(f"Unexpected character {ch!r} at {i}")
+
+    def string(self, i: int) -> Tuple[str, int]:
         try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            pass
-            
-        repaired_str = json_str
-        max_attempts = 10 
-        
-        for _ in range(max_attempts):
-            try:
-                return json.loads(repaired_str)
-            except json.JSONDecodeError as e:
-                # print(f"JSON Decode Error at {e.pos}: {e.msg}")
-                if "Expecting ',' delimiter" in str(e) or "Expecting property name enclosed in double quotes" in str(e):
-                    pos = e.pos
-                    search_str = repaired_str[:pos]
-                    match = re.search(r'([\"}\]0-9])\s*$', search_str)
-                    
-                    if match:
-                        insert_idx = match.end()
-                        repaired_str = repaired_str[:insert_idx] + "," + repaired_str[insert_idx:]
-                        continue
-                
-                # If we can't fix it, re-raise
-                raise e
-                
-        return json.loads(repaired_str)
-
-    for match in matches:
-        if not match.strip(): continue
-        # Simple heuristic to filter out non-json text blocks that might be caught by raw regex
-        if not (match.strip().startswith('{') or match.strip().startswith('[')):
-            continue
-            
+            return scanstring(self.text, i)
+        except ValueError:
+            # Unterminated string (truncated output): keep what is there up to the line end
+            end = self.text.find("\n", i)
+            end = self.n if end < 0 else end
+            return self.text[i:end], end
+
+    def object(self, i: int) -> Tuple[Dict[str, Any], int]:
+        obj = {}
+        while True:
+            i = self.skip_ws(i)
+            if i >= self.n:
+                return obj, i
+            ch = self.text[i]
+            if ch == "}":
+                return obj, i + 1
+            if ch == ",":
+                i += 1
+                continue
+            if ch in "]`":
+                # Mismatched bracket or closing fence: close this object, let the caller decide
+                return obj, i
+            if ch != '"':
+                raise ValueError(f"Expecting property name enclosed in double quotes at {i}")
+            key, i = self.string(i + 1)
+            i = self.skip_ws(i)
+            if i < self.n and self.text[i] == ":":
+                i += 1
+            obj[key], i = self.value(i)
+
+    def array(self, i: int) -> Tuple[List[Any], int]:
+        arr = []
+        while True:
+            i = self.skip_ws(i)
+            if i >= self.n:
+                return arr, i
+            ch = self.text[i]
+            if ch == "]":
+                return arr, i + 1
+            if ch == ",":
+                i += 1
+                continue
+            if ch in "}`":
+                return arr, i
+            value, i = self.value(i)
+            arr.append(value)
+
+def repair_json(json_str: str) -> Any:
+    """Parses JSON, falling back to the tolerant single-pass parser for malformed model output."""
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError as e:
+        return _TolerantParser(json_str, e.pos, errors=1).parse()
+
+def parse_json_block(block_text: str) -> List[Dict[str, Any]]:
+    """Parses (and repairs) one JSON object/array; returns the dict blocks it contains."""
+    return _dict_blocks(repair_json(block_text))
+
+def _dict_blocks(data: Any) -> List[Dict[str, Any]]:
+    if isinstance(data, list):
+        return [b for b in data if isinstance(b, dict)]
+    if isinstance(data, dict):
+        return [data]
+    return []
+
+def extract_json_blocks(text: str) -> List[Dict[str, Any]]:
+    """
+    Extracts JSON blocks from the generated text. Blocks inside ``` fences win; raw
+    top-level objects/arrays in the text are only used when there are no fenced blocks.
+    """
+    return JsonBlockStreamExtractor.extract(text)
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURE_SPECIAL = re.compile(r'[{}\[\]"`]')
+
+class JsonBlockStreamExtractor:
+    """
+    Incremental counterpart of extract_json_blocks for streamed model output.
+    `feed()` takes the next text chunk and returns the blocks completed by it: a block is
+    complete when its outermost brace/bracket closes, or when the closing ``` fence arrives.
+    Call `finish()` once the stream ends to flush a trailing unterminated block.
+    `extract()` runs the same scan over a complete text in one go.
+    """
+    def __init__(self):
+        self.chunks: List[str] = [] # everything fed so far, see `text`
+        self.buffer = "" # unscanned text plus the open block; consumed text is trimmed off
+        self.pos = 0 # next character of buffer to scan
+        self.in_fence = False
+        self.in_string = False
+        self.escape = False
+        self.depth = 0
+        self.block_start: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.chunks.append(chunk)
+        self.buffer += chunk
+        # Hold back two characters so a ``` split across chunks is still seen whole
+        found = self._scan(len(self.buffer) - 2)
+        self._trim()
+        return [block for block, _ in found]
+
+    def finish(self) -> List[Dict[str, Any]]:
+        found = self._scan(len(self.buffer)) + self._flush()
+        return [block for block, _ in found]
+
+    @classmethod
+    def extract(cls, text: str) -> List[Dict[str, Any]]:
+        """One-shot scan of a complete text: the fenced blocks, or all raw blocks when nothing is fenced."""
+        extractor = cls()
+        extractor.chunks.append(text)
+        extractor.buffer = text
+        found = extractor._scan(len(text), _TolerantParser(text)) + extractor._flush()
+        fenced = [block for block, in_fence in found if in_fence]
+        if fenced:
+            return fenced
+        return [block for block, _ in found]
+
+    def _trim(self):
+        # Drop the scanned text no open block still needs, so the buffer stays about one block long
+        keep = self.pos if self.block_start is None else self.block_start
+        if keep:
+            self.buffer = self.buffer[keep:]
+            self.pos -= keep
+            if self.block_start is not None:
+                self.block_start -= keep
+
+    def _flush(self) -> List[Tuple[Dict[str, Any], bool]]:
+        found = []
+        if self.block_start is not None:
+            found = self._parse(self.buffer[self.block_start:])
+            self.block_start = None
+            self.depth = 0
+        return found
+
+    def _parse(self, block_text: str) -> List[Tuple[Dict[str, Any], bool]]:
         try:
-            data = repair_json(match)
-            if isinstance(data, list):
-                 json_blocks.extend(data)
-            elif isinstance(data, dict):
-                 json_blocks.append(data)
+            return [(block, self.in_fence) for block in parse_json_block(block_text)]
         except Exception as e:
-            print(f"Failed to parse a JSON block: {e}")
-            # print(f"Block content: {match[:100]}...")
-            
-    return json_blocks
+            # Bracketed prose outside code fences ("[Panel 1]") is expected to fail quietly
+            if self.in_fence:
+                logger.warning(f"Failed to parse a JSON block: {e}")
+            return []
+
+    def _scan(self, end: int, parser: Optional[_TolerantParser] = None) -> List[Tuple[Dict[str, Any], bool]]:
+        # With a parser over the whole text (one-shot), blocks are parsed where they start instead of
+        # being walked first; while streaming an open block would be re-parsed on every chunk
+        found = []
+        text = self.buffer
+        i = self.pos
+        while i < end:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    i += 1
+                    continue
+                m = _STRING_SPECIAL.search(text, i, end)
+                if not m:
+                    i = end
+                    break
+                i = m.start()
+                if text[i] == "\\":
+                    self.escape = True
+                else:
+                    self.in_string = False
+                i += 1
+                continue
+
+            # Jump straight to the next character that can change the block structure
+            m = _STRUCTURE_SPECIAL.search(text, i, end)
+            if not m:
+                i = end
+                break
+            i = m.start()
+            ch = text[i]
+            if ch == "`":
+                if not text.startswith("```", i):
+                    i += 1
+                    continue
+                # A closing fence ends the block even if its braces never balanced;
+                # an object left open in prose before an opening fence is dropped
+                if self.in_fence and self.block_start is not None:
+                    found.extend(self._parse(text[self.block_start:i]))
+                self.in_fence = not self.in_fence
+                self.depth = 0
+                self.block_start = None
+                i += 3
+                continue
+            if ch in "{[":
+                if self.depth == 0:
+                    if parser is not None:
+                        try:
+                            parsed = parser.scan(i) or parser.container(i)
+                        except ValueError:
+                            # Not JSON after all (bracketed prose): leave it to the walk below
+                            parsed = None
+                        if parsed is not None:
+                            found.extend((block, self.in_fence) for block in _dict_blocks(parsed[0]))
+                            i = parsed[1]
+                            continue
+                    self.block_start = i
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth > 0:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        found.extend(self._parse(text[self.block_start:i + 1]))
+                        self.block_start = None
+            elif self.depth > 0: # '"'
+                self.in_string = True
+            i += 1
+        self.pos = max(self.pos, i)
+        return found
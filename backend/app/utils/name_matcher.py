@@ -0,0 +1,78 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Set, Tuple
+
+class NameMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of names (character names and their short forms).
+    Build it once, then `find()` reports every name occurring in a text, overlapping ones
+    included, in a single left-to-right pass regardless of how many names there are.
+    """
+    def __init__(self, names: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[str]] = [[]]
+        self.names: List[str] = []
+        for name in names:
+            if name and name not in self.names:
+                self.names.append(name)
+                self._add(name)
+        self._build()
+        # While no partial match is in progress, jump straight to the next possible first character
+        first_chars = {name[0] for name in self.names}
+        self._starts = re.compile("[" + "".join(re.escape(c) for c in sorted(first_chars)) + "]") if first_chars else None
+
+    def _add(self, name: str):
+        state = 0
+        for ch in name:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][ch] = nxt
+            state = nxt
+        self.out[state].append(name)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state:
+                    f = self.fail[state]
+                    while f and ch not in self.goto[f]:
+                        f = self.fail[f]
+                    self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """All (start, end, name) occurrences in the text."""
+        hits = []
+        if not self._starts or not text:
+            return hits
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            if state == 0:
+                m = self._starts.search(text, i)
+                if not m:
+                    break
+                i = m.start()
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for name in out[state]:
+                hits.append((i + 1 - len(name), i + 1, name))
+            i += 1
+        return hits
+
+    def find(self, text: str) -> Set[str]:
+        """The set of names occurring in the text."""
+        return {name for _, _, name in self.find_all(text)}
+
@@ -0,0 +1,46 @@
+"""
+Task worker entry point. Runs queued generation tasks outside the API process.
+
+    python -m app.worker                 # one worker process
+    python -m app.worker --processes 4   # four worker processes
+
+Requires TASK_QUEUE_ENABLED=true for the API to enqueue instead of running tasks itself.
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+from app.core.database import engine, init_db
+from app.services.task_queue import run_worker
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Comic Generator task worker")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes to start")
+    parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+    args = parser.parse_args()
+
+    # Registers every table model before create_all/migrate
+    import app.routers.generation  # noqa: F401
+    init_db()
+
+    if args.processes <= 1:
+        run_worker(once=args.once)
+        return
+
+    # Children must not share the parent's pooled DB connections: close them here, and start
+    # the workers with "spawn" so each builds its own engine instead of inheriting sockets/files
+    engine.dispose()
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, kwargs={"once": args.once}, name=f"comic-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+
+if __name__ == "__main__":
+    main()
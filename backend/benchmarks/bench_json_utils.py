@@ -0,0 +1,128 @@
+"""
+Benchmarks extract_json_blocks against the previous regex + retry-repair implementation.
+
+    cd backend
+    python -m benchmarks.bench_json_utils                                # saved ai_output_*.txt files
+    python -m benchmarks.bench_json_utils static/<project>/temp/ai_output_1700000000.txt
+    python -m benchmarks.bench_json_utils --synthetic 200                # generated 200-panel storyboard
+
+Each input is also checked with some/all line-end commas removed: the old repair loop
+re-parsed the whole block once per missing comma (and gave up after 10).
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.json_utils import extract_json_blocks
+
+def legacy_repair_json(json_str):
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        pass
+    repaired_str = json_str
+    for _ in range(10):
+        try:
+            return json.loads(repaired_str)
+        except json.JSONDecodeError as e:
+            if "Expecting ',' delimiter" in str(e) or "Expecting property name enclosed in double quotes" in str(e):
+                match = re.search(r'([\"}\]0-9])\s*$', repaired_str[:e.pos])
+                if match:
+                    insert_idx = match.end()
+                    repaired_str = repaired_str[:insert_idx] + "," + repaired_str[insert_idx:]
+                    continue
+            raise e
+    return json.loads(repaired_str)
+
+def legacy_extract_json_blocks(text):
+    json_blocks = []
+    matches = re.findall(r"```(?:json|JSON)?\s*(.*?)\s*```", text, re.DOTALL)
+    if not matches:
+        matches = re.findall(r"(\{[\s\S]*?\}|\[[\s\S]*?\])", text)
+    for match in matches:
+        if not match.strip().startswith(("{", "[")):
+            continue
+        try:
+            data = legacy_repair_json(match)
+            if isinstance(data, list):
+                json_blocks.extend(data)
+            elif isinstance(data, dict):
+                json_blocks.append(data)
+        except Exception:
+            pass
+    return json_blocks
+
+def synthetic_storyboard(panels: int) -> str:
+    parts = ["Here is your comic.\n"]
+    parts.append("```json\n" + json.dumps({"type": "comic_config", "style": "Ink", "language": "English"}, indent=2) + "\n```\n")
+    for name in ("Alice", "Bob", "Carol"):
+        sheet = {"type": "character_sheet", "name": name, "meta_info": {"role": "Protagonist", "age": "20"},
+                 "design_panels": [{"view": v, "description": f"{name} {v} " * 20} for v in ("Front", "Side", "Clothing", "Accessories")]}
+        parts.append("```json\n" + json.dumps(sheet, indent=2, ensure_ascii=False) + "\n```\n")
+    for page in range(panels // 4):
+        block = {"type": "storyboard", "meta_info": {"volume": f"{page + 1}"}, "characters": ["Alice", "Bob"],
+                 "panels": [{"panel": page * 4 + k + 1, "scene": "A long scene description. " * 15,
+                             "dialogue": [{"speaker": "Alice", "text": "Hello there!"}]} for k in range(4)]}
+        parts.append("```json\n" + json.dumps(block, indent=2, ensure_ascii=False) + "\n```\n")
+    return "".join(parts)
+
+def strip_commas(text: str, every: int = 1) -> str:
+    # Drop every n-th comma at a line end: the "missing commas" failure mode
+    seen = 0
+    def drop(m):
+        nonlocal seen
+        seen += 1
+        return m.group(1) + m.group(2) if seen % every == 0 else m.group(0)
+    return re.sub(r'([}\]0-9"])\s*,(\s*\n)', drop, text)
+
+def bench(fn, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark a generated storyboard with this many panels")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    inputs = []
+    files = args.files or glob.glob(os.path.join("static", "*", "temp", "ai_output_*.txt"))
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            inputs.append((os.path.basename(path), f.read()))
+    if args.synthetic or not inputs:
+        panels = args.synthetic or 120
+        text = synthetic_storyboard(panels)
+        inputs.append((f"synthetic-{panels}", text))
+        # Same content as one big fenced array, the worst case for per-comma re-parsing
+        blocks = legacy_extract_json_blocks(text)
+        inputs.append((f"synthetic-{panels}-single-block", "```json\n" + json.dumps(blocks, indent=2, ensure_ascii=False) + "\n```\n"))
+
+    print(f"{'input':<44} {'size':>9} {'legacy ms':>10} {'blocks':>7} {'new ms':>9} {'blocks':>7} {'speedup':>8}")
+    for name, text in inputs:
+        variants = (
+            ("", text),
+            (" (1/8 commas missing)", strip_commas(text, 8)),
+            (" (1/400 commas missing)", strip_commas(text, 400)),
+            (" (no commas)", strip_commas(text)),
+        )
+        for variant, body in variants:
+            legacy_time, legacy_blocks = bench(legacy_extract_json_blocks, body, args.repeat)
+            new_time, new_blocks = bench(extract_json_blocks, body, args.repeat)
+            print(f"{(name + variant)[:44]:<44} {len(body):>9} {legacy_time * 1000:>10.2f} {len(legacy_blocks):>7} "
+                  f"{new_time * 1000:>9.2f} {len(new_blocks):>7} {legacy_time / new_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmarks concurrent task-log / progress writes against SQLite with the old engine setup
+(rollback journal, no busy timeout, default pool) and the tuned one from create_db_engine.
+
+    cd backend
+    python -m benchmarks.bench_sqlite_writes
+    python -m benchmarks.bench_sqlite_writes --threads 16 --batches 50 --batch-size 20
+
+Every thread mimics a background generation task: it appends a batch of TaskLog rows in one
+transaction (like TaskLogWriter.flush) and then commits a progress update on its Task row.
+Each profile runs against a fresh database file in a temp directory.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import SQLModel, Session, create_engine
+
+from app.core.database import create_db_engine
+from app.models.models import Project, Task, TaskLog
+
+def legacy_engine(url):
+    return create_engine(url, echo=False, connect_args={"check_same_thread": False})
+
+def run_profile(name, make_engine, threads, batches, batch_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = make_engine(url)
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            project = Project(title="bench")
+            session.add(project)
+            session.commit()
+            task_ids = []
+            for i in range(threads):
+                task = Task(project_id=project.id, type="image_generation", status="processing", name=f"task {i}")
+                session.add(task)
+                session.commit()
+                task_ids.append(task.id)
+
+        errors = []
+        written = [0] * threads
+        start_barrier = threading.Barrier(threads)
+
+        def worker(index):
+            task_id = task_ids[index]
+            start_barrier.wait()
+            for batch in range(batches):
+                try:
+                    with Session(engine) as session:
+                        session.add_all([
+                            TaskLog(task_id=task_id, message=f"[bench] batch {batch} line {line}")
+                            for line in range(batch_size)
+                        ])
+                        session.commit()
+                        task = session.get(Task, task_id)
+                        task.progress = int((batch + 1) / batches * 100)
+                        session.add(task)
+                        session.commit()
+                    written[index] += batch_size
+                except Exception as e:
+                    errors.append(str(e).splitlines()[0])
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+
+    total = sum(written)
+    print(f"{name:8s} {elapsed:8.2f}s  {total / elapsed:10.0f} lines/s  {threads * batches / elapsed:8.0f} tx pairs/s  "
+          f"{len(errors)} failed batches")
+    for message in sorted(set(errors))[:3]:
+        print(f"         e.g. {message}")
+    return elapsed, len(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batches", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.batches} batches x {args.batch_size} log lines")
+    before, _ = run_profile("legacy", legacy_engine, args.threads, args.batches, args.batch_size)
+    after, _ = run_profile("tuned", create_db_engine, args.threads, args.batches, args.batch_size)
+    print(f"speedup  {before / after:.2f}x")
+
+if __name__ == "__main__":
+    main()
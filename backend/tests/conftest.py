@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+# Point the app at a throwaway database before app.core.config is imported
+_test_dir = tempfile.mkdtemp(prefix="comic-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_test_dir, 'test.db')}"
+os.environ.setdefault("TASK_LOG_FLUSH_INTERVAL_SECONDS", "0.05")
+
+import pytest
+from sqlmodel import Session
+from app.core.database import engine, init_db
+from app.models.models import Project, Task
+import app.routers.generation  # noqa: F401 (registers every table model)
+
+init_db()
+
+@pytest.fixture
+def session():
+    with Session(engine) as session:
+        yield session
+
+@pytest.fixture
+def project(session):
+    project = Project(title="Test Comic", language="en-US")
+    session.add(project)
+    session.commit()
+    session.refresh(project)
+    return project
+
+@pytest.fixture
+def task(session, project):
+    task = Task(type="image_generation", status="processing", project_id=project.id, name="Test Task")
+    session.add(task)
+    session.commit()
+    session.refresh(task)
+    return task
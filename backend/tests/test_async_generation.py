@@ -0,0 +1,113 @@
+import asyncio
+import threading
+from app.cruds import crud_project
+from app.routers import generation
+from app.services.ai_service import AsyncAIService
+from app.services.generation_loop import generation_loop
+
+def test_iterate_consumes_an_async_generator_from_a_thread():
+    closed = []
+
+    async def numbers():
+        try:
+            for i in range(3):
+                await asyncio.sleep(0)
+                yield i
+        finally:
+            closed.append(True)
+
+    assert list(generation_loop.iterate(numbers())) == [0, 1, 2]
+    stream = generation_loop.iterate(numbers())
+    assert next(stream) == 0
+    stream.close()
+    assert closed == [True, True]
+
+def test_async_generation_keeps_blocking_work_off_the_loop(session, project, task, tmp_path, monkeypatch):
+    crud_project.merge_storyboard(session, project.id, [{"panel": i} for i in range(5)])
+    session.refresh(project)
+    call_threads = []
+    save_threads = []
+
+    async def fake_generate_image(self, prompt, context_images=None, aspect_ratio="16:9", resolution="2K"):
+        call_threads.append(threading.current_thread().name)
+        await asyncio.sleep(0.01)
+        return b"png"
+
+    def fake_save(session, project_id, entity_type, entity_id, image_bytes):
+        save_threads.append(threading.current_thread().name)
+        return f"/static/{project_id}/panels/{entity_id}.png"
+
+    monkeypatch.setattr(generation.settings, "ASYNC_GENERATION", True)
+    monkeypatch.setattr(AsyncAIService, "generate_image", fake_generate_image)
+    monkeypatch.setattr(generation, "save_generated_image", fake_save)
+
+    assert generation.render_panels(session, task, project, 2, str(tmp_path)) is True
+    assert len(call_threads) == 5
+    assert set(call_threads) == {"generation-loop"}
+    assert set(save_threads) == {threading.current_thread().name}
+    assert all(item.image_url for item in project.storyboard_items)
+
+def test_panel_task_runs_on_the_generation_loop_without_a_threadpool_thread(session, project, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.models.models import StoryboardItem, Task
+    from app.services import task_queue
+
+    item = StoryboardItem(project_id=project.id, sequence=1, data={"panel": 1})
+    session.add(item)
+    session.commit()
+    session.refresh(item)
+    call_threads = []
+    begin_threads = []
+    sync_runs = []
+
+    async def fake_generate_image(self, prompt, context_images=None, aspect_ratio="16:9", resolution="2K"):
+        call_threads.append(threading.current_thread().name)
+        return b"png"
+
+    begin_image_task = generation.begin_image_task
+    def recording_begin(*args):
+        begin_threads.append(threading.current_thread().name)
+        return begin_image_task(*args)
+
+    monkeypatch.setattr(generation.settings, "ASYNC_GENERATION", True)
+    monkeypatch.setattr(task_queue.settings, "TASK_QUEUE_ENABLED", False)
+    monkeypatch.setattr(AsyncAIService, "generate_image", fake_generate_image)
+    monkeypatch.setattr(generation, "begin_image_task", recording_begin)
+    monkeypatch.setattr(generation, "run_image_task", lambda *args: sync_runs.append(args))
+    monkeypatch.setattr(generation, "save_generated_image", lambda session, project_id, entity_type, entity_id, image_bytes: f"/static/{project_id}/panels/{entity_id}.png")
+
+    response = TestClient(app).post(f"/api/v1/generate/panel/{item.id}")
+    assert response.status_code == 200
+    task = session.get(Task, response.json()["task_id"])
+    session.refresh(task)
+    session.refresh(item)
+    assert task.status == "completed"
+    assert item.image_url == f"/static/{project.id}/panels/{item.id}.png"
+    assert sync_runs == []
+    assert call_threads == ["generation-loop"]
+    assert begin_threads and begin_threads[0] != "generation-loop"
+
+def test_failed_render_fails_the_single_image_task(session, project, monkeypatch):
+    from app.models.models import Character, Task
+    char = Character(project_id=project.id, name="Alice", data={"name": "Alice"})
+    task = Task(type="character_generation", status="pending", project_id=project.id)
+    session.add(char)
+    session.add(task)
+    session.commit()
+
+    def failing_render(**request):
+        raise RuntimeError("quota exceeded")
+    monkeypatch.setattr(generation, "render_image_now", failing_render)
+    generation.generate_character_task(task.id, char.id)
+    session.refresh(task)
+    assert task.status == "failed"
+    assert task.message == "quota exceeded"
+
+    missing = Task(type="image_generation", status="pending", project_id=project.id)
+    session.add(missing)
+    session.commit()
+    asyncio.run(generation.generate_panel_task_async(missing.id, 999999))
+    session.refresh(missing)
+    assert missing.status == "failed"
+    assert missing.message == "Storyboard item not found"
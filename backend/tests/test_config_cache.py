@@ -0,0 +1,67 @@
+from sqlalchemy import event, update
+from sqlmodel import Session
+from app.core.database import engine, seed_db
+from app.cruds import crud_config
+from app.models.models import ModelConfig, ModelConfigVersion
+from app.schemas.schemas import ModelConfigCreate
+
+def test_version_row_is_seeded_once(session):
+    seed_db()
+    seed_db()
+    assert session.get(ModelConfigVersion, 1) is not None
+
+def test_write_from_another_process_is_seen_on_the_next_lookup(session):
+    config = crud_config.create_model_config(session, ModelConfigCreate(
+        provider="google", api_key="old-key", model_name="m", model_type="cache-test"
+    ))
+    assert crud_config.get_active_config(session, "cache-test").api_key == "old-key"
+
+    # Another process revokes the key: it writes the row and bumps the version, but cannot
+    # invalidate this process's in-memory cache
+    with Session(engine) as other:
+        other.exec(update(ModelConfig).where(ModelConfig.id == config.id).values(api_key="new-key"))
+        other.exec(update(ModelConfigVersion).where(ModelConfigVersion.id == 1).values(version=ModelConfigVersion.version + 1))
+        other.commit()
+        crud_config.touch_config_stamp()
+    assert crud_config.get_active_config(session, "cache-test").api_key == "new-key"
+
+    crud_config.delete_model_config(session, session.get(ModelConfig, config.id))
+    assert crud_config.get_active_config(session, "cache-test") is None
+
+def count_config_statements(func):
+    # The task log writer thread shares the engine, so only config queries are counted
+    statements = []
+    listener = lambda *args: "modelconfig" in args[2].lower() and statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return result, statements
+
+def test_settled_stamp_skips_the_version_row(session, monkeypatch):
+    crud_config.create_model_config(session, ModelConfigCreate(
+        provider="google", api_key="key", model_name="m", model_type="stamp-test"
+    ))
+    monkeypatch.setattr(crud_config.settings, "CONFIG_STAMP_SETTLE_SECONDS", 0)
+    crud_config.get_active_config(session, "stamp-test")
+
+    config, statements = count_config_statements(lambda: crud_config.get_active_config(session, "stamp-test"))
+    assert config.api_key == "key"
+    assert statements == []
+
+def test_commit_without_final_touch_is_seen_while_the_stamp_is_recent(session, monkeypatch):
+    monkeypatch.setattr(crud_config.settings, "CONFIG_STAMP_SETTLE_SECONDS", 60)
+    config = crud_config.create_model_config(session, ModelConfigCreate(
+        provider="google", api_key="old-key", model_name="m", model_type="crash-test"
+    ))
+    assert crud_config.get_active_config(session, "crash-test").api_key == "old-key"
+
+    # The other writer touches the stamp and commits, then dies before its final touch
+    with Session(engine) as other:
+        other.exec(update(ModelConfig).where(ModelConfig.id == config.id).values(api_key="new-key"))
+        crud_config._bump_config_version(other)
+        other.commit()
+    config, statements = count_config_statements(lambda: crud_config.get_active_config(session, "crash-test"))
+    assert config.api_key == "new-key"
+    assert any("modelconfigversion" in statement.lower() for statement in statements)
@@ -0,0 +1,48 @@
+import io
+import os
+from PIL import Image
+from app.services import context_image_cache as cic
+from app.services.ai_service import AIService
+from app.services.context_image_cache import ContextUploadMetrics, prepare_context_image
+
+def save_noise(path, mode, size):
+    img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).convert(mode)
+    if mode == "RGBA":
+        img.putalpha(Image.new("L", size, 0))
+    img.save(path)
+    return path
+
+def test_opaque_images_are_downscaled_to_jpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_FORMAT", "JPEG")
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_MAX_EDGE", 64)
+    path = save_noise(tmp_path / "panel.png", "RGB", (256, 128))
+    data, mime_type, original_size = prepare_context_image(str(path))
+    assert mime_type == "image/jpeg"
+    assert original_size == os.path.getsize(path)
+    assert Image.open(io.BytesIO(data)).size == (64, 32)
+
+def test_transparent_images_stay_png(tmp_path, monkeypatch):
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_FORMAT", "JPEG")
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_MAX_EDGE", 64)
+    path = save_noise(tmp_path / "sheet.png", "RGBA", (256, 128))
+    data, mime_type, _ = prepare_context_image(str(path))
+    assert mime_type == "image/png"
+    img = Image.open(io.BytesIO(data))
+    assert img.size == (64, 32)
+    assert img.mode == "RGBA" and img.getextrema()[3] == (0, 0)
+
+def test_every_call_records_its_upload_sizes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_FORMAT", "JPEG")
+    monkeypatch.setattr(cic.settings, "CONTEXT_IMAGE_MAX_EDGE", 64)
+    metrics = ContextUploadMetrics()
+    monkeypatch.setattr("app.services.ai_service.context_upload_metrics", metrics)
+    paths = [str(save_noise(tmp_path / f"{i}.png", "RGB", (200, 200))) for i in range(2)]
+
+    AIService()._build_image_contents("image-model", "prompt", paths)
+    AIService()._build_image_contents("image-model", "prompt", paths[:1])
+    snapshot = metrics.snapshot()
+    assert [call["files"] for call in snapshot["recent"]] == [2, 1]
+    first = snapshot["recent"][0]
+    assert first["original_bytes"] == sum(os.path.getsize(p) for p in paths)
+    assert first["saved_bytes"] == first["original_bytes"] - first["upload_bytes"] > 0
+    assert snapshot["totals"]["calls"] == 2
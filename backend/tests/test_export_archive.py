@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import zipfile
+import pytest
+from PIL import Image
+from app.models.models import Character, StoryboardItem
+from app.services import export_archive
+from app.services.image_service import split_comic_page_file
+
+@pytest.fixture
+def static_project(session, project, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_archive, "base_dir", str(tmp_path))
+    os.makedirs(tmp_path / "static" / project.id)
+    session.add(Character(project_id=project.id, name="Alice", image_url=write_png(tmp_path, project.id, "alice", "red")))
+    for sequence in (1, 2, 3):
+        url = write_png(tmp_path, project.id, f"page{sequence}", "blue")
+        session.add(StoryboardItem(project_id=project.id, sequence=sequence, data={}, image_url=url))
+    session.commit()
+    session.refresh(project)
+    return project
+
+def write_png(tmp_path, project_id, name, color):
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buf, format="PNG")
+    (tmp_path / "static" / project_id / f"{name}.png").write_bytes(buf.getvalue())
+    return f"/static/{project_id}/{name}.png"
+
+def build(project, split_images=True):
+    manifest = export_archive.load_manifest(project.id, split_images)
+    entries = export_archive.collect_export_entries(project, manifest)
+    body = b"".join(export_archive.iter_export_archive(project.id, split_images, entries, manifest))
+    return body, export_archive.load_manifest(project.id, split_images)
+
+def count_splits(monkeypatch, fail=()):
+    calls = []
+    def fake_split(path):
+        calls.append(os.path.basename(path))
+        return [] if os.path.basename(path) in fail else split_comic_page_file(path)
+    monkeypatch.setattr(export_archive, "split_comic_page_file", fake_split)
+    return calls
+
+def test_manifest_is_stored_inside_the_published_archive(static_project):
+    body, manifest = build(static_project)
+    zip_path = export_archive.archive_path(static_project.id, True)
+    with open(zip_path, "rb") as f:
+        assert f.read() == body
+    with zipfile.ZipFile(zip_path) as archive:
+        names = archive.namelist()
+        assert json.loads(archive.read(export_archive.MANIFEST_NAME)) == manifest
+    assert names[-1] == export_archive.MANIFEST_NAME
+    assert "characters/Alice.png" in names and "panels/panel_3_4.png" in names
+    assert [e["name"] for e in manifest["entries"]] == ["characters/Alice.png", "comic_part_1.png", "comic_part_2.png", "comic_part_3.png"]
+    assert [f for f in os.listdir(os.path.dirname(zip_path)) if f.endswith(".tmp")] == []
+
+    entries = export_archive.collect_export_entries(static_project, manifest)
+    assert export_archive.is_up_to_date(manifest, entries)
+    assert export_archive.pages_to_split(entries, manifest) == []
+
+def test_only_changed_pages_are_split_again(static_project, tmp_path, monkeypatch):
+    build(static_project)
+    calls = count_splits(monkeypatch)
+    write_png(tmp_path, static_project.id, "page2", "green")
+
+    _, manifest = build(static_project)
+    assert calls == ["page2.png"]
+    assert all(len(e["panels"]) == 4 for e in manifest["entries"] if e["sequence"])
+
+def test_failed_split_is_not_recorded_and_is_retried(static_project, monkeypatch):
+    calls = count_splits(monkeypatch, fail={"page2.png"})
+    _, manifest = build(static_project)
+    page2 = next(e for e in manifest["entries"] if e["name"] == "comic_part_2.png")
+    assert "panels" not in page2
+
+    entries = export_archive.collect_export_entries(static_project, manifest)
+    assert not export_archive.is_up_to_date(manifest, entries)
+    assert [p["name"] for p in export_archive.pages_to_split(entries, manifest)] == ["comic_part_2.png"]
+
+    calls = count_splits(monkeypatch)
+    _, manifest = build(static_project)
+    assert calls == ["page2.png"]
+    assert export_archive.is_up_to_date(manifest, export_archive.collect_export_entries(static_project, manifest))
+
+def test_a_build_started_earlier_does_not_overwrite_a_newer_one(static_project, tmp_path):
+    entries = export_archive.collect_export_entries(static_project)
+    older = export_archive.iter_export_archive(static_project.id, True, entries)
+    next(older)
+
+    write_png(tmp_path, static_project.id, "page1", "green")
+    _, newer = build(static_project)
+    for _ in older:
+        pass
+    assert export_archive.load_manifest(static_project.id, True) == newer
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+def test_download_never_splits_pages_on_the_request(static_project, client, monkeypatch):
+    from app.routers import export
+    dispatched = []
+    monkeypatch.setattr(export, "dispatch_task", lambda background_tasks, session, task, handler, *args: dispatched.append((task.id, args)))
+    calls = count_splits(monkeypatch)
+    url = f"/api/v1/export/{static_project.id}/archive.zip"
+
+    pending = client.get(url, params={"split_images": True})
+    assert pending.status_code == 202
+    assert pending.headers["retry-after"] == "2"
+    task_id = pending.json()["task_id"]
+    assert dispatched == [(task_id, (static_project.id, True))]
+    # The dialog's export request and repeated downloads wait for the same task
+    assert client.get(url, params={"split_images": True}).json()["task_id"] == task_id
+    assert client.get(f"/api/v1/export/{static_project.id}", params={"split_images": True}).json()["task_id"] == task_id
+    assert len(dispatched) == 1 and calls == []
+
+    # Exports without splitting still stream right away
+    plain = client.get(url, params={"split_images": False})
+    assert plain.status_code == 200
+    assert "comic_part_1.png" in zipfile.ZipFile(io.BytesIO(plain.content)).namelist()
+
+    body, _ = build(static_project)
+    calls.clear()
+    done = client.get(url, params={"split_images": True})
+    assert done.status_code == 200 and done.content == body
+    assert calls == []
+
+def test_an_export_task_left_behind_by_a_restart_is_replaced(static_project, client, session, monkeypatch):
+    from datetime import datetime, timedelta
+    from app.models.models import Task
+    from app.routers import export
+    dispatched = []
+    monkeypatch.setattr(export, "dispatch_task", lambda background_tasks, session, task, handler, *args: dispatched.append(task.id))
+    # The process running it died mid-split: the row stays "processing" with no more progress
+    orphan = Task(type="export", status="processing", project_id=static_project.id, name="Export Comic",
+                  updated_at=datetime.utcnow() - timedelta(seconds=export.settings.EXPORT_TASK_STALE_SECONDS + 1))
+    session.add(orphan)
+    session.commit()
+
+    pending = client.get(f"/api/v1/export/{static_project.id}/archive.zip", params={"split_images": True})
+    assert pending.status_code == 202
+    assert pending.json()["task_id"] != orphan.id and dispatched == [pending.json()["task_id"]]
+    session.refresh(orphan)
+    assert orphan.status == "failed"
@@ -0,0 +1,65 @@
+import json
+from app.utils.json_utils import JsonBlockStreamExtractor, extract_json_blocks
+
+STORYBOARD = (
+    "Sure! Here is the comic.\n"
+    "```json\n" + json.dumps({"type": "comic_config", "style": "Ink"}) + "\n```\n"
+    "Some prose with a [bracket] in it.\n"
+    "```json\n" + json.dumps([{"panel": 1, "scene": "A \\\"quoted\\\" } brace"}, {"panel": 2}], indent=2) + "\n```\n"
+    "```json\n" + json.dumps({"panel": 3, "dialogue": [{"speaker": "Bob", "text": "```"}]}) + "\n```\n"
+)
+
+def stream(text, size):
+    extractor = JsonBlockStreamExtractor()
+    blocks = []
+    for start in range(0, len(text), size):
+        blocks += extractor.feed(text[start:start + size])
+    blocks += extractor.finish()
+    return extractor, blocks
+
+def test_streaming_matches_one_shot_for_any_chunk_size():
+    expected = extract_json_blocks(STORYBOARD)
+    assert [b.get("panel", b.get("type")) for b in expected] == ["comic_config", 1, 2, 3]
+    for size in (1, 2, 3, 7, 64, len(STORYBOARD)):
+        extractor, blocks = stream(STORYBOARD, size)
+        assert blocks == expected
+        assert extractor.text == STORYBOARD
+
+def test_blocks_are_returned_as_soon_as_they_close():
+    extractor = JsonBlockStreamExtractor()
+    assert extractor.feed('```json\n{"panel": 1, "scene": "a"') == []
+    assert extractor.feed('}\n{"panel": 2') == [{"panel": 1, "scene": "a"}]
+    assert extractor.feed("}\n```\n") == [{"panel": 2}]
+    assert extractor.finish() == []
+
+def test_unterminated_block_is_flushed_on_finish():
+    extractor = JsonBlockStreamExtractor()
+    assert extractor.feed('```json\n{"panel": 1, "scene": "cut off') == []
+    assert extractor.finish() == [{"panel": 1, "scene": "cut off"}]
+
+def test_buffer_only_holds_the_open_block():
+    block = "```json\n" + json.dumps({"panel": 1, "scene": "x" * 200}) + "\n```\n"
+    extractor = JsonBlockStreamExtractor()
+    found = []
+    for _ in range(50):
+        for start in range(0, len(block), 16):
+            found += extractor.feed(block[start:start + 16])
+            assert len(extractor.buffer) <= len(block)
+    assert len(found) == 50
+    assert len(extractor.text) == 50 * len(block)
+
+def test_one_shot_repairs_missing_and_trailing_commas():
+    text = '```json\n{"type": "storyboard", "panels": [\n {"panel": 1 "scene": "a",},\n {"panel": 2,, "scene": "b"}\n ],}\n```'
+    assert extract_json_blocks(text) == [{"type": "storyboard", "panels": [{"panel": 1, "scene": "a"}, {"panel": 2, "scene": "b"}]}]
+
+def test_one_shot_keeps_nested_objects_and_fills_missing_values():
+    text = '```json\n[{"meta_info": {"volume": "1" "style": {"ink": true}}, "characters": ["A" "B"], "mood": }]\n```'
+    assert extract_json_blocks(text) == [{"meta_info": {"volume": "1", "style": {"ink": True}}, "characters": ["A", "B"], "mood": None}]
+
+def test_one_shot_closes_blocks_at_unbalanced_fences():
+    text = '```json\n{"panel": 1, "scene": {"place": "road"\n```\ntext\n```json\n{"panel": 2}}\n```\n```json\n{"panel": 3'
+    assert extract_json_blocks(text) == [{"panel": 1, "scene": {"place": "road"}}, {"panel": 2}, {"panel": 3}]
+
+def test_one_shot_prefers_fenced_blocks_over_raw_ones():
+    assert extract_json_blocks('See [Panel 1] and {"raw": 1}\n```json\n{"fenced": 1}\n```') == [{"fenced": 1}]
+    assert extract_json_blocks('See [Panel 1] and {"raw": 1} then [{"raw": 2}]') == [{"raw": 1}, {"raw": 2}]
@@ -0,0 +1,30 @@
+import re
+from app.routers.generation import find_missing_characters
+from app.services.consistency_service import build_character_registry
+from app.utils.name_matcher import NameMatcher
+
+def naive_find_all(names, text):
+    return sorted((m.start(), m.start() + len(name), name) for name in set(names) if name for m in re.finditer(f"(?={re.escape(name)})", text))
+
+def test_find_all_reports_overlapping_and_nested_names():
+    names = ["he", "she", "his", "hers", "Ming", "Xiao Ming"]
+    text = "ushers said Xiao Ming met his sheep"
+    assert sorted(NameMatcher(names).find_all(text)) == naive_find_all(names, text)
+    assert NameMatcher(names).find(text) == {"he", "she", "hers", "his", "Ming", "Xiao Ming"}
+
+def test_matches_non_ascii_names_and_ignores_empty_ones():
+    matcher = NameMatcher(["", "小明", "王老师", "小明"])
+    assert matcher.names == ["小明", "王老师"]
+    assert matcher.find("王老师叫小明回家") == {"小明", "王老师"}
+    assert NameMatcher([]).find("anything") == set()
+    assert matcher.find("") == set()
+
+def test_character_registry_maps_short_forms_to_full_names():
+    known, matcher = build_character_registry(["Ma (Butler)", "Alice", ""])
+    assert known == {"Ma (Butler)": "Ma (Butler)", "Ma": "Ma (Butler)", "Alice": "Alice"}
+    assert {known[name] for name in matcher.find("Ma pours tea for Alice")} == {"Ma (Butler)", "Alice"}
+
+def test_missing_characters_match_names_in_either_direction():
+    char_blocks = [{"name": "Ming"}, {"name": "Professor Oak"}]
+    story_blocks = [{"characters": ["Xiao Ming", "Oak", {"name": "Brock"}, "X"]}, {"characters": "Misty"}]
+    assert sorted(find_missing_characters(char_blocks, story_blocks)) == ["Brock", "Misty"]
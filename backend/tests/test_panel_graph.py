@@ -0,0 +1,63 @@
+import threading
+import time
+from app.cruds import crud_project
+from app.routers import generation
+from app.routers.generation import panel_context_dependencies, render_panels
+
+def test_sequential_window_is_first_plus_last_two():
+    deps = panel_context_dependencies(6, lag=1)
+    assert deps[0] == []
+    assert deps[1] == [0]
+    assert deps[2] == [0, 1]
+    assert deps[5] == [0, 3, 4]
+
+def test_larger_lag_only_depends_on_older_panels():
+    lag = 3
+    deps = panel_context_dependencies(12, lag=lag)
+    for i, panel_deps in enumerate(deps):
+        assert len(panel_deps) == len(set(panel_deps))
+        assert all(d == 0 or d <= i - lag for d in panel_deps)
+    # The first `lag` panels after the opening one can start together
+    assert deps[1] == deps[2] == deps[3] == [0]
+
+def test_render_panels_respects_dependencies_and_concurrency(session, project, task, tmp_path, monkeypatch):
+    crud_project.merge_storyboard(session, project.id, [{"panel": i} for i in range(8)])
+    session.refresh(project)
+    items = sorted(project.storyboard_items, key=lambda x: x.sequence)
+    path_to_panel = {}
+    rendered = []
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_save(session, project_id, entity_type, entity_id, image_bytes):
+        url = f"/static/{project_id}/panels/{entity_id}.png"
+        path_to_panel[generation.resolve_static_path(str(tmp_path), url)] = entity_id
+        return url
+
+    def fake_render(prompt, context_images, aspect_ratio, resolution):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+            # Every history image must belong to a panel that is already saved
+            assert all(path_to_panel[p] in rendered for p in context_images)
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return b"png"
+
+    original_save_panel = generation.save_panel_result
+    def save_panel(session, task, project, item, image_bytes, completed, total_items, base_dir):
+        path = original_save_panel(session, task, project, item, image_bytes, completed, total_items, base_dir)
+        rendered.append(item.id)
+        return path
+
+    monkeypatch.setattr(generation, "save_generated_image", fake_save)
+    monkeypatch.setattr(generation, "render_image", fake_render)
+    monkeypatch.setattr(generation, "save_panel_result", save_panel)
+
+    assert render_panels(session, task, project, 3, str(tmp_path)) is True
+    assert sorted(rendered) == sorted(item.id for item in items)
+    assert max(peak) <= 3
+    assert max(peak) > 1
+    assert task.checkpoint["panels"] == {str(item.id): "done" for item in items}
@@ -0,0 +1,34 @@
+import os
+from app.services.result_cache import ResultCache
+
+def test_scans_only_on_first_write_and_when_over_the_limit(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=1000)
+    scans = []
+    original_scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or original_scan())
+
+    for i in range(4):
+        cache.put(f"{i:064x}", b"x" * 200)
+    assert len(scans) == 1
+    assert cache.total_bytes == 800
+
+    # Rewriting a key replaces its size instead of adding to it
+    cache.put(f"{0:064x}", b"x" * 100)
+    assert cache.total_bytes == 700
+    assert len(scans) == 1
+
+    cache.put(f"{9:064x}", b"x" * 400)
+    assert len(scans) == 2
+    assert cache.total_bytes <= 900
+
+def test_evicts_least_recently_used_first(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=700)
+    keys = [f"{i:064x}" for i in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, b"x" * 200)
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    # Reading marks an entry as recently used
+    assert cache.get(keys[0]) == b"x" * 200
+    cache.put(f"{7:064x}", b"x" * 200)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
@@ -0,0 +1,121 @@
+import json
+from sqlalchemy import update
+from sqlmodel import Session, select
+from app.core.database import engine
+from app.cruds import crud_project
+from app.models.models import StoryboardItem, Task
+from app.routers import generation
+
+def render_all(session, project_id):
+    items = session.exec(select(StoryboardItem).where(StoryboardItem.project_id == project_id)).all()
+    for item in items:
+        item.image_url = f"/static/{project_id}/panels/{item.id}.png"
+        session.add(item)
+    session.commit()
+    return {item.data.get("panel"): item.id for item in items}
+
+def panels(session, project_id):
+    statement = select(StoryboardItem).where(StoryboardItem.project_id == project_id).order_by(StoryboardItem.sequence, StoryboardItem.id)
+    return [(item.sequence, item.data.get("panel"), item.image_url is not None) for item in session.exec(statement).all()]
+
+def test_streamed_blocks_are_upserted_one_at_a_time(session, project, task, monkeypatch):
+    crud_project.merge_storyboard(session, project.id, [{"panel": i} for i in (1, 2, 3)])
+    ids = render_all(session, project.id)
+    merge_storyboard = crud_project.merge_storyboard
+    merges = []
+    monkeypatch.setattr(crud_project, "merge_storyboard", lambda *args, **kwargs: merges.append(args))
+
+    streamed = generation.new_stream_state()
+    for block in ({"panel": 3}, {"panel": 9}, {"panel": 1}):
+        generation.persist_streamed_block(session, task, project, block, streamed)
+
+    assert merges == []
+    # Panel 3 and 1 moved with their images, panel 9 is new; panel 2 is left for the final merge
+    assert panels(session, project.id) == [(1, 3, True), (2, 2, True), (2, 9, False), (3, 1, True)]
+
+    _, stale = merge_storyboard(session, project.id, streamed["story"])
+    assert panels(session, project.id) == [(1, 3, True), (2, 9, False), (3, 1, True)]
+    assert ids[2] not in stale and len(stale) == 1
+    session.expire_all()
+    assert session.get(StoryboardItem, ids[3]).sequence == 1
+    assert session.get(StoryboardItem, ids[1]).sequence == 3
+
+def run_streaming_task(session, project, task, monkeypatch, chunks):
+    monkeypatch.setattr(generation.settings, "STORYBOARD_STREAMING", True)
+    monkeypatch.setattr(generation, "save_raw_ai_output", lambda *args: None)
+    monkeypatch.setattr(generation, "stream_storyboard_text", lambda *args: chunks())
+    generation.generate_storyboard_task(task.id, project.id, "A story")
+    session.expire_all()
+    return session.get(Task, task.id)
+
+def fenced(block):
+    return "```json\n" + json.dumps(block) + "\n```\n"
+
+def test_cancelling_mid_stream_puts_the_storyboard_back(session, project, task, monkeypatch):
+    crud_project.merge_storyboard(session, project.id, [{"panel": i} for i in (1, 2, 3)])
+    ids = render_all(session, project.id)
+    before = panels(session, project.id)
+
+    def chunks():
+        yield fenced({"panel": 3})
+        yield fenced({"panel": 9})
+        with Session(engine) as other:
+            other.exec(update(Task).where(Task.id == task.id).values(status="cancelled"))
+            other.commit()
+        yield fenced({"panel": 1})
+
+    assert run_streaming_task(session, project, task, monkeypatch, chunks).status == "cancelled"
+    assert panels(session, project.id) == before
+    assert {item.id for item in session.exec(select(StoryboardItem).where(StoryboardItem.project_id == project.id))} == set(ids.values())
+
+def test_a_stream_that_fails_midway_puts_the_storyboard_back(session, project, task, monkeypatch):
+    crud_project.merge_storyboard(session, project.id, [{"panel": i} for i in (1, 2, 3)])
+    render_all(session, project.id)
+    before = panels(session, project.id)
+
+    def chunks():
+        yield fenced({"panel": 2})
+        yield fenced({"panel": 9})
+        raise RuntimeError("connection reset")
+
+    task = run_streaming_task(session, project, task, monkeypatch, chunks)
+    assert task.status == "failed" and "connection reset" in task.message
+    assert panels(session, project.id) == before
+
+def storyboard_output():
+    config = {"type": "comic_config", "style": "Ink", "layout_settings": {"gutter": 4}}
+    chars = [{"type": "character_sheet", "name": "Alice"}, {"type": "character_sheet", "name": "Ma (Butler)"}]
+    story = [
+        {"type": "storyboard", "characters": ["Alice"], "plot_breakdown": ["Alice rings for Ma."]},
+        {"type": "storyboard", "characters": [], "plot_breakdown": ["Ma (Butler) brings tea."], "meta_info": {"volume": "2"}},
+        {"type": "storyboard", "characters": ["Alice"], "plot_breakdown": ["Alice drinks it."]},
+    ]
+    return [config] + chars + story, chars, story
+
+def test_applying_the_same_storyboard_twice_keeps_every_image(session, project):
+    project.language = None
+    session.add(project)
+    session.commit()
+
+    json_blocks, chars, story = storyboard_output()
+    assert len(generation.apply_storyboard_output(session, project, json_blocks, chars, story)) == 3
+    render_all(session, project.id)
+
+    json_blocks, chars, story = storyboard_output()
+    assert generation.apply_storyboard_output(session, project, json_blocks, chars, story) == []
+    assert [has_image for _, _, has_image in panels(session, project.id)] == [True, True, True]
+    items = session.exec(select(StoryboardItem).where(StoryboardItem.project_id == project.id).order_by(StoryboardItem.sequence)).all()
+    assert [item.data["characters"] for item in items] == [["Alice", "Ma (Butler)"], ["Ma (Butler)"], ["Alice"]]
+    assert [item.data["meta_info"]["volume"] for item in items] == ["1/3", "2/3", "3/3"]
+    assert {item.data["meta_info"]["language"] for item in items} == {"English"}
+
+def test_a_changed_panel_is_the_only_stale_one(session, project):
+    json_blocks, chars, story = storyboard_output()
+    generation.apply_storyboard_output(session, project, json_blocks, chars, story)
+    render_all(session, project.id)
+
+    json_blocks, chars, story = storyboard_output()
+    story[1]["plot_breakdown"] = ["Ma (Butler) spills the tea."]
+    stale = generation.apply_storyboard_output(session, project, json_blocks, chars, story)
+    assert [has_image for _, _, has_image in panels(session, project.id)] == [True, False, True]
+    assert len(stale) == 1
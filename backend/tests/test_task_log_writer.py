@@ -0,0 +1,36 @@
+from sqlmodel import create_engine
+import app.core.database as database
+from app.services.task_log_service import TaskLogWriter, count_task_logs
+
+def test_indices_continue_after_stored_lines(session, task):
+    writer = TaskLogWriter()
+    assert [writer.append(task.id, f"line {i}") for i in range(3)] == [0, 1, 2]
+    writer.flush()
+    assert count_task_logs(session, task.id) == 3
+    # Another process (a fresh writer) picks up where the table ends
+    other = TaskLogWriter()
+    assert other.append(task.id, "line 3") == 3
+    other.flush()
+
+def test_failed_flush_keeps_the_batch(session, task, tmp_path, monkeypatch):
+    writer = TaskLogWriter()
+    writer.append(task.id, "first")
+    writer.append(task.id, "second")
+    monkeypatch.setattr(database, "engine", create_engine(f"sqlite:///{tmp_path}/missing/dir/db.sqlite"))
+    writer.flush()
+    assert [line for _, _, line in writer.buffer] == ["first", "second"]
+    monkeypatch.undo()
+    writer.flush()
+    assert writer.buffer == []
+    assert count_task_logs(session, task.id) == 2
+
+def test_idle_counters_are_evicted_and_reseeded(session, task):
+    writer = TaskLogWriter()
+    writer.append(task.id, "a")
+    writer.COUNT_IDLE_SECONDS = 0
+    writer.flush()
+    assert task.id not in writer.line_counts
+    assert writer.append(task.id, "b") == 1
+    # A counter with lines still buffered is kept
+    writer._evict_idle_counts()
+    assert writer.line_counts[task.id] == 2
@@ -0,0 +1,77 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import delete, update
+from sqlmodel import Session
+from app.core.database import engine
+from app.models.models import Task
+from app.services import task_queue
+from app.services.task_queue import LeaseLostError, claim_next_task, requeue_expired_tasks, run_claimed_task
+
+@pytest.fixture
+def queued(session, project):
+    session.exec(delete(Task).where(Task.handler.is_not(None)))
+    session.commit()
+
+    def make(minutes_ago=0, **values):
+        values.setdefault("status", "pending")
+        task = Task(type="test", project_id=project.id, handler="noop",
+                    created_at=datetime.utcnow() - timedelta(minutes=minutes_ago), **values)
+        session.add(task)
+        session.commit()
+        return task.id
+    return make
+
+def test_claims_oldest_first_and_each_task_once(session, queued):
+    newer = queued(minutes_ago=1)
+    older = queued(minutes_ago=5)
+    first = claim_next_task(session, "worker-a")
+    second = claim_next_task(session, "worker-b")
+    assert (first.id, second.id) == (older, newer)
+    assert first.lease_owner == "worker-a" and first.attempts == 1
+    assert claim_next_task(session, "worker-c") is None
+
+def test_expired_lease_is_requeued_then_failed_after_max_attempts(session, queued, monkeypatch):
+    monkeypatch.setattr(task_queue.settings, "TASK_MAX_ATTEMPTS", 2)
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    retry = queued(status="processing", lease_owner="dead", lease_expires_at=expired, attempts=1)
+    give_up = queued(status="processing", lease_owner="dead", lease_expires_at=expired, attempts=2)
+    alive = queued(status="processing", lease_owner="live", lease_expires_at=datetime.utcnow() + timedelta(minutes=1), attempts=1)
+
+    assert requeue_expired_tasks(session) == 1
+    session.expire_all()
+    assert (session.get(Task, retry).status, session.get(Task, retry).lease_owner) == ("pending", None)
+    assert session.get(Task, give_up).status == "failed"
+    assert session.get(Task, alive).status == "processing"
+    assert claim_next_task(session, "worker-b").id == retry
+
+def test_handler_cannot_commit_after_losing_its_lease(session, queued, monkeypatch):
+    task_id = queued()
+    claim_next_task(session, "worker-a")
+    seen = {}
+
+    def steal_lease(task_id):
+        with Session(engine) as other:
+            other.exec(update(Task).where(Task.id == task_id).values(lease_owner="worker-b"))
+            other.commit()
+
+    def handler(task_id):
+        with Session(engine) as own:
+            task = own.get(Task, task_id)
+            task.progress = 10
+            own.commit()
+            # The lease expires and another worker claims the task
+            other = threading.Thread(target=steal_lease, args=(task_id,))
+            other.start()
+            other.join()
+            task.progress = 50
+            with pytest.raises(LeaseLostError):
+                own.commit()
+            seen["stopped"] = True
+
+    monkeypatch.setattr(task_queue, "resolve_handler", lambda name: handler)
+    run_claimed_task(task_id, "noop", [], "worker-a")
+    assert seen["stopped"]
+    session.expire_all()
+    task = session.get(Task, task_id)
+    assert (task.progress, task.lease_owner) == (10, "worker-b")
@@ -0,0 +1,58 @@
+import threading
+from app.services import ai_service
+from app.services.ai_service import AIService, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_burst_is_free_then_requests_are_spaced(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ai_service.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_minute=60, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Each further reservation goes one more token into debt (1 token per second)
+    assert bucket.reserve() == 1.0
+    assert bucket.reserve() == 2.0
+
+def test_tokens_refill_up_to_capacity(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ai_service.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 1.5
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.5
+    clock.now += 3600
+    assert bucket.tokens <= 2
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+
+def test_concurrent_reservations_never_share_a_slot(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ai_service.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_minute=120, capacity=1)
+    delays = []
+    lock = threading.Lock()
+
+    def reserve():
+        delay = bucket.reserve()
+        with lock:
+            delays.append(delay)
+
+    threads = [threading.Thread(target=reserve) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(delays) == [i * 0.5 for i in range(20)]
+
+def test_rate_limit_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(AIService, "_rate_limiters", {})
+    assert AIService._get_rate_limiter("google") is None
+    monkeypatch.setattr(ai_service.settings, "PROVIDER_REQUESTS_PER_MINUTE", 30)
+    limiter = AIService._get_rate_limiter("Google")
+    assert limiter is AIService._get_rate_limiter("google")